@@ -0,0 +1,253 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List
+import numpy as np
+import pandas as pd
+
+import parallel
+from data_loader import is_polars, load_pandas, load_polars
+from metrics import rolling_pandas, rolling_polars
+from result_cache import RESULT_CACHE_DIRNAME, ResultCache, file_fingerprint
+from portfolio import (aggregate_portfolio_sequential, aggregate_portfolio_parallel, aggregate_portfolio_flat,
+                       compile_portfolio, evaluate_compiled)
+from workers import POLARS_PRELOAD, WorkerPool
+
+if TYPE_CHECKING:
+    import polars as pl
+
+# ---------- synthetic data ----------
+def generate_market_data(n_symbols: int = 3, n_rows: int = 300_000, seed: int = 0,
+                         start: str = "2024-01-01 09:30:00", freq: str = "1s") -> pd.DataFrame:
+    """
+    Deterministic tick panel with columns timestamp, symbol, price: `n_rows`
+    rows in total, symbols interleaved on a common clock, geometric random-walk
+    prices. Same arguments always give the same frame.
+    """
+    rng = np.random.default_rng(seed)
+    per_symbol = -(-n_rows // n_symbols)
+    symbols = np.array([f"S{i:04d}" for i in range(n_symbols)])
+    ts = pd.date_range(start, periods=per_symbol, freq=freq)
+
+    p0 = rng.uniform(20.0, 500.0, n_symbols)
+    steps = rng.normal(0.0, 1e-3, (per_symbol, n_symbols))
+    prices = np.round(p0 * np.exp(np.cumsum(steps, axis=0)), 2)
+
+    df = pd.DataFrame({
+        "timestamp": np.repeat(ts.to_numpy(), n_symbols),
+        "symbol": np.tile(symbols, per_symbol),
+        "price": prices.ravel(),
+    })
+    return df.iloc[:n_rows].reset_index(drop=True)
+
+
+def write_market_csv(path, **kwargs) -> str:
+    df = generate_market_data(**kwargs)
+    df.to_csv(path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    return os.fspath(path)
+
+
+def generate_portfolio(symbols: List[str], depth: int = 2, width: int = 2,
+                       positions_per_node: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """Portfolio JSON tree: every node has `width` sub-portfolios down to `depth` levels."""
+    rng = np.random.default_rng(seed)
+
+    def node(name: str, level: int) -> Dict[str, Any]:
+        picks = rng.choice(len(symbols), size=min(positions_per_node, len(symbols)), replace=False)
+        out: Dict[str, Any] = {
+            "name": name,
+            "positions": [{"symbol": symbols[i], "quantity": int(rng.integers(1, 500))} for i in picks],
+        }
+        if level < depth:
+            out["sub_portfolios"] = [node(f"{name}.{k}", level + 1) for k in range(width)]
+        return out
+
+    return node("Root", 0)
+
+
+# ---------- timing ----------
+def frame_mb(obj) -> float | None:
+    """In-memory size of a pandas/polars result (deep, incl. strings), None for other results."""
+    if isinstance(obj, pd.DataFrame):
+        return obj.memory_usage(deep=True).sum() / 1024 ** 2
+    if is_polars(obj):
+        return obj.estimated_size("mb")
+    return None
+
+
+def time_callable(fn: Callable[[], Any], warmup: int = 1, repeat: int = 5) -> Dict[str, Any]:
+    """Timing stats plus `result_mb`, the size of the returned frame (None if not a frame)."""
+    for _ in range(warmup):
+        fn()
+    runs = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - t0)
+    arr = np.asarray(runs)
+    mb = frame_mb(result)
+    return {
+        "median_s": float(np.median(arr)),
+        "p95_s": float(np.percentile(arr, 95)),
+        "min_s": float(arr.min()),
+        "result_mb": None if mb is None else round(mb, 3),
+        "runs": [round(r, 6) for r in runs],
+    }
+
+
+def _cases(csv_path: str, df_pd: pd.DataFrame, df_pl: pl.DataFrame,
+           port: Dict[str, Any], pool: WorkerPool) -> Dict[str, Dict[str, Callable[[], Any]]]:
+    # warm-up fills the result cache, so the timed runs of the "-resultcache" variants are hits
+    results = ResultCache(os.path.join(os.path.dirname(csv_path), RESULT_CACHE_DIRNAME))
+    source = file_fingerprint(csv_path)
+    return {
+        "load": {
+            "pandas": lambda: load_pandas(csv_path),
+            "polars": lambda: load_polars(csv_path),
+            "pandas-cache": lambda: load_pandas(csv_path, cache=True),
+            "polars-cache": lambda: load_polars(csv_path, cache=True),
+            "pandas-compact": lambda: load_pandas(csv_path, compact=True, float32=True),
+            "polars-compact": lambda: load_polars(csv_path, compact=True, float32=True),
+        },
+        "rolling": {
+            "pandas-numpy": lambda: rolling_pandas(df_pd, method="numpy"),
+            "pandas-groupby": lambda: rolling_pandas(df_pd, method="groupby"),
+            "polars": lambda: rolling_polars(df_pl),
+            "pandas-numpy-metrics32": lambda: rolling_pandas(df_pd, output="metrics", float32=True),
+            "polars-metrics32": lambda: rolling_polars(df_pl, output="metrics", float32=True),
+            "pandas-numpy-resultcache": lambda: results.call(rolling_pandas, df_pd, fingerprint=source),
+            "polars-resultcache": lambda: results.call(rolling_polars, df_pl, fingerprint=source),
+        },
+        "parallel": {
+            "thread-pandas": lambda: parallel.compute_threading(df_pd, "pandas", pool=pool),
+            "thread-polars": lambda: parallel.compute_threading(df_pl, "polars", pool=pool),
+            "process-pandas": lambda: parallel.compute_multiprocessing(df_pd, "pandas", pool=pool),
+            "process-polars": lambda: parallel.compute_multiprocessing(df_pl, "polars", pool=pool),
+            "process-shared-pandas": lambda: parallel.compute_multiprocessing(df_pd, "pandas", shared=True, pool=pool),
+            "process-pandas-metrics32": lambda: parallel.compute_multiprocessing(df_pd, "pandas", pool=pool,
+                                                                                 output="metrics", float32=True),
+            "polars-lazy": lambda: parallel.compute_polars_lazy(df_pl),
+        },
+        "portfolio": {
+            "sequential": lambda: aggregate_portfolio_sequential(port, df_pd),
+            "parallel": lambda: aggregate_portfolio_parallel(port, df_pd, pool=pool),
+            "flat": lambda: aggregate_portfolio_flat(port, df_pd, pool=pool),
+            "flat-shared": lambda: aggregate_portfolio_flat(port, df_pd, shared=True, pool=pool),
+            "compiled": lambda: evaluate_compiled(compile_portfolio(port), df_pd).to_snapshot(),
+        },
+    }
+
+
+def case_key(r: Dict[str, Any]) -> str:
+    return f"{r['stage']}/{r['variant']}/s{r['n_symbols']}/r{r['n_rows']}/d{r['depth']}w{r['width']}"
+
+
+def run_matrix(symbols: Iterable[int] = (3,), rows: Iterable[int] = (100_000,),
+               depth: int = 2, width: int = 2, warmup: int = 1, repeat: int = 5,
+               stages: Iterable[str] | None = None, seed: int = 0,
+               max_workers: int | None = None) -> List[Dict[str, Any]]:
+    """
+    Time every (stage, variant) for each symbols x rows size. Process-based
+    variants share one warmed WorkerPool, so numbers are steady-state costs.
+    """
+    results: List[Dict[str, Any]] = []
+    with WorkerPool(max_workers=max_workers, preload=POLARS_PRELOAD) as pool, tempfile.TemporaryDirectory() as tmp:
+        pool.warm_up()
+        for n_sym in symbols:
+            for n_rows in rows:
+                csv_path = write_market_csv(os.path.join(tmp, f"md_{n_sym}_{n_rows}.csv"),
+                                            n_symbols=n_sym, n_rows=n_rows, seed=seed)
+                df_pd, df_pl = load_pandas(csv_path), load_polars(csv_path)
+                syms = sorted(df_pd["symbol"].unique().tolist())
+                port = generate_portfolio(syms, depth=depth, width=width, seed=seed)
+
+                for stage, variants in _cases(csv_path, df_pd, df_pl, port, pool).items():
+                    if stages is not None and stage not in stages:
+                        continue
+                    for variant, fn in variants.items():
+                        res = {"stage": stage, "variant": variant, "n_symbols": n_sym, "n_rows": n_rows,
+                               "depth": depth, "width": width}
+                        res.update(time_callable(fn, warmup=warmup, repeat=repeat))
+                        results.append(res)
+    return results
+
+
+# ---------- persistence / comparison ----------
+def environment() -> Dict[str, Any]:
+    import polars as pl
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "polars": pl.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(results: List[Dict[str, Any]], path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+
+def load_results(path) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+            threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Rows for every case present in both runs, with the median ratio; a case
+    regresses when its median is more than `threshold` slower than baseline.
+    """
+    base = {case_key(r): r for r in baseline}
+    rows = []
+    for r in results:
+        b = base.get(case_key(r))
+        if b is None:
+            continue
+        ratio = r["median_s"] / b["median_s"] if b["median_s"] > 0 else float("inf")
+        rows.append({"case": case_key(r), "baseline_s": b["median_s"], "current_s": r["median_s"],
+                     "ratio": round(ratio, 3), "regression": ratio > 1.0 + threshold})
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark loaders, rolling backends, executors and aggregators.")
+    ap.add_argument("--symbols", type=int, nargs="+", default=[3])
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    ap.add_argument("--depth", type=int, default=2)
+    ap.add_argument("--width", type=int, default=2)
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--stages", nargs="+", choices=["load", "rolling", "parallel", "portfolio"])
+    ap.add_argument("--out", default="benchmark_results.json")
+    ap.add_argument("--baseline", help="earlier --out file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    args = ap.parse_args(argv)
+
+    results = run_matrix(args.symbols, args.rows, args.depth, args.width,
+                         args.warmup, args.repeat, args.stages)
+    save_results(results, args.out)
+    print(pd.DataFrame(results).drop(columns=["runs"]).to_string(index=False))
+    print(f"Saved: {args.out}")
+
+    if args.baseline:
+        cmp = compare(results, load_results(args.baseline), args.threshold)
+        print(pd.DataFrame(cmp).to_string(index=False))
+        if any(c["regression"] for c in cmp):
+            print("Regressions found.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
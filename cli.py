@@ -0,0 +1,262 @@
+"""
+Command-line entry point: python cli.py <command> [options]
+
+    load        parse a market data CSV (pandas or polars)
+    rolling     rolling metrics for a CSV
+    parallel    rolling metrics on a thread / process / auto executor
+    portfolio   portfolio snapshot JSON
+    benchmark   benchmark matrix (arguments are passed to benchmark.py)
+    plot        bar charts from a performance_summary.csv
+
+Only the standard library is imported at startup; each command imports the
+modules it needs (pandas, polars, matplotlib, psutil) when it runs, so a
+short job pays only for its own dependencies. --timings prints the measured
+cold-start breakdown to stderr as JSON.
+"""
+from __future__ import annotations
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+_T0 = time.perf_counter()
+HEAVY_MODULES = ("numpy", "pandas", "polars", "pyarrow", "matplotlib", "psutil")
+
+
+def process_age() -> float | None:
+    """Seconds since this process started (interpreter startup included); Linux /proc only."""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            start_ticks = int(f.read().rsplit(b")", 1)[1].split()[19])
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+_STARTUP_S = process_age()  # interpreter + this module, before any command runs
+
+
+# ---------- commands ----------
+# Each command is (modules to import, handler). The modules are imported (and
+# timed) right before the handler runs.
+def _profiled(args, section: str, lib: str, fn: Callable[[], Any]):
+    if not args.profile:
+        return fn()
+    from profiling import profile_stage  # psutil only when profiling was asked for
+    with profile_stage(section, lib) as prof:
+        result = fn()
+    print(json.dumps(prof.to_row()), file=sys.stderr)
+    return result
+
+
+def _load_frame(args):
+    from data_loader import load_pandas, load_polars
+    load = load_polars if args.library == "polars" else load_pandas
+    return load(args.csv, cache=args.cache, compact=args.compact, float32=args.float32)
+
+
+def _describe(df) -> str:
+    text = f"rows={len(df)} columns={list(df.columns)}"
+    if "symbol" in df.columns:
+        n_sym = df["symbol"].n_unique() if hasattr(df, "height") else df["symbol"].nunique()
+        text += f" symbols={n_sym}"
+    return text
+
+
+def _write_frame(df, path: str):
+    if hasattr(df, "height"):
+        df.write_parquet(path) if path.endswith(".parquet") else df.write_csv(path)
+    else:
+        df.to_parquet(path) if path.endswith(".parquet") else df.to_csv(path)
+    print(f"Saved: {path}")
+
+
+def cmd_load(args) -> int:
+    df = _profiled(args, "ingestion", args.library, lambda: _load_frame(args))
+    print(_describe(df))
+    return 0
+
+
+def cmd_rolling(args) -> int:
+    from metrics import rolling_pandas, rolling_polars
+    df = _load_frame(args)
+    window = args.window[0] if len(args.window) == 1 else args.window  # several windows -> suffixed columns
+    if args.library == "polars":
+        fn = lambda: rolling_polars(df, window, output=args.output, float32=args.float32)
+    else:
+        fn = lambda: rolling_pandas(df, window, output=args.output, float32=args.float32)
+    out = _profiled(args, "rolling", args.library, fn)
+    print(_describe(out))
+    if args.out:
+        _write_frame(out, args.out)
+    return 0
+
+
+def cmd_parallel(args) -> int:
+    import parallel
+    from workers import WorkerPool, preload_for
+    df = _load_frame(args)
+    with WorkerPool(max_workers=args.workers, preload=preload_for(args.library)) as pool:
+        fns = {"threading": parallel.compute_threading, "multiprocessing": parallel.compute_multiprocessing,
+               "auto": parallel.compute_auto}
+        out = _profiled(args, args.mode, args.library,
+                        lambda: fns[args.mode](df, library=args.library, window=args.window, pool=pool))
+    print(_describe(out))
+    if args.out:
+        _write_frame(out, args.out)
+    return 0
+
+
+def cmd_portfolio(args) -> int:
+    from data_loader import load_pandas
+    from portfolio import aggregate_portfolio_sequential, compile_portfolio, evaluate_compiled
+    with open(args.portfolio, "r", encoding="utf-8") as f:
+        port = json.load(f)
+    df = load_pandas(args.csv, cache=args.cache)
+    if args.engine == "compiled":
+        fn = lambda: evaluate_compiled(compile_portfolio(port), df, args.vol_window, as_of=args.as_of).to_snapshot()
+    else:
+        fn = lambda: aggregate_portfolio_sequential(port, df, args.vol_window, as_of=args.as_of)
+    snap = _profiled(args, "portfolio", args.engine, fn)
+    text = json.dumps(snap, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Saved: {args.out}")
+    else:
+        print(text)
+    return 0
+
+
+def cmd_benchmark(args) -> int:
+    import benchmark
+    return benchmark.main(args.bench_args)
+
+
+def cmd_plot(args) -> int:
+    import matplotlib
+    matplotlib.use("Agg")  # files only, never a window
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    perf = pd.read_csv(args.summary)
+    labels = [f"{a}|{b}" for a, b in zip(perf["section"].astype(str), perf["lib"].astype(str))]
+    charts = [("seconds", "seconds", "Performance: seconds", "performance_seconds.png"),
+              ("rss_mb_delta", "MB", "Performance: RSS delta (MB)", "performance_rss_delta.png"),
+              ("peak_rss_mb_delta", "MB", "Performance: peak RSS delta incl. workers (MB)", "performance_peak_rss.png")]
+    os.makedirs(args.outdir, exist_ok=True)
+    saved = []
+    for col, ylabel, title, name in charts:
+        if col not in perf.columns:
+            continue
+        plt.figure()
+        plt.bar(range(len(labels)), perf[col].astype(float).fillna(0.0).tolist())
+        plt.xticks(range(len(labels)), labels, rotation=45, ha="right")
+        plt.ylabel(ylabel)
+        plt.title(title)
+        plt.tight_layout()
+        path = os.path.join(args.outdir, name)
+        plt.savefig(path, dpi=140)
+        plt.close()
+        saved.append(path)
+    print("Saved: " + ", ".join(saved))
+    return 0
+
+
+def _frame_modules(args) -> List[str]:
+    mods = ["data_loader", "pandas"]
+    if args.library == "polars" or args.cache:
+        mods.append("polars")
+    return mods
+
+
+COMMANDS: Dict[str, tuple] = {
+    "load": (_frame_modules, cmd_load),
+    "rolling": (lambda a: _frame_modules(a) + ["metrics"], cmd_rolling),
+    "parallel": (lambda a: _frame_modules(a) + ["parallel", "workers"], cmd_parallel),
+    "portfolio": (lambda a: ["data_loader", "portfolio"] + (["polars"] if a.cache else []), cmd_portfolio),
+    "benchmark": (lambda a: ["benchmark"], cmd_benchmark),
+    "plot": (lambda a: ["pandas", "matplotlib.pyplot"], cmd_plot),
+}
+
+
+# ---------- argument parsing ----------
+def _frame_options(p: argparse.ArgumentParser, library: bool = True):
+    p.add_argument("csv", nargs="?", default="market_data-1.csv")
+    if library:
+        p.add_argument("--library", choices=["pandas", "polars"], default="pandas")
+        p.add_argument("--compact", action="store_true", help="dictionary-encoded symbol column")
+        p.add_argument("--float32", action="store_true")
+    p.add_argument("--cache", action="store_true", help="use the columnar cache next to the CSV")
+    p.add_argument("--profile", action="store_true", help="time/CPU/RSS profile of the stage (needs psutil)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="cli.py", description="Market data processing jobs.")
+    ap.add_argument("--timings", action="store_true", help="print cold-start timings to stderr")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    _frame_options(sub.add_parser("load", help="parse a market data CSV"))
+
+    p = sub.add_parser("rolling", help="rolling ret/ma/std/sharpe")
+    _frame_options(p)
+    p.add_argument("--window", type=int, nargs="+", default=[20])
+    p.add_argument("--output", choices=["full", "metrics"], default="full")
+    p.add_argument("--out", help="write the result (.parquet or .csv)")
+
+    p = sub.add_parser("parallel", help="rolling metrics on an executor")
+    _frame_options(p)
+    p.add_argument("--mode", choices=["threading", "multiprocessing", "auto"], default="auto")
+    p.add_argument("--window", type=int, default=20)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--out", help="write the result (.parquet or .csv)")
+
+    p = sub.add_parser("portfolio", help="portfolio snapshot JSON")
+    _frame_options(p, library=False)
+    p.add_argument("--portfolio", default="portfolio_structure-1.json")
+    p.add_argument("--engine", choices=["sequential", "compiled"], default="compiled")
+    p.add_argument("--vol-window", type=int, default=20)
+    p.add_argument("--as-of", help="value with prices up to this timestamp")
+    p.add_argument("--out", help="write the snapshot here instead of stdout")
+
+    p = sub.add_parser("benchmark", help="benchmark matrix (see benchmark.py --help)")
+    p.add_argument("bench_args", nargs=argparse.REMAINDER)
+
+    p = sub.add_parser("plot", help="bar charts from a performance summary CSV")
+    p.add_argument("--summary", default="performance_summary.csv")
+    p.add_argument("--outdir", default=".")
+    return ap
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    modules, handler = COMMANDS[args.command]
+
+    t_import = time.perf_counter()
+    for name in modules(args):
+        importlib.import_module(name)
+    t_run = time.perf_counter()
+    code = handler(args)
+    t_end = time.perf_counter()
+
+    if args.timings:
+        age = process_age()
+        print(json.dumps({
+            "command": args.command,
+            "startup_s": None if _STARTUP_S is None else round(_STARTUP_S, 4),
+            "parse_s": round(t_import - _T0, 4),
+            "imports_s": round(t_run - t_import, 4),
+            "run_s": round(t_end - t_run, 4),
+            "total_s": None if age is None else round(age, 4),
+            "modules": [m for m in HEAVY_MODULES if m in sys.modules],
+        }), file=sys.stderr)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
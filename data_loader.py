@@ -1,13 +1,205 @@
+from __future__ import annotations
+import datetime as dt
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import TYPE_CHECKING
 import pandas as pd
-import polars as pl
 
-def load_pandas(path):
-    df = pd.read_csv(path)
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
+if TYPE_CHECKING:
+    import polars as pl
+
+# ---------- lazy polars import ----------
+# polars is imported inside the functions that build polars objects, so the
+# pandas-only paths (load_pandas without cache, collect on pandas frames)
+# start without it.
+def is_polars(obj, kind: str = "DataFrame") -> bool:
+    """isinstance(obj, polars.<kind>) without importing polars (a polars object implies it is loaded)."""
+    pl = sys.modules.get("polars")
+    return pl is not None and isinstance(obj, getattr(pl, kind))
+
+
+# ---------- columnar cache ----------
+# The first cached load of a CSV writes one Arrow IPC file per symbol under
+# <cache_dir>/<stem>-<hash>/ plus a manifest holding the source size/mtime.
+# Later loads memory-map those files instead of re-parsing text; a changed
+# size or mtime on the source invalidates the whole directory.
+CACHE_DIRNAME = ".market_cache"
+_MANIFEST = "manifest.json"
+_ROW = "__row"
+
+
+def _cache_path(path, cache_dir=None) -> str:
+    src = os.path.abspath(os.fspath(path))
+    base = os.fspath(cache_dir) if cache_dir else os.path.join(os.path.dirname(src), CACHE_DIRNAME)
+    stem = os.path.splitext(os.path.basename(src))[0]
+    tag = hashlib.sha1(src.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(base, f"{stem}-{tag}")
+
+
+def _source_stamp(path) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _read_manifest(path, cache_dir=None):
+    """Return the manifest if the cache exists and still matches the source file."""
+    try:
+        with open(os.path.join(_cache_path(path, cache_dir), _MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("source") != _source_stamp(path):
+        return None
+    return manifest
+
+
+def _parse_csv(path) -> pl.DataFrame:
+    import polars as pl
+    df = pl.read_csv(path)
+    return df.with_columns(pl.col("timestamp").str.to_datetime())
+
+
+def build_cache(path, cache_dir=None) -> dict:
+    """(Re)write the symbol-partitioned cache for `path` and return its manifest."""
+    root = _cache_path(path, cache_dir)
+    stamp = _source_stamp(path)  # taken before parsing so a concurrent rewrite invalidates
+    df = _parse_csv(path).with_row_index(_ROW)
+
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    parts = {}
+    for i, (key, part) in enumerate(df.partition_by("symbol", as_dict=True, maintain_order=True).items()):
+        fname = f"part-{i:05d}.arrow"
+        part.write_ipc(os.path.join(root, fname), compression="uncompressed")  # lets readers memory-map
+        parts[str(key[0])] = fname
+
+    manifest = {"source": stamp, "rows": df.height, "columns": df.columns[1:], "parts": parts}
+    # manifest is written last: its presence marks a complete cache
+    with open(os.path.join(root, _MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def clear_cache(path, cache_dir=None):
+    root = _cache_path(path, cache_dir)
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+
+
+def _load_cached(path, cache_dir=None, symbols=None) -> pl.DataFrame:
+    import polars as pl
+    manifest = _read_manifest(path, cache_dir) or build_cache(path, cache_dir)
+    root = _cache_path(path, cache_dir)
+    parts = manifest["parts"]
+    names = list(parts) if symbols is None else [s for s in symbols if s in parts]
+    if not parts:
+        return _parse_csv(path)
+    if not names:
+        # no requested symbol is present: keep the schema, return no rows
+        first = next(iter(parts.values()))
+        return pl.read_ipc(os.path.join(root, first)).clear().drop(_ROW)
+    frames = [pl.read_ipc(os.path.join(root, parts[s])) for s in names]
+    # restore source row order so cached and uncached loads are identical
+    return pl.concat(frames).sort(_ROW).drop(_ROW)
+
+
+# compact=True stores `symbol` dictionary-encoded (pandas category / polars
+# Categorical) and float32=True stores `price` as float32; both are opt-in.
+def _compact_polars(df: pl.DataFrame, compact=False, float32=False) -> pl.DataFrame:
+    import polars as pl
+    casts = []
+    if compact:
+        casts.append(pl.col("symbol").cast(pl.Categorical))
+    if float32:
+        casts.append(pl.col("price").cast(pl.Float32))
+    return df.with_columns(casts) if casts else df
+
+
+def load_pandas(path, cache=False, cache_dir=None, compact=False, float32=False):
+    if cache or cache_dir:
+        df = _compact_polars(_load_cached(path, cache_dir), compact, float32).to_pandas()
+    else:
+        dtype = {}
+        if compact:
+            dtype["symbol"] = "category"  # parsed straight into codes, no object column
+        if float32:
+            dtype["price"] = "float32"
+        df = pd.read_csv(path, dtype=dtype or None)
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
     df = df.set_index("timestamp")
     return df
 
-def load_polars(path):
-    df = pl.read_csv(path)
-    df = df.with_columns(pl.col("timestamp").str.to_datetime())
-    return df
\ No newline at end of file
+def load_polars(path, cache=False, cache_dir=None, compact=False, float32=False):
+    if cache or cache_dir:
+        return _compact_polars(_load_cached(path, cache_dir), compact, float32)
+    return _compact_polars(_parse_csv(path), compact, float32)
+
+
+# ---------- lazy scans ----------
+def _as_datetime(value):
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    return pd.Timestamp(value).to_pydatetime()
+
+
+def scan_market_data(path, symbols=None, start=None, end=None, columns=None,
+                     cache=False, cache_dir=None) -> pl.LazyFrame:
+    """
+    Lazy scan of a market data CSV with symbol, time-range and column pushdown.
+
+    `symbols` keeps only those symbols, `start`/`end` bound the timestamp
+    (both inclusive; str, datetime or pd.Timestamp) and `columns` selects the
+    output columns. Nothing is read until the LazyFrame is collected. With
+    cache=True (or cache_dir) only the requested symbols' partitions of the
+    columnar cache are scanned; otherwise the CSV reader applies the filters
+    while it streams.
+    """
+    import polars as pl
+    start, end = _as_datetime(start), _as_datetime(end)
+
+    lf = None
+    if cache or cache_dir:
+        manifest = _read_manifest(path, cache_dir) or build_cache(path, cache_dir)
+        root = _cache_path(path, cache_dir)
+        parts = manifest["parts"]
+        names = list(parts) if symbols is None else [s for s in symbols if s in parts]
+        if names:
+            lf = pl.scan_ipc([os.path.join(root, parts[s]) for s in names])
+        elif parts:
+            lf = pl.scan_ipc(os.path.join(root, next(iter(parts.values())))).head(0)
+    if lf is None:
+        lf = pl.scan_csv(path)
+        if symbols is not None:
+            lf = lf.filter(pl.col("symbol").is_in(list(symbols)))
+        lf = lf.with_columns(pl.col("timestamp").str.to_datetime())
+
+    if start is not None:
+        lf = lf.filter(pl.col("timestamp") >= start)
+    if end is not None:
+        lf = lf.filter(pl.col("timestamp") <= end)
+    if _ROW in lf.collect_schema().names():
+        lf = lf.sort(_ROW).drop(_ROW)
+    if columns is not None:
+        lf = lf.select(list(columns))
+    return lf
+
+
+def collect(df, library="polars"):
+    """
+    Materialize a LazyFrame (e.g. from scan_market_data) for `library`:
+    a polars DataFrame, or a pandas frame indexed by timestamp like load_pandas.
+    Eager frames are returned unchanged.
+    """
+    if not is_polars(df, "LazyFrame"):
+        return df
+    out = df.collect()
+    if library == "pandas":
+        out = out.to_pandas()
+        if "timestamp" in out.columns:
+            out = out.set_index("timestamp")
+    return out
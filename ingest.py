@@ -0,0 +1,165 @@
+from __future__ import annotations
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+import glob
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+import pandas as pd
+
+from data_loader import load_pandas, load_polars
+from metrics import rolling_pandas, rolling_polars
+
+# ---------- async multi-file ingestion ----------
+# Files are parsed on a thread pool with at most `concurrency` parses in
+# flight; each parsed frame goes through a bounded queue straight into the
+# compute stage (rolling metrics by default), also run on the thread pool, so
+# parsing file N+1 overlaps computing file N. The CSV readers and the NumPy /
+# polars kernels release the GIL, so threads are enough to overlap the work.
+# Every file is processed on its own (rolling windows restart per file).
+
+
+def resolve_paths(source) -> List[str]:
+    """A directory (its *.csv files), a glob pattern, a single path or a list of paths."""
+    if isinstance(source, (list, tuple)):
+        return [os.fspath(p) for p in source]
+    source = os.fspath(source)
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.csv")))
+    if glob.has_magic(source):
+        return sorted(glob.glob(source))
+    return [source]
+
+
+@dataclass
+class FileStats:
+    path: str
+    rows: int = 0
+    parse_s: float = 0.0
+    queue_wait_s: float = 0.0     # parsed frame waiting for the compute stage
+    compute_s: float = 0.0
+    queue_depth: int = 0          # frames waiting in the queue right after this one was enqueued
+
+
+@dataclass
+class IngestStats:
+    files: List[FileStats] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return sum(f.rows for f in self.files)
+
+    @property
+    def max_queue_depth(self) -> int:
+        return max((f.queue_depth for f in self.files), default=0)
+
+    @property
+    def overlap(self) -> float:
+        """Busy time (parse + compute) over wall time; > 1 means stages overlapped."""
+        busy = sum(f.parse_s + f.compute_s for f in self.files)
+        return busy / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {"files": len(self.files), "rows": self.rows, "seconds": round(self.seconds, 6),
+                "parse_s": round(sum(f.parse_s for f in self.files), 6),
+                "compute_s": round(sum(f.compute_s for f in self.files), 6),
+                "max_queue_depth": self.max_queue_depth, "overlap": round(self.overlap, 3)}
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame([asdict(f) for f in self.files])
+
+
+def _loader(library: str, cache: bool) -> Callable[[str], Any]:
+    if library == "polars":
+        return lambda p: load_polars(p, cache=cache)
+    if library == "pandas":
+        return lambda p: load_pandas(p, cache=cache)
+    raise ValueError("library must be 'pandas' or 'polars'")
+
+
+def _default_process(library: str, window) -> Callable[[Any], Any]:
+    if library == "polars":
+        return lambda df: rolling_polars(df, window)
+    return lambda df: rolling_pandas(df, window)
+
+
+async def iter_ingest(source, library: str = "polars", process: Callable[[Any], Any] | None = None,
+                      window=20, concurrency: int = 4, queue_size: int | None = None,
+                      cache: bool = False, pool=None,
+                      stats: IngestStats | None = None) -> AsyncIterator[Tuple[str, Any, FileStats]]:
+    """
+    Yield (path, result, FileStats) for every file as soon as its compute
+    stage finishes (completion order). `process` maps a parsed frame to the
+    result (default: rolling_polars / rolling_pandas with `window`; pass
+    `lambda df: df` to only load). `queue_size` bounds parsed frames waiting
+    for compute (default `concurrency`). `pool` is an optional
+    workers.WorkerPool whose threads run both stages.
+    """
+    paths = resolve_paths(source)
+    load = _loader(library, cache)
+    process = process or _default_process(library, window)
+    stats = stats if stats is not None else IngestStats()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or concurrency)
+    gate = asyncio.Semaphore(concurrency)
+    done = object()
+    t0 = time.perf_counter()
+
+    executor = pool.threads if pool is not None else ThreadPoolExecutor()
+
+    async def parse(path: str):
+        # the slot is held until the frame is queued, so a slow compute stage applies backpressure
+        async with gate:
+            fs = FileStats(path=path)
+            t = time.perf_counter()
+            df = await loop.run_in_executor(executor, load, path)
+            fs.parse_s = time.perf_counter() - t
+            fs.rows = len(df)
+            await queue.put((fs, df, time.perf_counter()))
+            fs.queue_depth = queue.qsize()
+
+    async def produce():
+        try:
+            await asyncio.gather(*(parse(p) for p in paths))
+        finally:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            fs, df, queued_at = item
+            fs.queue_wait_s = time.perf_counter() - queued_at
+            t = time.perf_counter()
+            result = await loop.run_in_executor(executor, process, df)
+            fs.compute_s = time.perf_counter() - t
+            stats.files.append(fs)
+            stats.seconds = time.perf_counter() - t0
+            yield fs.path, result, fs
+        await producer  # re-raises a parse error
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+        if pool is None:
+            # shutdown(wait=True) would block the event loop on in-flight parses
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def ingest_files(source, **kwargs) -> Tuple[Dict[str, Any], IngestStats]:
+    """Run iter_ingest to completion: ({path: result} in source order, stats)."""
+    stats = IngestStats()
+    results = {}
+    async for path, result, _ in iter_ingest(source, stats=stats, **kwargs):
+        results[path] = result
+    order = resolve_paths(source)
+    return {p: results[p] for p in order if p in results}, stats
+
+
+def load_files(source, **kwargs) -> Tuple[Dict[str, Any], IngestStats]:
+    """Synchronous entry point for ingest_files (starts its own event loop)."""
+    return asyncio.run(ingest_files(source, **kwargs))
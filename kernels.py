@@ -0,0 +1,211 @@
+import numpy as np
+
+# ---------- NumPy rolling kernels ----------
+# All kernels work on one flat array holding many groups (symbols) back to
+# back, e.g. prices sorted by symbol. `pos` is each row's position inside its
+# group (see group_positions); windows that would reach into the previous
+# group are masked to NaN, matching pandas groupby().rolling(window) with
+# min_periods=window.
+#
+# Rolling mean/std come from prefix sums of x and x^2 (O(N) per window, any
+# window length). To keep the sums small, each group is cut into pieces of
+# `seg` rows at group positions 0, seg, 2*seg, ... and every piece is centred
+# on its first finite value; a window spans at most two pieces, whose partial
+# sums are shifted to one centre before the variance is formed. A row's
+# result depends only on its own group's rows from the start of the piece
+# before it, so a stream processed in chunks (with those rows carried over
+# and `pos` continued) gives the same bits as one pass. Windows with a
+# non-finite value give NaN; constant windows are detected exactly (count of
+# value changes) and give the value itself and a std of 0, like pandas.
+
+_SEG_ROWS = 256
+
+
+def segment_rows(max_window: int = 1) -> int:
+    """Rows per prefix-sum piece of RollingSums(..., max_window)."""
+    return max(_SEG_ROWS, int(max_window))
+
+
+def group_positions(codes: np.ndarray) -> np.ndarray:
+    """Position of each row inside its run of equal `codes` (codes must be grouped)."""
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+    return np.arange(n) - np.repeat(starts, lengths)
+
+
+def pct_change(x: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[1:] = x[1:] / x[:-1] - 1.0
+    out[pos == 0] = np.nan
+    return out
+
+
+class RollingSums:
+    """
+    Prefix sums of one grouped array, built once; `mean(w)` / `std(w)` read
+    any window w <= max(max_window, _SEG_ROWS) off them in O(N). `pos` may
+    start a group above 0 (a continued stream); groups then need their
+    `codes`, otherwise a new group begins wherever `pos` does not continue
+    the previous row.
+    """
+
+    def __init__(self, x: np.ndarray, pos: np.ndarray, max_window: int = 1, codes: np.ndarray | None = None):
+        x = np.asarray(x, dtype=np.float64)
+        pos = np.asarray(pos)
+        n = len(x)
+        self.n = n
+        self.seg = seg = segment_rows(max_window)
+        bad = ~np.isfinite(x)
+        v = np.where(bad, 0.0, x)
+        self.x = v
+
+        # pieces: a new one at every group start and every multiple of seg inside a group
+        new_group = np.r_[True, pos[1:] != pos[:-1] + 1] if n else np.zeros(0, dtype=bool)
+        if codes is not None and n:
+            new_group[1:] |= codes[1:] != codes[:-1]
+        first = new_group | (pos % seg == 0)
+        starts = np.flatnonzero(first)
+        lengths = np.diff(np.r_[starts, n])
+        self.run = np.cumsum(first) - 1
+        self.run_end = starts + lengths
+
+        # centre on the piece's first finite value (0 if it has none)
+        idx = np.arange(n)
+        first_good = np.minimum.reduceat(np.where(bad, n, idx), starts) if n else np.zeros(0, dtype=np.int64)
+        centre = np.where(first_good < n, v[np.minimum(first_good, max(n - 1, 0))], 0.0)
+        self.centre = centre[self.run]
+        y = np.where(bad, 0.0, v - self.centre)
+
+        # cumulative sums restarting at each piece; pieces of equal length are
+        # stacked so each length is one cumsum along axis 1
+        self.cs1, self.cs2 = np.empty(n), np.empty(n)
+        for length in np.unique(lengths).tolist():
+            rows = starts[lengths == length][:, None] + np.arange(length)
+            self.cs1[rows] = np.cumsum(y[rows], axis=1)
+            self.cs2[rows] = np.cumsum(y[rows] * y[rows], axis=1)
+        self.tot1, self.tot2 = self.cs1[self.run_end - 1], self.cs2[self.run_end - 1]
+
+        self.bad = np.r_[0, np.cumsum(bad)]                          # non-finite rows before each index
+        self.changes = np.cumsum(np.r_[False, v[1:] != v[:-1]])     # value changes up to each index
+        self.first, self.group = first, np.cumsum(new_group)
+
+    def _window(self, window: int):
+        """(i, s1, s2, constant, ok) for windows ending at rows i = window-1 .. n-1, centred on centre[i]."""
+        if window < 1:
+            raise ValueError("window must be >= 1")
+        if window > self.seg:
+            raise ValueError(f"window {window} is longer than these sums support ({self.seg}); "
+                             "build RollingSums with max_window >= window")
+        i = np.arange(window - 1, self.n)
+        j = i - window + 1
+        cross = self.run[i] != self.run[j]
+        inner = ~self.first[j]                    # j is not the first row of its piece
+        jm = np.maximum(j - 1, 0)
+        before1 = np.where(inner, self.cs1[jm], 0.0)
+        before2 = np.where(inner, self.cs2[jm], 0.0)
+
+        # part in i's piece (all of the window unless it crosses into the previous piece)
+        s1 = self.cs1[i] - np.where(cross, 0.0, before1)
+        s2 = self.cs2[i] - np.where(cross, 0.0, before2)
+        if cross.any():
+            # part in the previous piece, shifted from centre[j] to centre[i]
+            rj = self.run[j[cross]]
+            a1 = self.tot1[rj] - before1[cross]
+            a2 = self.tot2[rj] - before2[cross]
+            na = self.run_end[rj] - j[cross]
+            d = self.centre[j[cross]] - self.centre[i[cross]]
+            s1[cross] += a1 + na * d
+            s2[cross] += a2 + 2.0 * d * a1 + na * d * d
+
+        ok = (self.bad[i + 1] - self.bad[j] == 0) & (self.group[i] == self.group[j])
+        constant = self.changes[i] - self.changes[j] == 0
+        return i, s1, s2, constant, ok
+
+    def mean_std(self, window: int, ddof: int = 1):
+        """(rolling mean, rolling std) from one pass over the sums."""
+        mean, std = np.full(self.n, np.nan), np.full(self.n, np.nan)
+        if window > self.n:
+            return mean, std
+        i, s1, s2, constant, ok = self._window(window)
+        m = self.centre[i] + s1 / window
+        m[constant] = self.x[i][constant]
+        m[~ok] = np.nan
+        mean[i] = m
+        if window - ddof > 0:
+            sd = np.sqrt(np.maximum(s2 - s1 * s1 / window, 0.0) / (window - ddof))
+            sd[constant] = 0.0
+            sd[~ok] = np.nan
+            std[i] = sd
+        return mean, std
+
+    def mean(self, window: int) -> np.ndarray:
+        return self.mean_std(window)[0]
+
+    def std(self, window: int, ddof: int = 1) -> np.ndarray:
+        return self.mean_std(window, ddof)[1]
+
+
+def rolling_mean(x: np.ndarray, window: int, pos: np.ndarray) -> np.ndarray:
+    return RollingSums(x, pos, window).mean(window)
+
+
+def rolling_std(x: np.ndarray, window: int, pos: np.ndarray, ddof: int = 1) -> np.ndarray:
+    return RollingSums(x, pos, window).std(window, ddof)
+
+
+# ---------- cross-sectional risk ----------
+# Many symbols at once as a (rows, symbols) matrix: each column holds one
+# symbol's observations right-aligned (its latest price in the last row) with
+# NaN above, so ragged histories share one array and every statistic is a
+# single reduction along axis 0.
+
+def right_aligned(x: np.ndarray, starts, lengths) -> np.ndarray:
+    """(max(lengths), k) matrix; column j is x[starts[j]:starts[j] + lengths[j]] at the bottom, NaN above."""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    n_rows = int(lengths.max()) if len(lengths) else 0
+    out = np.full((n_rows, len(lengths)), np.nan)
+    col = np.repeat(np.arange(len(lengths)), lengths)
+    pos = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    out[n_rows - lengths[col] + pos, col] = x[starts[col] + pos]
+    return out
+
+
+def trailing_risk(m: np.ndarray, window: int):
+    """
+    Per column of a right-aligned price matrix: (last price, std (ddof=0) of
+    the last `window` returns, max drawdown). Returns follow
+    pct_change().fillna(0), so a column's first observation has return 0;
+    volatility is NaN for columns with fewer than `window` observations.
+    """
+    n_rows, k = m.shape
+    if n_rows == 0:
+        return np.full(k, np.nan), np.full(k, np.nan), np.full(k, np.nan)
+    observed = ~np.isnan(m)
+    n_obs = observed.sum(axis=0)
+    last = m[-1].copy()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ret = np.empty_like(m)
+        ret[0] = 0.0
+        ret[1:] = m[1:] / m[:-1] - 1.0
+        ret[np.isnan(ret) & observed] = 0.0
+
+        vol = np.full(k, np.nan)
+        if 1 <= window <= n_rows:
+            w = ret[-window:]
+            full = n_obs >= window
+            s = w[:, full].std(axis=0)
+            s[w[:, full].max(axis=0) == w[:, full].min(axis=0)] = 0.0  # constant windows: exactly 0
+            vol[full] = s
+
+        peak = np.fmax.accumulate(m, axis=0)
+        dd = m / peak - 1.0
+    dd[~observed] = np.inf
+    dd = dd.min(axis=0)
+    dd[n_obs == 0] = np.nan
+    return last, vol, dd
@@ -1,16 +1,19 @@
-import time
 import matplotlib.pyplot as plt
 import polars as pl
 from data_loader import load_pandas, load_polars
 from metrics import rolling_pandas, rolling_polars
 import parallel
-import psutil
 import pandas as pd
 import json
+import logging
 from portfolio import (
     aggregate_portfolio_sequential,
     aggregate_portfolio_parallel,
 )
+from profiling import profile_stage
+from replay import replay
+from workers import POLARS_PRELOAD, WorkerPool
+from reporting import profiles_to_frame, write_reports
 
 def bar(values, ylabel, title, outfile):
     plt.figure()
@@ -22,161 +25,42 @@ def bar(values, ylabel, title, outfile):
     plt.savefig(outfile, dpi=140)
     plt.close()
 
-def _rss_mb():
-    return psutil.Process().memory_info().rss / (1024**2)
+def _n_symbols(df):
+    return df["symbol"].n_unique() if isinstance(df, pl.DataFrame) else df["symbol"].nunique()
 
-def _cpu_mb():
-    try:
-        return psutil.cpu_percent(interval=0.2)  # brief sampling window
-    except Exception:
-        return None
+profiles = []
+
+def run_stage(section, lib, fn, **options):
+    """Run fn() under profile_stage, keep its profile, and return fn's result."""
+    with profile_stage(section, lib, **options) as prof:
+        result = fn()
+    prof.extra.update({"rows": len(result), "symbols": _n_symbols(result)})
+    profiles.append(prof)
+    return result
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    df1 = run_stage("ingestion", "pandas", lambda: load_pandas("market_data-1.csv", cache=True))
+    df2 = run_stage("ingestion", "polars", lambda: load_polars("market_data-1.csv", cache=True))
+
+    rp = run_stage("rolling", "pandas", lambda: rolling_pandas(df1), trace_allocations=True)
+    run_stage("rolling", "polars", lambda: rolling_polars(df2), trace_allocations=True)
+
+    # one pool for the parallel stages so per-worker task timings are recorded
+    with WorkerPool(preload=POLARS_PRELOAD) as pool:
+        run_stage("threading", "pandas", lambda: parallel.compute_threading(df1, library="pandas", pool=pool), pool=pool)
+        run_stage("threading", "polars", lambda: parallel.compute_threading(df2, library="polars", pool=pool), pool=pool)
+
+        run_stage("multiprocessing", "pandas",
+                  lambda: parallel.compute_multiprocessing(df1, library="pandas", pool=pool), pool=pool)
+        run_stage("multiprocessing", "polars",
+                  lambda: parallel.compute_multiprocessing(df2, library="polars", pool=pool), pool=pool)
+        # executor picked from the host calibration; the plan is logged
+        run_stage("auto", "pandas", lambda: parallel.compute_auto(df1, library="pandas", pool=pool), pool=pool)
+        run_stage("auto", "polars", lambda: parallel.compute_auto(df2, library="polars", pool=pool), pool=pool)
 
-    rows = []
-
-    cpu0 = _cpu_mb()
-    rss0 = _rss_mb() 
-    t0 = time.perf_counter()
-    df1 = load_pandas("market_data-1.csv")
-    t1 = time.perf_counter()
-    rss1 = _rss_mb()
-    cpu1 = _cpu_mb()
-
-    rows.append({
-    "section": "ingestion",
-    "lib": "pandas",
-    "seconds": round(t1 - t0, 6),
-    "rss_mb_delta": round(max(rss1 - rss0, 0.0), 2),
-    "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-    "rows": len(df1),
-    "symbols": df1["symbol"].nunique()
-    })
-    
-    cpu0 = _cpu_mb()
-    rss2 = _rss_mb()
-    t2 = time.perf_counter()
-    df2 = load_polars("market_data-1.csv")
-    t3 = time.perf_counter()
-    rss3 = _rss_mb()
-    cpu1 = _cpu_mb()
-
-    rows.append({
-    "section": "ingestion",
-    "lib": "polars",
-    "seconds": round(t3 - t2, 6),
-    "rss_mb_delta": round(max(rss3 - rss2, 0.0), 2),
-    "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-    "rows": len(df2),
-    "symbols": df2["symbol"].n_unique()
-    })
-
-    
-
-    cpu0 = _cpu_mb()
-    t0 = time.time()
-    rss0 = _rss_mb()
-    rp = rolling_pandas(df1)
-    t1 = time.time()
-    rss1 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "rolling",
-        "lib": "pandas",
-        "seconds": round(t1 - t0, 6),
-        "rss_mb_delta": round(max(rss1 - rss0, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(rp),
-        "symbols": rp["symbol"].nunique()
-    })
-
-    cpu0 = _cpu_mb()
-    rss2 = _rss_mb()
-    t2 = time.time()
-    rpl = rolling_polars(df2)
-    t3 = time.time()
-    rss3 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "rolling",
-        "lib": "polars",
-        "seconds": round(t3 - t2, 6),
-        "rss_mb_delta": round(max(rss3 - rss2, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(rpl),
-        "symbols": rpl["symbol"].n_unique()
-    })
-
-    cpu0 = _cpu_mb()
-    t0 = time.time()
-    rss0 = _rss_mb()
-    thread_df = parallel.compute_threading(df1,library="pandas")
-    t1 = time.time()
-    rss1 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "threading",
-        "lib": "pandas",
-        "seconds": round(t1 - t0, 6),
-        "rss_mb_delta": round(max(rss1 - rss0, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(thread_df),
-        "symbols": thread_df["symbol"].nunique()
-    })
-
-    cpu0 = _cpu_mb()
-    t0 = time.time()
-    rss0 = _rss_mb()
-    thread_df = parallel.compute_threading(df2,library="polars")
-    t1 = time.time()
-    rss1 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "threading",
-        "lib": "polares",
-        "seconds": round(t1 - t0, 6),
-        "rss_mb_delta": round(max(rss1 - rss0, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(thread_df),
-        "symbols": thread_df["symbol"].n_unique()
-    })
-
-    
-    cpu0 = _cpu_mb()
-    rss2 = _rss_mb()
-    t2 = time.time()
-    process_df = parallel.compute_multiprocessing(df1,library="pandas")
-    t3 = time.time()
-    rss3 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "multiprocessing",
-        "lib": "pandas",
-        "seconds": round(t3 - t2, 6),
-        "rss_mb_delta": round(max(rss3 - rss2, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(process_df),
-        "symbols": process_df["symbol"].nunique()
-    })
-
-    cpu0 = _cpu_mb()
-    rss2 = _rss_mb()
-    t2 = time.time()
-    process_df = parallel.compute_multiprocessing(df2,library="polars")
-    t3 = time.time()
-    rss3 = _rss_mb()
-    cpu1 = _cpu_mb()
-    rows.append({
-        "section": "multiprocessing",
-        "lib": "polares",
-        "seconds": round(t3 - t2, 6),
-        "rss_mb_delta": round(max(rss3 - rss2, 0.0), 2),
-        "cpu_mb_delta": round(max(cpu1 - cpu0, 0.0), 2),
-        "rows": len(process_df),
-        "symbols": process_df["symbol"].n_unique()
-    })
-
-    
+    run_stage("engine", "polars-lazy", lambda: parallel.compute_threading(df2, library="polars-lazy"))
 
 
     # json report file for portfolio
@@ -194,42 +78,41 @@ if __name__ == "__main__":
     with open("portfolio_snapshot_output.json","w",encoding="utf-8") as f:
         json.dump(snap_par, f, indent=2)
 
+    # tick -> metrics + portfolio latency, paced and unpaced
+    for rate in (5_000, None):
+        print("replay:", replay(df1, port, rate=rate, warmup_rows=1_000, limit=20_000).summary())
+
 
 
     # print summary table
-    perf_df = pd.DataFrame(rows)
+    perf_df = profiles_to_frame(profiles)
     print("\n=== Performance Summary ===")
     print(perf_df)
 
-    perf_df.to_csv("performance_summary.csv", index=False)
-        # bar plots
-
-    with open("performance_report.md", "w", encoding="utf-8") as f:
-        f.write("# Performance Report\n\n")
-        f.write(perf_df.to_markdown(index=False))
-        f.write("\n")
+    write_reports(perf_df, "performance_summary.csv", "performance_report.md", details=profiles)
 
+    # bar plots
     labels = [f"{a}|{b}" for a,b in zip(perf_df["section"].astype(str),
                                     perf_df["lib"].astype(str))]
 
     bar(perf_df["seconds"].astype(float).fillna(0.0),
         "seconds", "Performance: seconds", "performance_seconds.png")
 
-    if "rss_mb_delta" in perf_df.columns:
-        bar(perf_df["rss_mb_delta"].astype(float).fillna(0.0),
-            "MB", "Performance: RSS delta (MB)", "performance_rss_delta.png")
+    bar(perf_df["rss_mb_delta"].astype(float).fillna(0.0),
+        "MB", "Performance: RSS delta (MB)", "performance_rss_delta.png")
 
-    vms_col = "vms_mb_delta" if "vms_mb_delta" in perf_df.columns else (
-            "cpu_mb_delta" if "cpu_mb_delta" in perf_df.columns else None)
-    if vms_col:
-        bar(perf_df[vms_col].astype(float).fillna(0.0),
-            "MB", f"Performance: {vms_col}", "performance_vms_delta.png")
+    bar(perf_df["peak_rss_mb_delta"].astype(float).fillna(0.0),
+        "MB", "Performance: peak RSS delta incl. workers (MB)", "performance_peak_rss.png")
 
-    print("Saved: performance_seconds.png, performance_rss_delta.png, performance_vms_delta.png")# plot example for pandas rolling
+    print("Saved: performance_seconds.png, performance_rss_delta.png, performance_peak_rss.png")
 
+    # plot example for pandas rolling
     s = "AAPL"
     sub = rp[rp["symbol"]==s]
+    plt.figure()
     plt.plot(sub.index, sub["price"], label="price")
     plt.plot(sub.index, sub["ma"], label="ma")
     plt.legend()
-    plt.show()
+    plt.savefig(f"rolling_{s}.png", dpi=140)
+    plt.close()
+    print(f"Saved: rolling_{s}.png")
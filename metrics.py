@@ -1,25 +1,190 @@
+import numpy as np
 import pandas as pd
-import polars as pl
-
-def rolling_pandas(df, window=20):
-    df = df.reset_index(drop=False)
-    out = df.copy()
-    g = out.groupby("symbol", group_keys=False)
-    out["ret"] = g["price"].pct_change()
-    out["ma"] = g["price"].transform(lambda x: x.rolling(window).mean())
-    out["std"] = g["price"].transform(lambda x: x.rolling(window).std())
-    out["sharpe"] = g["ret"].transform(lambda x: x.rolling(window).mean() / x.rolling(window).std())
+import kernels
+from data_loader import collect
+
+# `window` is an int (columns ma, std, sharpe) or a list of ints, computed in
+# one call with suffixed columns (ma_5, std_5, sharpe_5, ma_20, ...); sorting,
+# grouping and dispatch happen once per call, not once per window.
+def window_list(window):
+    """(windows, suffixed) for an int or a list of windows."""
+    if isinstance(window, (int, np.integer)):
+        return [int(window)], False
+    windows = list(dict.fromkeys(int(w) for w in window))
+    if not windows:
+        raise ValueError("window list is empty")
+    return windows, True
+
+def window_column(name, w, suffixed):
+    return f"{name}_{w}" if suffixed else name
+
+def metric_names(windows, suffixed):
+    return ["ret"] + [window_column(name, w, suffixed) for w in windows for name in ("ma", "std", "sharpe")]
+
+# Both functions also accept a LazyFrame from data_loader.scan_market_data.
+# output="metrics" returns only the metric columns, row-aligned to the input
+# (same index for pandas, same row order for polars) instead of a full copy;
+# float32=True stores the metric columns as float32 (computed in float64).
+def rolling_pandas(df, window=20, method="numpy", output="full", float32=False):
+    """
+    method="numpy" sorts rows by symbol once (stable, so each symbol keeps its
+    row order) and computes every symbol in one pass with the kernels module;
+    method="groupby" is the original per-group transform path. Both return the
+    same frame.
+    """
+    df = collect(df, library="pandas")
+    windows, suffixed = window_list(window)
+    if output not in ("full", "metrics"):
+        raise ValueError("output must be 'full' or 'metrics'")
+    if method == "numpy":
+        cols = _rolling_pandas_numpy(df, windows, suffixed)
+    elif method == "groupby":
+        cols = _rolling_pandas_groupby(df, windows, suffixed)
+    else:
+        raise ValueError("method must be 'numpy' or 'groupby'")
+    return _with_columns(df, cols, output, float32)
+
+def _with_columns(df, cols, output, float32):
+    dtype = np.float32 if float32 else np.float64
+    if output == "metrics":
+        return pd.DataFrame({name: col.astype(dtype, copy=False) for name, col in cols.items()}, index=df.index)
+    out = df.reset_index(drop=False)
+    for name, col in cols.items():
+        out[name] = col.astype(dtype, copy=False)
+    return out
+
+def _rolling_pandas_groupby(df, windows, suffixed):
+    keys = df["symbol"].to_numpy()
+    price = df["price"].reset_index(drop=True)
+    g = price.groupby(keys, sort=False)
+    ret = g.pct_change()
+    gr = ret.groupby(keys, sort=False)
+    cols = {"ret": ret}
+    for w in windows:
+        cols[window_column("ma", w, suffixed)] = g.transform(lambda x: x.rolling(w).mean())
+        cols[window_column("std", w, suffixed)] = g.transform(lambda x: x.rolling(w).std())
+        cols[window_column("sharpe", w, suffixed)] = gr.transform(lambda x: x.rolling(w).mean() / x.rolling(w).std())
+    return {name: col.to_numpy(dtype=np.float64) for name, col in cols.items()}
+
+def _rolling_pandas_numpy(df, windows, suffixed, first_pos=None):
+    """`first_pos` (rolling_chunked) is each row's count of earlier rows of its symbol not in `df`."""
+    codes, _ = pd.factorize(df["symbol"])
+    order = np.argsort(codes, kind="stable")
+    pos = kernels.group_positions(codes[order])
+    price = df["price"].to_numpy(dtype=np.float64)[order]
+
+    ret = kernels.pct_change(price, pos)
+    cols = {"ret": ret}
+    if first_pos is not None:
+        pos = pos + first_pos[order]
+    # one pass of prefix sums per column; every window is read off the same sums
+    price_sums = kernels.RollingSums(price, pos, max(windows), codes[order])
+    ret_sums = kernels.RollingSums(ret, pos, max(windows), codes[order])
+    for w in windows:
+        ma, sd = price_sums.mean_std(w)
+        ret_ma, ret_sd = ret_sums.mean_std(w)
+        cols[window_column("ma", w, suffixed)] = ma
+        cols[window_column("std", w, suffixed)] = sd
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cols[window_column("sharpe", w, suffixed)] = ret_ma / ret_sd
+
+    missing = codes[order] < 0  # rows without a symbol get no group, like groupby
+    out = {}
+    for name, sorted_vals in cols.items():
+        sorted_vals[missing] = np.nan
+        vals = np.empty_like(sorted_vals)
+        vals[order] = sorted_vals
+        out[name] = vals
     return out
 
-def rolling_polars(df, window=20):
+def rolling_polars(df, window=20, output="full", float32=False):
+    import polars as pl
+    windows, suffixed = window_list(window)
+    if output not in ("full", "metrics"):
+        raise ValueError("output must be 'full' or 'metrics'")
+    if output == "metrics":
+        df = df.with_row_index("__row")
     df = df.sort(["symbol", "timestamp"])
     df = df.with_columns((pl.col("price") / pl.col("price").shift(1) - 1).over("symbol").alias("ret"))
-    df = df.with_columns([
-        pl.col("price").rolling_mean(window_size=window).over("symbol").alias("ma"),
-        pl.col("price").rolling_std(window_size=window).over("symbol").alias("std"),
-        pl.col("ret").rolling_mean(window_size=window).over("symbol").alias("m"),
-        pl.col("ret").rolling_std(window_size=window).over("symbol").alias("s"),
-    ])
-    df = df.with_columns((pl.col("m") / pl.col("s")).alias("sharpe")).drop(["m","s"])
-    return df
+    exprs = []
+    for w in windows:
+        exprs += [
+            pl.col("price").rolling_mean(window_size=w).over("symbol").alias(window_column("ma", w, suffixed)),
+            pl.col("price").rolling_std(window_size=w).over("symbol").alias(window_column("std", w, suffixed)),
+            (pl.col("ret").rolling_mean(window_size=w) / pl.col("ret").rolling_std(window_size=w))
+            .over("symbol").alias(window_column("sharpe", w, suffixed)),
+        ]
+    df = df.with_columns(exprs)
+    names = metric_names(windows, suffixed)
+    if float32:
+        df = df.with_columns([pl.col(c).cast(pl.Float32) for c in names])
+    if output == "metrics":
+        df = df.sort("__row").select(names)
+    # a LazyFrame input runs the whole pipeline lazily and is collected once here
+    return collect(df)
+
+# ---------- out-of-core (chunked) rolling ----------
+def _source_chunks(source, chunk_rows):
+    """pandas frames (timestamp index, like load_pandas) from a CSV path or an iterable of frames."""
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        for chunk in pd.read_csv(source, chunksize=chunk_rows):
+            chunk["timestamp"] = pd.to_datetime(chunk["timestamp"])
+            yield chunk.set_index("timestamp")
+        return
+    for chunk in source:
+        yield collect(chunk, library="pandas")
+
+def rolling_chunked(source, out_path, window=20, chunk_rows=500_000, output="full", float32=False):
+    """
+    Out-of-core rolling_pandas (method="numpy"). `source` is a CSV path (read
+    `chunk_rows` at a time) or an iterable of pandas/polars frames, in time
+    order. For every symbol the rows from the start of the prefix-sum piece
+    its next windows reach into are carried into the next chunk (with one
+    row before it for returns), together with the symbol's row count so far,
+    so the rows written are bit-identical to rolling_pandas on the whole
+    source. Results are appended to the Parquet file `out_path` one row group
+    per chunk, so peak memory is about one chunk plus symbols x (window +
+    kernels.segment_rows(window) + 1) carried rows.
+    Returns {"path", "rows", "chunks", "carried_rows"}.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    windows, suffixed = window_list(window)
+    keep = max(windows)
+    seg = kernels.segment_rows(keep)
+    carry = None
+    carry_pos = pd.Series(dtype=np.int64)   # symbol -> row number of its first carried row
+    writer = None
+    rows = chunks = 0
+    try:
+        for chunk in _source_chunks(source, chunk_rows):
+            frame = chunk if carry is None else pd.concat([carry, chunk])
+            n_carried = 0 if carry is None else len(carry)
+            sym = frame["symbol"]
+            rank = frame.groupby("symbol", sort=False, observed=True).cumcount().to_numpy()
+            first_pos = sym.map(carry_pos).fillna(0).to_numpy(dtype=np.int64)
+            cols = _rolling_pandas_numpy(frame, windows, suffixed, first_pos=first_pos)
+            out = _with_columns(frame, cols, output, float32).iloc[n_carried:]
+            if output == "metrics":
+                out = out.reset_index(drop=True)
+
+            table = pa.Table.from_pandas(out, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(out)
+            chunks += 1
 
+            # keep rows from one before the piece holding the first row the next windows need
+            known = sym.notna().to_numpy()
+            row_no = pd.Series((rank + first_pos)[known])
+            keys = sym.to_numpy()[known]
+            seen = row_no.groupby(keys, sort=False).max() + 1
+            carry_pos = (((seen - keep + 1).clip(lower=0) // seg) * seg - 1).clip(lower=0)
+            carry = frame[known][(row_no >= pd.Series(keys).map(carry_pos)).to_numpy()]
+    finally:
+        if writer is not None:
+            writer.close()
+    return {"path": str(out_path), "rows": rows, "chunks": chunks,
+            "carried_rows": 0 if carry is None else len(carry)}
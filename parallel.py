@@ -1,81 +1,457 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+import numpy as np
 import pandas as pd
-import polars as pl
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
-import multiprocessing as mp
+from shared_panel import SharedPanel, SharedBlock, attach_panel, attach_block
+from workers import thread_executor, process_executor, default_context
+from data_loader import collect
+from metrics import window_list, window_column
 
-# Pandas metrics
-def compute_metrics_for_symbol(df_symbol: pd.DataFrame, window=20):
+if TYPE_CHECKING:
+    import polars as pl
+
+logger = logging.getLogger(__name__)
+
+METRIC_COLUMNS = ["return", "ma", "std", "sharpe"]
+
+def metric_columns(window=20):
+    """Output columns for `window` (an int or a list of windows, see metrics.window_list)."""
+    windows, suffixed = window_list(window)
+    return ["return"] + [window_column(name, w, suffixed) for w in windows for name in METRIC_COLUMNS[1:]]
+
+def _check_output(output):
+    if output not in ("full", "metrics"):
+        raise ValueError("output must be 'full' or 'metrics'")
+
+# Pandas metrics; `window` may be a list, computed in the same call.
+# output="metrics" returns only the metric columns (same index as the input),
+# float32=True stores them as float32; see metrics.rolling_pandas.
+def compute_metrics_for_symbol(df_symbol: pd.DataFrame, window=20, output="full", float32=False):
+    _check_output(output)
+    windows, suffixed = window_list(window)
+    price = df_symbol["price"]
+    ret = price.pct_change()
+    cols = {"return": ret}
+    for w in windows:
+        std = ret.rolling(w).std()
+        cols[window_column("ma", w, suffixed)] = price.rolling(w).mean()
+        cols[window_column("std", w, suffixed)] = std
+        cols[window_column("sharpe", w, suffixed)] = ret / std
+    dtype = np.float32 if float32 else np.float64
+    if output == "metrics":
+        return pd.DataFrame({name: col.to_numpy(dtype=dtype) for name, col in cols.items()}, index=df_symbol.index)
     df_symbol = df_symbol.copy()
-    df_symbol["return"] = df_symbol["price"].pct_change()
-    df_symbol["ma"] = df_symbol["price"].rolling(window).mean()
-    df_symbol["std"] = df_symbol["return"].rolling(window).std()
-    df_symbol["sharpe"] = df_symbol["return"] / df_symbol["std"]
+    for name, col in cols.items():
+        df_symbol[name] = col.astype(dtype) if float32 else col
     return df_symbol
 
 # Polars metrics
-def polars_compute_metrics(df_symbol: pl.DataFrame, window=20):
+def polars_compute_metrics(df_symbol: pl.DataFrame, window=20, output="full", float32=False):
+    import polars as pl
+    _check_output(output)
+    windows, suffixed = window_list(window)
     # compute return first
     df_symbol = df_symbol.with_columns([
         pl.col("price").pct_change().alias("return")
     ])
     # compute rolling metrics
-    df_symbol = df_symbol.with_columns([
-        pl.col("price").rolling_mean(window).alias("ma"),
-        pl.col("return").rolling_std(window).alias("std"),
-        (pl.col("return") / pl.col("return").rolling_std(window)).alias("sharpe")
-    ])
-    return df_symbol
+    exprs = []
+    for w in windows:
+        exprs += [
+            pl.col("price").rolling_mean(w).alias(window_column("ma", w, suffixed)),
+            pl.col("return").rolling_std(w).alias(window_column("std", w, suffixed)),
+            (pl.col("return") / pl.col("return").rolling_std(w)).alias(window_column("sharpe", w, suffixed)),
+        ]
+    df_symbol = df_symbol.with_columns(exprs)
+    return _finish_polars(df_symbol, metric_columns(window), output, float32)
 
+def _finish_polars(df, columns, output, float32):
+    import polars as pl
+    if float32:
+        df = df.with_columns([pl.col(c).cast(pl.Float32) for c in columns])
+    return df.select(columns) if output == "metrics" else df
 
-# Threading
-def compute_threading(df, library="pandas", window=20):
-    results = []
+# Polars lazy: one .over("symbol") pipeline for all symbols, run by the engine
+def _collect_streaming(lf: pl.LazyFrame) -> pl.DataFrame:
+    try:
+        return lf.collect(engine="streaming")
+    except TypeError:  # polars < 1.23
+        return lf.collect(streaming=True)
 
-    # split into groups
+def compute_polars_lazy(df, window=20, output="full", float32=False):
+    """
+    Same columns as polars_compute_metrics, built once as .over("symbol")
+    expressions on a LazyFrame and collected with the streaming engine, so
+    polars parallelizes internally instead of Python threads/processes.
+    Rows come back grouped by symbol (sorted), each symbol in input order;
+    with output="metrics" only the metric columns come back, in input order.
+    """
+    import polars as pl
+    _check_output(output)
+    windows, suffixed = window_list(window)
+    lf = df.lazy() if isinstance(df, pl.DataFrame) else df
+    if output == "metrics":
+        lf = lf.with_row_index("__row")
+    ret = pl.col("price").pct_change()
+    exprs = [ret.over("symbol").alias("return")]
+    for w in windows:
+        exprs += [
+            pl.col("price").rolling_mean(w).over("symbol").alias(window_column("ma", w, suffixed)),
+            ret.rolling_std(w).over("symbol").alias(window_column("std", w, suffixed)),
+            (ret / ret.rolling_std(w)).over("symbol").alias(window_column("sharpe", w, suffixed)),
+        ]
+    lf = lf.sort("symbol", maintain_order=True).with_columns(exprs)
+    if output == "metrics":
+        lf = lf.sort("__row")
+    return _collect_streaming(_finish_polars(lf, metric_columns(window), output, float32))
+
+LIBRARIES = ("pandas", "polars", "polars-lazy")
+
+
+def _split_groups(df, library, output):
+    """
+    (func, per-symbol groups, source rows of the concatenated groups or None).
+    With output="metrics" only the price column is shipped and the source
+    rows are kept so results can be put back in input order.
+    """
+    _check_output(output)
     if library == "pandas":
         func = compute_metrics_for_symbol
-        groups = [df_symbol for _, df_symbol in df.groupby("symbol")]
-    elif library == "polars":
+        if output == "full":
+            return func, [df_symbol for _, df_symbol in df.groupby("symbol")], None
+        idx = list(df.groupby("symbol").indices.values())
+        price = df[["price"]]
+        return func, [price.iloc[i] for i in idx], np.concatenate(idx)
+    if library == "polars":
         func = polars_compute_metrics
-        groups = [df.filter(pl.col("symbol") == s) for s in df["symbol"].unique().to_list()]
-    else:
-        raise ValueError("library must be 'pandas' or 'polars'")
+        if output == "full":
+            return func, df.partition_by("symbol", maintain_order=True), None  # one pass, not one filter per symbol
+        parts = df.select("symbol", "price").with_row_index("__row").partition_by("symbol", maintain_order=True)
+        return func, [p.select("price") for p in parts], np.concatenate([p["__row"].to_numpy() for p in parts])
+    raise ValueError("library must be 'pandas', 'polars' or 'polars-lazy'")
+
+def _combine(results, library, rows, df):
+    if library == "pandas":
+        final_df = pd.concat(results)
+        if rows is not None:
+            final_df = final_df.iloc[np.argsort(rows, kind="stable")]
+            final_df.index = df.index
+        return final_df
+    import polars as pl
+    final_df = pl.concat(results)
+    return final_df if rows is None else final_df[np.argsort(rows, kind="stable")]
+
+
+# Threading
+def compute_threading(df, library="pandas", window=20, pool=None, output="full", float32=False,
+                      max_workers=None):
+    """
+    `pool` is an optional long-lived workers.WorkerPool whose threads are reused;
+    `max_workers` caps how many threads run at once (default: all of them).
+    `df` may also be a LazyFrame from data_loader.scan_market_data.
+    output="metrics" returns only the metric columns aligned to the input rows
+    (pandas: same index) and float32=True stores them as float32.
+    """
+    if library == "polars-lazy":
+        return compute_polars_lazy(df, window, output, float32)
+    results = []
+
+    # split into groups
+    df = collect(df, library)
+    func, groups, rows = _split_groups(df, library, output)
 
     # submit to threads
-    with ThreadPoolExecutor() as executor:
+    with thread_executor(pool, max_workers) as executor:
         for df_symbol in groups:
-            results.append(executor.submit(func, df_symbol, window))
+            results.append(executor.submit(func, df_symbol, window, output, float32))
 
     # collect results
+    return _combine([f.result() for f in results], library, rows, df)
+
+
+# Shared-memory worker: reads its price slice from the panel and writes the
+# metric columns into the output block, so nothing but descriptors is pickled
+def _shared_metrics_task(panel_spec, out_spec, offset, length, window=20):
+    price = pd.Series(attach_panel(panel_spec)["price"][offset:offset + length], copy=False)
+    out = attach_block(out_spec)[:, offset:offset + length]
+    ret = price.pct_change()
+    out[0] = ret.to_numpy()
+    for k, w in enumerate(window_list(window)[0]):
+        std = ret.rolling(w).std()
+        out[1 + 3 * k] = price.rolling(w).mean().to_numpy()
+        out[2 + 3 * k] = std.to_numpy()
+        out[3 + 3 * k] = (ret / std).to_numpy()
+    return length
+
+
+def _compute_multiprocessing_shared(df, library, window, panel, pool=None, output="full", float32=False,
+                                    max_workers=None):
+    spec = panel.spec
+    columns = metric_columns(window)
+    with SharedBlock(len(columns), spec.n_rows) as out:
+        with process_executor(pool, max_workers) as executor:
+            futs = [executor.submit(_shared_metrics_task, spec, out.spec,
+                                    spec.offsets[i], spec.offsets[i + 1] - spec.offsets[i], window)
+                    for i in range(len(spec.symbols))]
+            for f in futs:
+                f.result()
+        metrics = out.array.astype(np.float32 if float32 else np.float64)
+
+    if output == "metrics":
+        aligned = np.empty_like(metrics)
+        aligned[:, panel.order] = metrics
+        if library == "pandas":
+            return pd.DataFrame(dict(zip(columns, aligned)), index=df.index)
+        import polars as pl
+        return pl.DataFrame([pl.Series(name, col, nan_to_null=True) for name, col in zip(columns, aligned)])
+
+    # rows come back grouped by symbol, like the per-group concat below
     if library == "pandas":
-        final_df = pd.concat([f.result() for f in results])
+        final_df = df.iloc[panel.order].copy()
+        for name, col in zip(columns, metrics):
+            final_df[name] = col
     else:
-        final_df = pl.concat([f.result() for f in results])
-
+        import polars as pl
+        final_df = df[panel.order].with_columns([
+            pl.Series(name, col, nan_to_null=True) for name, col in zip(columns, metrics)
+        ])
     return final_df
 
 
 # Multiprocessing
-def compute_multiprocessing(df, library="pandas", window=20):
+def compute_multiprocessing(df, library="pandas", window=20, shared=False, panel=None, pool=None,
+                            output="full", float32=False, chunksize=1, max_workers=None):
+    """
+    shared=True (or passing a prebuilt SharedPanel as `panel`) copies the price
+    columns into shared memory once; workers attach zero-copy views instead of
+    receiving pickled per-symbol frames. `pool` is an optional long-lived
+    workers.WorkerPool whose processes are reused across calls. `df` may also
+    be a LazyFrame from data_loader.scan_market_data. library="polars-lazy"
+    runs compute_polars_lazy instead (same for compute_threading). `window`
+    may be a list of windows: all are computed per task, giving suffixed
+    columns (ma_20, std_60, ...), so groups are split and shipped once.
+    `output`/`float32` are as for compute_threading; with output="metrics"
+    only prices are pickled to the workers. `chunksize` symbols are sent to
+    a worker per task (ProcessPoolExecutor.map). `max_workers` caps how
+    many worker processes run at once (default: all of the pool's).
+    """
+    if library not in LIBRARIES:
+        raise ValueError("library must be 'pandas', 'polars' or 'polars-lazy'")
+    if library == "polars-lazy":
+        # the engine owns parallelism; a process pool would only add IPC
+        return compute_polars_lazy(df, window, output, float32)
+    _check_output(output)
+    df = collect(df, library)
+    if panel is not None:
+        return _compute_multiprocessing_shared(df, library, window, panel, pool, output, float32, max_workers)
+    if shared:
+        with SharedPanel.from_frame(df) as panel:
+            return _compute_multiprocessing_shared(df, library, window, panel, pool, output, float32, max_workers)
+
     # split into groups
-    if library == "pandas":
-        func = compute_metrics_for_symbol
-        groups = [df_symbol for _, df_symbol in df.groupby("symbol")]
-    elif library == "polars":
-        func = polars_compute_metrics
-        groups = [df.filter(pl.col("symbol") == s) for s in df["symbol"].unique().to_list()]
-    else:
-        raise ValueError("library must be 'pandas' or 'polars'")
+    func, groups, rows = _split_groups(df, library, output)
 
     # map to processes
-    with ProcessPoolExecutor(mp.cpu_count()) as executor:
-        results = list(executor.map(func, groups, [window]*len(groups)))
+    n = len(groups)
+    with process_executor(pool, max_workers) as executor:
+        results = list(executor.map(func, groups, [window] * n, [output] * n, [float32] * n,
+                                    chunksize=chunksize))
 
     # collect results
-    if library == "pandas":
-        final_df = pd.concat(results)
-    else:
-        final_df = pl.concat(results)
+    return _combine(results, library, rows, df)
 
-    return final_df
 
+# ---------- adaptive execution ----------
+# compute_auto picks serial, thread, process or engine (polars-lazy) execution
+# from a cost model fed by a one-time calibration of this host: per-call and
+# per-row compute cost of each backend, how much threads actually speed it up
+# (GIL), process pool startup, per-task round trip and per-row pickling cost.
+EXECUTION_MODES = ("serial", "thread", "process", "engine")
+
+
+def _echo(x):
+    return x
+
+
+def _sample_frame(n_symbols=8, rows_per_symbol=2500, seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0.0, 1e-3, (rows_per_symbol, n_symbols))
+    prices = 100.0 * np.exp(np.cumsum(steps, axis=0))
+    ts = pd.date_range("2024-01-01", periods=rows_per_symbol, freq="1s")
+    return pd.DataFrame({
+        "symbol": np.tile([f"S{i}" for i in range(n_symbols)], rows_per_symbol),
+        "price": prices.ravel(),
+    }, index=pd.DatetimeIndex(np.repeat(ts.to_numpy(), n_symbols), name="timestamp"))
+
+
+def _best_of(fn, repeat=3) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+@dataclass
+class Calibration:
+    cpu_count: int
+    call_s: dict                  # library -> fixed cost of one per-symbol call
+    row_s: dict                   # library -> cost per row inside a call
+    thread_speedup: dict          # library -> serial time / threaded time on this host
+    thread_task_s: float          # submit + result overhead of one thread task
+    process_startup_s: float      # transient process pool: start + first task
+    process_task_s: float         # round trip of an empty task through a warm pool
+    ipc_row_s: float              # pickling a row to a worker and its metrics back
+    engine_call_s: float          # polars-lazy fixed cost (inf when polars was not measured)
+    engine_row_s: float           # polars-lazy cost per row
+
+
+_calibration = None
+_calibration_lock = threading.Lock()
+
+
+def calibrate(pool=None, force=False, polars: bool | None = None) -> Calibration:
+    """
+    Measure this host once (cached for the process; force=True re-measures).
+    `pool` is used for the warm-pool task and IPC costs when given. The
+    polars backends are measured when `polars` is true, by default only if
+    polars is already imported, so pandas-only processes never load it; a
+    cached calibration without them is re-measured when they are asked for.
+    """
+    global _calibration
+    if polars is None:
+        polars = "polars" in sys.modules
+    with _calibration_lock:
+        if _calibration is not None and not force and (not polars or "polars" in _calibration.row_s):
+            return _calibration
+        sample = _sample_frame()
+        pdf_groups = [g for _, g in sample.groupby("symbol")]
+        rows = len(pdf_groups[0])
+        backends = [("pandas", compute_metrics_for_symbol, sample, pdf_groups)]
+        if polars:
+            import polars as pl
+            pl_sample = pl.from_pandas(sample.reset_index())
+            backends.append(("polars", polars_compute_metrics, pl_sample,
+                             pl_sample.partition_by("symbol", maintain_order=True)))
+
+        call_s, row_s, speedup = {}, {}, {}
+        for lib, func, whole, groups in backends:
+            tiny = groups[0][:50]
+            call_s[lib] = _best_of(lambda: func(tiny))
+            row_s[lib] = max(_best_of(lambda: func(whole)) - call_s[lib], 0.0) / len(whole)
+            serial = _best_of(lambda: [func(g) for g in groups])
+            with thread_executor(pool) as ex:
+                threaded = _best_of(lambda: [f.result() for f in [ex.submit(func, g) for g in groups]])
+            speedup[lib] = serial / threaded if threaded > 0 else 1.0
+        with thread_executor(pool) as ex:
+            thread_task_s = _best_of(lambda: [f.result() for f in [ex.submit(_echo, 0) for _ in range(50)]]) / 50
+
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(1, mp_context=default_context()) as ex:
+            ex.submit(_echo, 0).result()
+        startup = time.perf_counter() - t0
+        with process_executor(pool) as ex:
+            ex.submit(_echo, 0).result()  # warm
+            task_s = _best_of(lambda: [f.result() for f in [ex.submit(_echo, 0) for _ in range(20)]]) / 20
+            payload = compute_metrics_for_symbol(pdf_groups[0])  # result is larger than the input
+            ipc = _best_of(lambda: ex.submit(_echo, payload).result())
+        ipc_row_s = max(ipc - task_s, 0.0) / rows
+
+        engine_call_s = engine_row_s = math.inf
+        if polars:
+            engine_call_s = _best_of(lambda: compute_polars_lazy(pl_sample.head(50)))
+            engine_row_s = max(_best_of(lambda: compute_polars_lazy(pl_sample)) - engine_call_s, 0.0) / pl_sample.height
+
+        _calibration = Calibration(
+            cpu_count=os.cpu_count() or 1, call_s=call_s, row_s=row_s, thread_speedup=speedup,
+            thread_task_s=thread_task_s, process_startup_s=startup, process_task_s=task_s,
+            ipc_row_s=ipc_row_s, engine_call_s=engine_call_s, engine_row_s=engine_row_s,
+        )
+        logger.info("calibration: %s", asdict(_calibration))
+        return _calibration
+
+
+@dataclass
+class ExecutionPlan:
+    mode: str                     # one of EXECUTION_MODES
+    library: str
+    max_workers: int
+    chunksize: int                # symbols per process task
+    estimates: dict = field(default_factory=dict)   # mode -> estimated seconds
+
+    def describe(self) -> str:
+        est = ", ".join(f"{m}={s:.4f}s" for m, s in sorted(self.estimates.items(), key=lambda kv: kv[1]))
+        return (f"mode={self.mode} library={self.library} workers={self.max_workers} "
+                f"chunksize={self.chunksize} estimates[{est}]")
+
+
+def plan_execution(n_rows: int, n_symbols: int, library="pandas", window=20, pool=None,
+                   calibration: Calibration | None = None) -> ExecutionPlan:
+    """Estimate each execution mode for this input size and pick the cheapest."""
+    if library not in ("pandas", "polars"):
+        raise ValueError("library must be 'pandas' or 'polars'")
+    cal = calibration or calibrate(pool, polars=library == "polars" or None)
+    n_windows = len(window_list(window)[0])
+    n_symbols = max(n_symbols, 1)
+
+    workers = min(pool.max_workers if pool is not None else cal.cpu_count, n_symbols)
+    compute = n_symbols * cal.call_s[library] + n_rows * cal.row_s[library] * n_windows
+    tasks_per_worker = 4  # a few tasks each so stragglers even out
+    chunksize = max(1, math.ceil(n_symbols / (workers * tasks_per_worker)))
+    n_tasks = math.ceil(n_symbols / chunksize)
+    warm = pool is not None and pool.processes_started > 0
+
+    estimates = {
+        "serial": compute,
+        "thread": n_symbols * cal.thread_task_s + compute / max(min(cal.thread_speedup[library], workers), 1e-3),
+        "process": (0.0 if warm else cal.process_startup_s) + n_tasks * cal.process_task_s
+                   + n_rows * cal.ipc_row_s * n_windows + compute / max(min(workers, cal.cpu_count), 1),
+    }
+    if library == "polars":
+        estimates["engine"] = cal.engine_call_s + n_rows * cal.engine_row_s * n_windows
+    mode = min(estimates, key=estimates.get)
+    return ExecutionPlan(mode=mode, library=library, max_workers=workers if mode in ("thread", "process") else 1,
+                         chunksize=chunksize if mode == "process" else 1, estimates=estimates)
+
+
+def _compute_serial(df, library, window=20, output="full", float32=False):
+    func, groups, rows = _split_groups(df, library, output)
+    return _combine([func(g, window, output, float32) for g in groups], library, rows, df)
+
+
+def compute_auto(df, library="pandas", window=20, pool=None, output="full", float32=False,
+                 calibration: Calibration | None = None, plan: ExecutionPlan | None = None):
+    """
+    Run the metrics with the execution mode plan_execution picks for this
+    input (or the given `plan`); the decision is logged at INFO on the
+    `parallel` logger. Thread/process modes reuse `pool` when given and use
+    at most the plan's `max_workers` of its workers.
+    """
+    df = collect(df, library)
+    if plan is None:
+        if library == "pandas":
+            n_rows, n_symbols = len(df), df["symbol"].nunique()
+        else:
+            n_rows, n_symbols = df.height, df["symbol"].n_unique()
+        plan = plan_execution(n_rows, n_symbols, library, window, pool, calibration)
+    logger.info("compute_auto: %s", plan.describe())
+
+    if plan.mode == "serial":
+        return _compute_serial(df, library, window, output, float32)
+    if plan.mode == "thread":
+        return compute_threading(df, library, window, pool, output, float32, max_workers=plan.max_workers)
+    if plan.mode == "process":
+        return compute_multiprocessing(df, library, window, pool=pool, output=output, float32=float32,
+                                       chunksize=plan.chunksize, max_workers=plan.max_workers)
+    if plan.mode == "engine":
+        return compute_polars_lazy(df, window, output, float32)
+    raise ValueError(f"unknown execution mode {plan.mode!r}")
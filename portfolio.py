@@ -1,9 +1,15 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Dict, Any, List, Tuple
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Any, List, Set, Tuple
+import heapq
+import math
+import threading
 import numpy as np
 import pandas as pd
+import kernels
+from shared_panel import SharedPanel, SortedPanel, attach_panel, sort_by_symbol
+from workers import WorkerPool
 
 # ---------- core helpers (self-contained; no changes to metrics.py needed) ----------
 def _pct_returns(price: pd.Series) -> pd.Series:
@@ -23,12 +29,57 @@ def _max_drawdown_pct(price: pd.Series) -> float:
     dd = price / peak - 1.0
     return float(dd.min())
 
-def _series_for_symbol(panel: pd.DataFrame, symbol: str) -> pd.Series:
-    sub = panel[panel["symbol"] == symbol]
+def _as_i8(as_of, ts_dtype: str) -> np.ndarray:
+    """Timestamp(s) (str, datetime, pd.Timestamp or a sequence) as int64 in the panel's unit."""
+    idx = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(np.asarray(as_of, dtype=object))))
+    if idx.tz is not None:
+        idx = idx.tz_convert("UTC").tz_localize(None)
+    return idx.to_numpy().astype(ts_dtype).view(np.int64)
 
+def _is_batch(as_of) -> bool:
+    return isinstance(as_of, (list, tuple, np.ndarray, pd.Index, pd.Series))
 
-    sub = sub.sort_index()
-    return sub["price"].astype(float)
+def _as_of_i8(as_of, ts_dtype: str) -> int:
+    """One `as_of` timestamp as int64; a batch here would silently value at its first entry."""
+    if _is_batch(as_of):
+        raise TypeError("as_of must be a single timestamp here; "
+                        "pass a list to aggregate_portfolio_as_of or the aggregate_portfolio_* functions")
+    return int(_as_i8(as_of, ts_dtype)[0])
+
+
+@dataclass
+class PriceIndex:
+    """
+    Price panel sorted once by (symbol, timestamp) with per-symbol row offsets,
+    so looking up a symbol's series is a slice instead of a boolean-mask scan.
+    With `as_of`, the slice ends at the last row at or before that timestamp
+    (binary search on the symbol's sorted timestamps).
+    """
+    panel: SortedPanel
+    slices: Dict[str, Tuple[int, int]]
+
+    def bounds(self, symbol: str, as_of=None) -> Tuple[int, int]:
+        start, stop = self.slices.get(symbol, (0, 0))
+        if as_of is not None:
+            ts = self.panel.timestamps[start:stop]
+            stop = start + int(np.searchsorted(ts, _as_of_i8(as_of, self.panel.ts_dtype), side="right"))
+        return start, stop
+
+    def stamp(self, symbol: str, as_of=None) -> Tuple[int, int | None]:
+        """(rows, last timestamp) of the symbol's slice: identifies the data a metric was computed from."""
+        start, stop = self.bounds(symbol, as_of)
+        return stop - start, int(self.panel.timestamps[stop - 1]) if stop > start else None
+
+    def series(self, symbol: str, as_of=None) -> pd.Series:
+        start, stop = self.bounds(symbol, as_of)
+        sp = self.panel
+        idx = pd.DatetimeIndex(sp.timestamps[start:stop].view(sp.ts_dtype), name="timestamp")
+        return pd.Series(sp.prices[start:stop], index=idx, name="price")
+
+def build_price_index(price_panel: pd.DataFrame) -> PriceIndex:
+    sp = sort_by_symbol(price_panel)
+    slices = {s: (sp.offsets[i], sp.offsets[i + 1]) for i, s in enumerate(sp.symbols)}
+    return PriceIndex(panel=sp, slices=slices)
 
 
 @dataclass
@@ -40,12 +91,67 @@ class PositionOut:
     
 
 
-# Compute metrics for a single position
-def _compute_position(symbol: str, quantity: float, price_series: pd.Series, vol_window: int = 20) -> Dict[str, Any]:
-    
-    value_now = float(price_series.iloc[-1]) * float(quantity) if not price_series.empty else np.nan
-    vol_pct   = _rolling_vol_pct(price_series, window=vol_window)     
-    dd_pct    = _max_drawdown_pct(price_series)                       
+# ---------- per-symbol risk table ----------
+# Per-symbol metrics (last price, volatility, drawdown) are computed for many
+# symbols at once with kernels.trailing_risk on a right-aligned matrix (one
+# column per symbol's own observations, so ragged histories line up on their
+# latest tick). Columns are processed in blocks of at most `max_cells` cells.
+_MAX_CELLS = 1 << 24
+
+def _risk_arrays(x: np.ndarray, starts, lengths, vol_window: int = 20,
+                 max_cells: int = _MAX_CELLS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    k = len(lengths)
+    last, vol, dd = np.full(k, np.nan), np.full(k, np.nan), np.full(k, np.nan)
+    order = np.argsort(-lengths, kind="stable")  # longest first: each block is sized by its first column
+    i = 0
+    while i < k:
+        rows = max(int(lengths[order[i]]), 1)
+        cols = order[i:i + max(1, max_cells // rows)]
+        m = kernels.right_aligned(x, starts[cols], lengths[cols])
+        last[cols], vol[cols], dd[cols] = kernels.trailing_risk(m, vol_window)
+        i += len(cols)
+    return last, vol, dd
+
+
+@dataclass
+class RiskTable:
+    """Per-symbol (last price, volatility, drawdown) arrays, aligned with `symbols`."""
+    symbols: List[str]
+    last: np.ndarray
+    volatility: np.ndarray
+    drawdown: np.ndarray
+
+    def __post_init__(self):
+        self._code = {s: i for i, s in enumerate(self.symbols)}
+
+    def metrics(self, symbol: str) -> Tuple[float, float, float]:
+        i = self._code[symbol]
+        return float(self.last[i]), float(self.volatility[i]), float(self.drawdown[i])
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({"last": self.last, "volatility": self.volatility, "drawdown": self.drawdown},
+                            index=pd.Index(self.symbols, name="symbol"))
+
+
+def risk_table(index: PriceIndex, symbols: List[str] | None = None, vol_window: int = 20,
+               as_of=None, max_cells: int = _MAX_CELLS) -> RiskTable:
+    """Metrics for `symbols` (default: every symbol in the index) in one vectorized pass."""
+    symbols = list(index.slices) if symbols is None else list(symbols)
+    bounds = np.array([index.bounds(s, as_of) for s in symbols], dtype=np.int64).reshape(-1, 2)
+    last, vol, dd = _risk_arrays(index.panel.prices, bounds[:, 0], bounds[:, 1] - bounds[:, 0], vol_window, max_cells)
+    return RiskTable(symbols=symbols, last=last, volatility=vol, drawdown=dd)
+
+
+# Per-symbol metrics: (last price, volatility, drawdown); independent of quantity
+def _symbol_metrics(price_series: pd.Series, vol_window: int = 20) -> Tuple[float, float, float]:
+    p = price_series.to_numpy(dtype=np.float64)
+    last, vol, dd = _risk_arrays(p, [0], [len(p)], vol_window)
+    return float(last[0]), float(vol[0]), float(dd[0])
+
+def _position_out(symbol: str, quantity: float, last: float, vol_pct: float, dd_pct: float) -> Dict[str, Any]:
+    value_now = last * float(quantity)
     return {
         "symbol": symbol,
         "value": round(value_now, 2),
@@ -53,6 +159,95 @@ def _compute_position(symbol: str, quantity: float, price_series: pd.Series, vol
         "drawdown": float(dd_pct) if np.isfinite(dd_pct) else np.nan,
     }
 
+# Compute metrics for a single position
+def _compute_position(symbol: str, quantity: float, price_series: pd.Series, vol_window: int = 20) -> Dict[str, Any]:
+    return _position_out(symbol, quantity, *_symbol_metrics(price_series, vol_window))
+
+def _shared_bounds(panel: SharedPanel, symbol: str, as_of=None) -> Tuple[int, int]:
+    """(offset, length) of `symbol` in a SharedPanel, cut at `as_of` like PriceIndex.bounds."""
+    offset, length = panel.spec.slice_for(symbol)
+    if as_of is not None:
+        ts = panel.views["timestamp"][offset:offset + length]
+        length = int(np.searchsorted(ts, _as_of_i8(as_of, panel.spec.ts_dtype), side="right"))
+    return offset, length
+
+def _shared_stamp(panel: SharedPanel, symbol: str, as_of=None) -> Tuple[int, int | None]:
+    """PriceIndex.stamp for a SharedPanel."""
+    offset, length = _shared_bounds(panel, symbol, as_of)
+    return length, int(panel.views["timestamp"][offset + length - 1]) if length else None
+
+def _stamp(price_panel, index: PriceIndex | None, symbol: str, as_of=None) -> Tuple[int, int | None]:
+    """Cache stamp of a symbol's slice, from the index or else the SharedPanel."""
+    return index.stamp(symbol, as_of) if index is not None else _shared_stamp(price_panel, symbol, as_of)
+
+# Shared-memory variant: the worker attaches to the panel and slices its prices
+def _symbol_metrics_shared(spec, offset: int, length: int, vol_window: int = 20) -> Tuple[float, float, float]:
+    price = attach_panel(spec)["price"][offset:offset + length]
+    return _symbol_metrics(pd.Series(price, copy=False), vol_window)
+
+
+# ---------- per-symbol metrics cache ----------
+class PositionMetricsCache:
+    """
+    Bounded LRU of per-symbol (last price, volatility, drawdown), keyed by
+    (symbol, vol_window, stamp). The stamp is PriceIndex.stamp: the number of
+    rows and the last timestamp of the slice the metrics were computed from,
+    so a panel with appended prices (or a later `as_of`) misses on its own
+    and the same slice hits whatever panel or `as_of` it came from.
+    Rewriting past prices in place keeps the stamp: call `invalidate(symbol)`
+    (or `invalidate()`) for that. Thread-safe.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple[str, int, Any], Tuple[float, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, symbol: str, vol_window: int, stamp=None):
+        with self._lock:
+            key = (symbol, vol_window, stamp)
+            hit = self._data.get(key)
+            if hit is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hit
+
+    def put(self, symbol: str, vol_window: int, metrics: Tuple[float, float, float], stamp=None):
+        with self._lock:
+            key = (symbol, vol_window, stamp)
+            self._data[key] = metrics
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, symbol: str, vol_window: int,
+                       compute: Callable[[], Tuple[float, float, float]], stamp=None) -> Tuple[float, float, float]:
+        hit = self.get(symbol, vol_window, stamp)
+        if hit is None:
+            hit = compute()
+            self.put(symbol, vol_window, hit, stamp)
+        return hit
+
+    def invalidate(self, symbol: str | None = None):
+        with self._lock:
+            if symbol is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] == symbol]:
+                del self._data[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._data), "maxsize": self.maxsize,
+                "hit_rate": self.hits / total if total else 0.0}
+
 def _aggregate_children(children: List[Dict[str, Any]]) -> Tuple[float, float, float]:
     """
     Returns: (total_value, aggregate_volatility, max_drawdown)
@@ -75,24 +270,9 @@ def _aggregate_children(children: List[Dict[str, Any]]) -> Tuple[float, float, f
         worst_dd = min(worst_dd, float(d or 0.0))
     return total, agg_vol, worst_dd
 
-
-# Main function: aggregate portfolio metrics sequentially for json
-def aggregate_portfolio_sequential(portfolio: Dict[str, Any],
-                                   price_panel: pd.DataFrame,
-                                   vol_window: int = 20) -> Dict[str, Any]:
-   
-    out: Dict[str, Any] = {"name": portfolio.get("name", "Portfolio")}
-    
-    pos_out: List[Dict[str, Any]] = []
-    for p in portfolio.get("positions", []):
-        sym, qty = p["symbol"], float(p["quantity"])
-        series = _series_for_symbol(price_panel, sym)
-        pos_out.append(_compute_position(sym, qty, series, vol_window))
-
-    subs_out: List[Dict[str, Any]] = []
-    for sp in portfolio.get("sub_portfolios", []):
-        subs_out.append(aggregate_portfolio_sequential(sp, price_panel, vol_window))
-
+def _rollup_node(out: Dict[str, Any], pos_out: List[Dict[str, Any]],
+                 subs_out: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fill a node's totals from its position and sub-portfolio outputs."""
     tv_pos, av_pos, dd_pos = _aggregate_children(pos_out)
     tv_sub, av_sub, dd_sub = _aggregate_children(subs_out)
     total_value = round(tv_pos + tv_sub, 2)
@@ -110,46 +290,631 @@ def aggregate_portfolio_sequential(portfolio: Dict[str, Any],
     return out
 
 
+# Main function: aggregate portfolio metrics sequentially for json
+def aggregate_portfolio_sequential(portfolio: Dict[str, Any],
+                                   price_panel: pd.DataFrame,
+                                   vol_window: int = 20,
+                                   index: PriceIndex | None = None,
+                                   cache: PositionMetricsCache | None = None,
+                                   as_of=None) -> Dict[str, Any] | List[Dict[str, Any]]:
+    """
+    `index` is a prebuilt PriceIndex for `price_panel`; built once per call if omitted.
+    `cache` is a PositionMetricsCache consulted before computing a symbol.
+    `as_of` values the tree with prices up to that timestamp (inclusive); a
+    list of timestamps returns a list with one snapshot per timestamp,
+    computed by aggregate_portfolio_as_of (without the cache).
+    """
+    if index is None:
+        index = build_price_index(price_panel)
+    if _is_batch(as_of):
+        return [v.to_snapshot() for v in aggregate_portfolio_as_of(portfolio, price_panel, as_of, vol_window, index)]
+
+    metrics = _tree_metrics(flatten_portfolio(portfolio).symbols(), index, vol_window, cache, as_of)
+    return _aggregate_sequential(portfolio, metrics)
+
+def _tree_metrics(symbols: List[str], index: PriceIndex, vol_window: int = 20,
+                  cache: PositionMetricsCache | None = None, as_of=None) -> Dict[str, Tuple[float, float, float]]:
+    """Metrics for every symbol: cache hits first, the rest from one risk_table pass."""
+    metrics: Dict[str, Tuple[float, float, float]] = {}
+    missing = []
+    for sym in symbols:
+        hit = cache.get(sym, vol_window, index.stamp(sym, as_of)) if cache is not None else None
+        if hit is None:
+            missing.append(sym)
+        else:
+            metrics[sym] = hit
+    table = risk_table(index, missing, vol_window, as_of)
+    for sym in missing:
+        metrics[sym] = table.metrics(sym)
+        if cache is not None:
+            cache.put(sym, vol_window, metrics[sym], index.stamp(sym, as_of))
+    return metrics
+
+def _aggregate_sequential(portfolio: Dict[str, Any], metrics: Dict[str, Tuple[float, float, float]]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"name": portfolio.get("name", "Portfolio")}
+
+    pos_out: List[Dict[str, Any]] = []
+    for p in portfolio.get("positions", []):
+        sym, qty = p["symbol"], float(p["quantity"])
+        pos_out.append(_position_out(sym, qty, *metrics[sym]))
+
+    subs_out: List[Dict[str, Any]] = []
+    for sp in portfolio.get("sub_portfolios", []):
+        subs_out.append(_aggregate_sequential(sp, metrics))
+
+    return _rollup_node(out, pos_out, subs_out)
+
+
 # Main function: aggregate portfolio metrics in parallel for json
 def aggregate_portfolio_parallel(portfolio: Dict[str, Any],
                                  price_panel: pd.DataFrame,
                                  vol_window: int = 20,
-                                 max_workers: int | None = None) -> Dict[str, Any]:
-   
+                                 max_workers: int | None = None,
+                                 shared: bool = False,
+                                 pool: WorkerPool | None = None,
+                                 index: PriceIndex | None = None,
+                                 cache: PositionMetricsCache | None = None,
+                                 as_of=None) -> Dict[str, Any] | List[Dict[str, Any]]:
+    """
+    shared=True copies the panel into shared memory once for the whole tree, so
+    workers get (offset, length) descriptors instead of pickled price Series.
+    A prebuilt SharedPanel may also be passed as `price_panel`.
+
+    `pool` is a long-lived workers.WorkerPool reused by every node of the tree;
+    without one, a single transient pool is opened for the whole call.
+    `index` is a prebuilt PriceIndex for `price_panel` (built once if omitted).
+    `cache` is a PositionMetricsCache; cached symbols are not sent to workers.
+    `as_of` values the tree at that timestamp (see aggregate_portfolio_sequential);
+    a list of timestamps returns one snapshot per timestamp, all computed with
+    the same pool, index and shared panel (and without the cache, like
+    aggregate_portfolio_as_of).
+    """
+    if pool is None:
+        with WorkerPool(max_workers=max_workers) as pool:
+            return aggregate_portfolio_parallel(portfolio, price_panel, vol_window, max_workers,
+                                                shared, pool, index, cache, as_of)
+    if isinstance(price_panel, SharedPanel):
+        shared = True
+    elif index is None:
+        index = build_price_index(price_panel)
+    if shared and not isinstance(price_panel, SharedPanel):
+        with SharedPanel.from_sorted(index.panel) as panel:
+            return aggregate_portfolio_parallel(portfolio, panel, vol_window, max_workers, True, pool,
+                                                index, cache, as_of)
+    if _is_batch(as_of):
+        return [aggregate_portfolio_parallel(portfolio, price_panel, vol_window, max_workers, shared, pool,
+                                             index, None, t) for t in list(as_of)]
+
     out: Dict[str, Any] = {"name": portfolio.get("name", "Portfolio")}
     positions = portfolio.get("positions", [])
     subs = portfolio.get("sub_portfolios", [])
 
-    # parallel over this node's positions
-    pos_out: List[Dict[str, Any]] = []
+    # parallel over this node's positions (cache hits are resolved here)
+    metrics: List[Any] = []
     if positions:
-        with ProcessPoolExecutor(max_workers=max_workers) as ex:
-            futs = []
-            for p in positions:
-                sym, qty = p["symbol"], float(p["quantity"])
-                series = _series_for_symbol(price_panel, sym)  # slice before sending to process
-                futs.append(ex.submit(_compute_position, sym, qty, series, vol_window))
-            for f in as_completed(futs):
-                pos_out.append(f.result())
-
-    # sequential recursion for sub-portfolios (keeps structure simple & avoids nested pools)
+        ex = pool.processes
+        for p in positions:
+            sym = p["symbol"]
+            hit = cache.get(sym, vol_window, _stamp(price_panel, index, sym, as_of)) if cache is not None else None
+            if hit is not None:
+                metrics.append(hit)
+            elif shared:
+                offset, length = _shared_bounds(price_panel, sym, as_of)
+                metrics.append(ex.submit(_symbol_metrics_shared, price_panel.spec, offset, length, vol_window))
+            else:
+                series = index.series(sym, as_of)  # slice before sending to process
+                metrics.append(ex.submit(_symbol_metrics, series, vol_window))
+
+    pos_out: List[Dict[str, Any]] = []
+    for p, m in zip(positions, metrics):
+        if not isinstance(m, tuple):
+            m = m.result()
+            if cache is not None:
+                cache.put(p["symbol"], vol_window, m, _stamp(price_panel, index, p["symbol"], as_of))
+        pos_out.append(_position_out(p["symbol"], float(p["quantity"]), *m))
+
+    # sequential recursion for sub-portfolios; every level reuses the same pool
     subs_out: List[Dict[str, Any]] = []
     for sp in subs:
-        subs_out.append(aggregate_portfolio_parallel(sp, price_panel, vol_window, max_workers))
+        subs_out.append(aggregate_portfolio_parallel(sp, price_panel, vol_window, max_workers,
+                                                     shared, pool, index, cache, as_of))
 
-    # aggregate
-    tv_pos, av_pos, dd_pos = _aggregate_children(pos_out)
-    tv_sub, av_sub, dd_sub = _aggregate_children(subs_out)
-    total_value = round(tv_pos + tv_sub, 2)
-    agg_vol = ((av_pos * tv_pos + av_sub * tv_sub) / total_value) if total_value > 0 else 0.0
-    max_dd = min(dd_pos, dd_sub)
+    return _rollup_node(out, pos_out, subs_out)
 
-    out.update({
-        "total_value": total_value,
-        "aggregate_volatility": float(agg_vol),
-        "max_drawdown": float(max_dd),
-        "positions": pos_out,
-    })
-    if subs_out:
-        out["sub_portfolios"] = subs_out
-    return out
\ No newline at end of file
+
+# ---------- flattened evaluation ----------
+@dataclass
+class FlatPortfolio:
+    """Portfolio tree as flat lists; nodes are in pre-order, so children follow parents."""
+    names: List[str]
+    parents: List[int]                         # -1 for the root
+    children: List[List[int]]
+    positions: List[Tuple[int, str, float]]    # (node, symbol, quantity) in source order
+
+    def symbols(self) -> List[str]:
+        return list(dict.fromkeys(sym for _, sym, _ in self.positions))
+
+def flatten_portfolio(portfolio: Dict[str, Any]) -> FlatPortfolio:
+    flat = FlatPortfolio(names=[], parents=[], children=[], positions=[])
+    stack = [(portfolio, -1)]
+    while stack:
+        node, parent = stack.pop()
+        i = len(flat.names)
+        flat.names.append(node.get("name", "Portfolio"))
+        flat.parents.append(parent)
+        flat.children.append([])
+        if parent >= 0:
+            flat.children[parent].append(i)
+        for p in node.get("positions", []):
+            flat.positions.append((i, p["symbol"], float(p["quantity"])))
+        # reversed so sub-portfolios pop (and are numbered) in source order
+        for sp in reversed(node.get("sub_portfolios", [])):
+            stack.append((sp, i))
+    return flat
+
+def _symbol_metrics_batch(items: List[Tuple[str, pd.Series]], vol_window: int = 20):
+    parts = [series.to_numpy(dtype=np.float64) for _, series in items]
+    lengths = [len(p) for p in parts]
+    x = np.concatenate(parts) if parts else np.zeros(0)
+    return _batch_out([sym for sym, _ in items], *_risk_arrays(x, np.cumsum(lengths) - lengths, lengths, vol_window))
+
+def _symbol_metrics_batch_shared(spec, items: List[Tuple[str, int, int]], vol_window: int = 20):
+    price = attach_panel(spec)["price"]
+    arrays = _risk_arrays(price, [o for _, o, _ in items], [n for _, _, n in items], vol_window)
+    return _batch_out([sym for sym, _, _ in items], *arrays)
+
+def _batch_out(symbols, last, vol, dd):
+    return [(sym, (float(a), float(b), float(c))) for sym, a, b, c in zip(symbols, last, vol, dd)]
+
+def _rollup_flat(flat: FlatPortfolio, metrics: Dict[str, Tuple[float, float, float]]) -> Dict[str, Any]:
+    """Build the nested snapshot bottom-up from per-symbol metrics."""
+    pos_out: List[List[Dict[str, Any]]] = [[] for _ in flat.names]
+    for node, sym, qty in flat.positions:
+        pos_out[node].append(_position_out(sym, qty, *metrics[sym]))
+
+    outs: List[Dict[str, Any]] = [None] * len(flat.names)
+    for i in reversed(range(len(flat.names))):
+        subs_out = [outs[c] for c in flat.children[i]]
+        outs[i] = _rollup_node({"name": flat.names[i]}, pos_out[i], subs_out)
+    return outs[0]
+
+
+# Main function: evaluate the whole tree with one batched dispatch per call
+def aggregate_portfolio_flat(portfolio: Dict[str, Any],
+                             price_panel: pd.DataFrame,
+                             vol_window: int = 20,
+                             max_workers: int | None = None,
+                             shared: bool = False,
+                             pool: WorkerPool | None = None,
+                             index: PriceIndex | None = None,
+                             cache: PositionMetricsCache | None = None,
+                             as_of=None) -> Dict[str, Any] | List[Dict[str, Any]]:
+    """
+    Same snapshot as aggregate_portfolio_parallel, but the tree is flattened
+    first and each unique symbol is computed once, in one batch of tasks (one
+    per worker) across all levels; totals are then rolled up the tree.
+    Arguments mean the same as for aggregate_portfolio_parallel.
+    """
+    if pool is None:
+        with WorkerPool(max_workers=max_workers) as pool:
+            return aggregate_portfolio_flat(portfolio, price_panel, vol_window, max_workers, shared, pool,
+                                            index, cache, as_of)
+    if isinstance(price_panel, SharedPanel):
+        shared = True
+    elif index is None:
+        index = build_price_index(price_panel)
+    if shared and not isinstance(price_panel, SharedPanel):
+        with SharedPanel.from_sorted(index.panel) as panel:
+            return aggregate_portfolio_flat(portfolio, panel, vol_window, max_workers, True, pool, index, cache,
+                                            as_of)
+    if _is_batch(as_of):
+        return [aggregate_portfolio_flat(portfolio, price_panel, vol_window, max_workers, shared, pool,
+                                         index, None, t) for t in list(as_of)]
+
+    flat = flatten_portfolio(portfolio)
+    metrics: Dict[str, Tuple[float, float, float]] = {}
+    symbols = []
+    for s in flat.symbols():
+        hit = cache.get(s, vol_window, _stamp(price_panel, index, s, as_of)) if cache is not None else None
+        if hit is None:
+            symbols.append(s)
+        else:
+            metrics[s] = hit
+    n_tasks = max(1, min(pool.max_workers, len(symbols)))
+    batches = [symbols[k::n_tasks] for k in range(n_tasks)]
+
+    ex = pool.processes
+    if shared:
+        spec = price_panel.spec
+        futs = [ex.submit(_symbol_metrics_batch_shared, spec,
+                          [(s, *_shared_bounds(price_panel, s, as_of)) for s in batch], vol_window)
+                for batch in batches if batch]
+    else:
+        futs = [ex.submit(_symbol_metrics_batch, [(s, index.series(s, as_of)) for s in batch], vol_window)
+                for batch in batches if batch]
+
+    for f in futs:
+        for sym, m in f.result():
+            metrics[sym] = m
+            if cache is not None:
+                cache.put(sym, vol_window, m, _stamp(price_panel, index, sym, as_of))
+    return _rollup_flat(flat, metrics)
+
+
+# ---------- incremental revaluation ----------
+class _SymbolTrack:
+    """Running state behind one symbol's metrics: last price, peak, worst drawdown, last returns."""
+    __slots__ = ("count", "last", "peak", "min_dd", "returns")
+
+    def __init__(self, price_series: pd.Series, vol_window: int):
+        p = price_series.to_numpy(dtype=float)
+        self.count = len(p)
+        self.last = float(p[-1]) if len(p) else np.nan
+        self.peak = float(p.max()) if len(p) else np.nan
+        self.min_dd = _max_drawdown_pct(price_series)
+        self.returns = deque(_pct_returns(price_series).to_numpy()[-vol_window:], maxlen=vol_window)
+
+    def push(self, price: float):
+        if self.count == 0:
+            self.returns.append(0.0)
+            self.peak, self.min_dd = price, 0.0
+        else:
+            self.returns.append(price / self.last - 1.0)
+            self.peak = max(self.peak, price)
+            self.min_dd = min(self.min_dd, price / self.peak - 1.0)
+        self.last = price
+        self.count += 1
+
+    def metrics(self, vol_window: int) -> Tuple[float, float, float]:
+        vol = float(np.std(self.returns)) if self.count >= vol_window else np.nan
+        return self.last, vol, self.min_dd if self.count else np.nan
+
+
+class _RunningSum:
+    """
+    Exact sum of float terms under add/remove (Shewchuk partials, as in
+    math.fsum), so the result does not depend on the order of updates;
+    NaN while any NaN term is in it, like sum().
+    """
+    __slots__ = ("partials", "nans")
+
+    def __init__(self):
+        self.partials: List[float] = []
+        self.nans = 0
+
+    def add(self, x: float, sign: int = 1):
+        if x != x:
+            self.nans += sign
+            return
+        x = sign * x
+        i = 0
+        partials = self.partials
+        for y in partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                partials[i] = lo
+                i += 1
+            x = hi
+        partials[i:] = [x]
+
+    def value(self) -> float:
+        return float("nan") if self.nans else math.fsum(self.partials)
+
+
+class _NodeSums:
+    """
+    Running inputs of _rollup_node for one node: value and value * vol summed
+    over its positions and over its children, and the worst drawdown so far.
+    """
+    __slots__ = ("pos_tv", "pos_vw", "sub_tv", "sub_vw", "dd")
+
+    def __init__(self):
+        self.pos_tv, self.pos_vw = _RunningSum(), _RunningSum()
+        self.sub_tv, self.sub_vw = _RunningSum(), _RunningSum()
+        self.dd = 0.0
+
+    def apply(self, tv: _RunningSum, vw: _RunningSum, value: float, vol: float, dd: float, sign: int):
+        # terms as _aggregate_children forms them
+        tv.add(value, sign)
+        vw.add(float(value or 0.0) * float(vol or 0.0), sign)
+        if sign > 0:
+            self.dd = min(self.dd, float(dd or 0.0))  # min() skips NaN, as in _aggregate_children
+
+    def finish(self, out: Dict[str, Any]):
+        """out's totals from the sums, with the arithmetic of _aggregate_children / _rollup_node."""
+        tv_pos, tv_sub = self.pos_tv.value(), self.sub_tv.value()
+        av_pos = self.pos_vw.value() / tv_pos if tv_pos > 0 else 0.0
+        av_sub = self.sub_vw.value() / tv_sub if tv_sub > 0 else 0.0
+        total_value = round(tv_pos + tv_sub, 2)
+        agg_vol = ((av_pos * tv_pos + av_sub * tv_sub) / total_value) if total_value > 0 else 0.0
+        out["total_value"] = total_value
+        out["aggregate_volatility"] = float(agg_vol)
+        out["max_drawdown"] = float(self.dd)
+
+
+class IncrementalPortfolio:
+    """
+    Stateful snapshot of a portfolio tree. Built once from the portfolio JSON
+    and a price panel (same result as aggregate_portfolio_sequential); then
+    `update(ticks)` appends new prices, recomputes only the positions holding
+    those symbols and applies each change as a delta to running per-node sums
+    along the ancestor path, so a tick costs O(holders x depth), independent
+    of how wide the nodes on the path are. A symbol's worst drawdown only
+    falls, so node drawdowns are running minimums.
+
+    `snapshot()` is the live nested dict, updated in place.
+    """
+
+    def __init__(self, portfolio: Dict[str, Any], price_panel: pd.DataFrame,
+                 vol_window: int = 20, index: PriceIndex | None = None):
+        if index is None:
+            index = build_price_index(price_panel)
+        self.vol_window = vol_window
+        self.flat = flat = flatten_portfolio(portfolio)
+
+        self._tracks: Dict[str, _SymbolTrack] = {}
+        self._holders: Dict[str, List[Tuple[int, int, float]]] = {}   # symbol -> (node, slot, quantity)
+        self._pos_out: List[List[Dict[str, Any]]] = [[] for _ in flat.names]
+        table = risk_table(index, flat.symbols(), vol_window)
+        metrics = {sym: table.metrics(sym) for sym in table.symbols}
+        for sym in flat.symbols():
+            self._tracks[sym] = _SymbolTrack(index.series(sym), vol_window)
+        for node, sym, qty in flat.positions:
+            self._holders.setdefault(sym, []).append((node, len(self._pos_out[node]), qty))
+            self._pos_out[node].append(_position_out(sym, qty, *metrics[sym]))
+
+        self._outs: List[Dict[str, Any]] = [{"name": n} for n in flat.names]
+        self._sums = [_NodeSums() for _ in flat.names]
+        # pre-order numbering: descending index visits children before parents
+        for i in reversed(range(len(flat.names))):
+            sums = self._sums[i]
+            for c in self._pos_out[i]:
+                sums.apply(sums.pos_tv, sums.pos_vw, c["value"], c["volatility"], c["drawdown"], 1)
+            subs_out = [self._outs[c] for c in flat.children[i]]
+            for c in subs_out:
+                sums.apply(sums.sub_tv, sums.sub_vw, c["total_value"], c["aggregate_volatility"],
+                           c["max_drawdown"], 1)
+            _rollup_node(self._outs[i], self._pos_out[i], subs_out)
+        self.recomputed_nodes = len(flat.names)
+
+    def update(self, ticks) -> Dict[str, Any]:
+        """
+        Apply ticks in time order and revalue. `ticks` is a DataFrame with
+        `symbol` and `price` columns or an iterable of (symbol, price) pairs;
+        symbols not held anywhere in the tree are ignored.
+        """
+        if isinstance(ticks, pd.DataFrame):
+            ticks = zip(ticks["symbol"].tolist(), ticks["price"].tolist())
+        changed: Set[str] = set()
+        for sym, price in ticks:
+            track = self._tracks.get(sym)
+            if track is not None:
+                track.push(float(price))
+                changed.add(sym)
+
+        dirty: Set[int] = set()
+        for sym in changed:
+            metrics = self._tracks[sym].metrics(self.vol_window)
+            for node, slot, qty in self._holders[sym]:
+                sums, old = self._sums[node], self._pos_out[node][slot]
+                new = _position_out(sym, qty, *metrics)
+                sums.apply(sums.pos_tv, sums.pos_vw, old["value"], old["volatility"], old["drawdown"], -1)
+                sums.apply(sums.pos_tv, sums.pos_vw, new["value"], new["volatility"], new["drawdown"], 1)
+                self._pos_out[node][slot] = new
+                dirty.add(node)
+
+        # deepest first (pre-order: children have larger indices); each node
+        # passes its change on to its parent's sub-portfolio sums
+        heap = [-i for i in dirty]
+        heapq.heapify(heap)
+        done = 0
+        while heap:
+            i = -heapq.heappop(heap)
+            while heap and -heap[0] == i:  # several children queued the same parent
+                heapq.heappop(heap)
+            out = self._outs[i]
+            old = (out["total_value"], out["aggregate_volatility"], out["max_drawdown"])
+            self._sums[i].finish(out)
+            done += 1
+            parent = self.flat.parents[i]
+            if parent >= 0:
+                ps = self._sums[parent]
+                ps.apply(ps.sub_tv, ps.sub_vw, *old, -1)
+                ps.apply(ps.sub_tv, ps.sub_vw, out["total_value"], out["aggregate_volatility"],
+                         out["max_drawdown"], 1)
+                heapq.heappush(heap, -parent)
+        self.recomputed_nodes = done
+        return self._outs[0]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._outs[0]
+
+
+# ---------- array-compiled evaluation ----------
+@dataclass
+class CompiledPortfolio:
+    """
+    Portfolio tree as NumPy arrays (nodes in pre-order). Positions are grouped
+    by node, so node k owns positions pos_offsets[k]:pos_offsets[k + 1].
+    """
+    names: List[str]
+    parents: np.ndarray        # int64, -1 for the root
+    depth: np.ndarray          # int64, root is 0
+    children: List[List[int]]
+    pos_offsets: np.ndarray    # len(names) + 1
+    pos_sym: np.ndarray        # int64 codes into `symbols`
+    quantities: np.ndarray     # float64
+    symbols: List[str]
+
+def compile_portfolio(portfolio: Dict[str, Any]) -> CompiledPortfolio:
+    flat = flatten_portfolio(portfolio)
+    n = len(flat.names)
+    symbols = flat.symbols()
+    code = {s: i for i, s in enumerate(symbols)}
+
+    parents = np.asarray(flat.parents, dtype=np.int64)
+    depth = np.zeros(n, dtype=np.int64)
+    for i in range(1, n):
+        depth[i] = depth[parents[i]] + 1
+    pos_node = np.fromiter((node for node, _, _ in flat.positions), dtype=np.int64, count=len(flat.positions))
+    return CompiledPortfolio(
+        names=flat.names,
+        parents=parents,
+        depth=depth,
+        children=flat.children,
+        pos_offsets=np.searchsorted(pos_node, np.arange(n + 1)),
+        pos_sym=np.fromiter((code[s] for _, s, _ in flat.positions), dtype=np.int64, count=len(flat.positions)),
+        quantities=np.fromiter((q for _, _, q in flat.positions), dtype=np.float64, count=len(flat.positions)),
+        symbols=symbols,
+    )
+
+@dataclass
+class CompiledValuation:
+    """Per-position and per-node results; the nested snapshot dict is built on demand."""
+    compiled: CompiledPortfolio
+    pos_value: np.ndarray
+    pos_vol: np.ndarray
+    pos_dd: np.ndarray
+    total_value: np.ndarray
+    aggregate_volatility: np.ndarray
+    max_drawdown: np.ndarray
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        """Same nested dict as aggregate_portfolio_sequential."""
+        c = self.compiled
+        syms = [c.symbols[k] for k in c.pos_sym.tolist()]
+        values, vols, dds = self.pos_value.tolist(), self.pos_vol.tolist(), self.pos_dd.tolist()
+        tv, av, md = self.total_value.tolist(), self.aggregate_volatility.tolist(), self.max_drawdown.tolist()
+        offsets = c.pos_offsets.tolist()
+
+        outs: List[Dict[str, Any]] = [None] * len(c.names)
+        for i in reversed(range(len(c.names))):
+            out = {"name": c.names[i], "total_value": tv[i], "aggregate_volatility": av[i],
+                   "max_drawdown": md[i],
+                   "positions": [{"symbol": syms[j], "value": values[j], "volatility": vols[j], "drawdown": dds[j]}
+                                 for j in range(offsets[i], offsets[i + 1])]}
+            if c.children[i]:
+                out["sub_portfolios"] = [outs[k] for k in c.children[i]]
+            outs[i] = out
+        return outs[0]
+
+
+def _safe_ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(num))
+    ok = den > 0
+    out[ok] = num[ok] / den[ok]
+    return out
+
+def evaluate_compiled(compiled: CompiledPortfolio, price_panel: pd.DataFrame | None = None,
+                      vol_window: int = 20, index: PriceIndex | None = None,
+                      as_of=None) -> CompiledValuation | List[CompiledValuation]:
+    """
+    Vectorized aggregate_portfolio_sequential: per-node sums and minima over
+    the position arrays, rolled up one tree level at a time (deepest first),
+    summing and rounding totals per node like the dict version.
+    `as_of` values the tree with prices up to that timestamp; a list of
+    timestamps returns one valuation each (aggregate_portfolio_as_of).
+    """
+    if index is None:
+        index = build_price_index(price_panel)
+    if _is_batch(as_of):
+        return aggregate_portfolio_as_of(compiled, price_panel, as_of, vol_window, index)
+    table = risk_table(index, compiled.symbols, vol_window, as_of)
+    return _rollup_compiled(compiled, table.last, table.volatility, table.drawdown)
+
+def _round2(x: np.ndarray) -> np.ndarray:
+    """Python round(v, 2) per element; np.round scales by 100 first and can land on the other cent."""
+    return np.fromiter((round(v, 2) for v in x.tolist()), dtype=np.float64, count=len(x))
+
+def _rollup_compiled(c: CompiledPortfolio, last: np.ndarray, vol: np.ndarray, dd: np.ndarray) -> CompiledValuation:
+    """Position and node results from per-symbol (last, vol, drawdown) arrays."""
+    with np.errstate(invalid="ignore"):
+        pos_value = _round2(last[c.pos_sym] * c.quantities)
+    pos_vol = np.where(np.isfinite(vol), vol, np.nan)[c.pos_sym]
+    pos_dd = np.where(np.isfinite(dd), dd, np.nan)[c.pos_sym]
+
+    # this node's own positions are a contiguous segment; summed left to right
+    # like _aggregate_children (np.add.reduceat sums pairwise, which can move
+    # a total across a rounding boundary)
+    n = len(c.names)
+    tv_pos, vnum_pos, dd_pos = np.zeros(n), np.zeros(n), np.zeros(n)
+    has_pos = np.diff(c.pos_offsets) > 0
+    if has_pos.any():
+        values, vnums, offsets = pos_value.tolist(), (pos_value * pos_vol).tolist(), c.pos_offsets.tolist()
+        for i in np.flatnonzero(has_pos).tolist():
+            a, b = offsets[i], offsets[i + 1]
+            tv_pos[i] = sum(values[a:b])
+            acc = 0.0
+            for v in vnums[a:b]:
+                acc += v
+            vnum_pos[i] = acc
+        starts = c.pos_offsets[:-1][has_pos]
+        dd_pos[has_pos] = np.minimum(np.minimum.reduceat(np.nan_to_num(pos_dd, nan=0.0), starts), 0.0)
+    av_pos = _safe_ratio(vnum_pos, tv_pos)
+
+    # sub-portfolios: children scatter into parents, one level at a time
+    tv_sub, vnum_sub, dd_sub = np.zeros(n), np.zeros(n), np.zeros(n)
+    total, agg, mdd = np.zeros(n), np.zeros(n), np.zeros(n)
+    for level in range(int(c.depth.max()), -1, -1):
+        nodes = np.flatnonzero(c.depth == level)
+        av_sub = _safe_ratio(vnum_sub[nodes], tv_sub[nodes])
+        t = _round2(tv_pos[nodes] + tv_sub[nodes])
+        total[nodes] = t
+        agg[nodes] = _safe_ratio(av_pos[nodes] * tv_pos[nodes] + av_sub * tv_sub[nodes], t)
+        mdd[nodes] = np.minimum(dd_pos[nodes], dd_sub[nodes])
+        if level > 0:
+            parents = c.parents[nodes]
+            np.add.at(tv_sub, parents, t)
+            np.add.at(vnum_sub, parents, t * agg[nodes])
+            np.minimum.at(dd_sub, parents, mdd[nodes])
+
+    return CompiledValuation(compiled=c, pos_value=pos_value, pos_vol=pos_vol, pos_dd=pos_dd,
+                             total_value=total, aggregate_volatility=agg, max_drawdown=mdd)
+
+
+# ---------- as-of batches ----------
+def _trailing_vol_at(p: np.ndarray, rows: np.ndarray, vol_window: int) -> np.ndarray:
+    """
+    kernels.trailing_risk volatility of p[:r + 1] for each r in `rows`: one
+    column per row holding its last vol_window + 1 prices (NaN above the
+    first), so each value has the same bits as the scalar path.
+    """
+    idx = rows[None, :] + np.arange(-vol_window, 1)[:, None]
+    m = np.where(idx >= 0, p[np.maximum(idx, 0)], np.nan)
+    return kernels.trailing_risk(m, vol_window)[1]
+
+def aggregate_portfolio_as_of(portfolio, price_panel: pd.DataFrame | None, timestamps,
+                              vol_window: int = 20, index: PriceIndex | None = None) -> List[CompiledValuation]:
+    """
+    One valuation per timestamp in `timestamps` (e.g. every minute of a day),
+    each equal to aggregate_portfolio_sequential(..., as_of=ts). Every symbol
+    is scanned once: its running worst drawdown is computed over the whole
+    history, each timestamp picks the row at or before it by binary search,
+    and the volatilities of all picked rows come from one trailing_risk call;
+    the tree is rolled up with the compiled arrays. `portfolio` is the JSON
+    tree or a CompiledPortfolio. Batches do not use a PositionMetricsCache:
+    every symbol is scanned once anyway, and one entry per (symbol,
+    timestamp) would only push out the entries scalar calls reuse.
+    """
+    if index is None:
+        index = build_price_index(price_panel)
+    c = portfolio if isinstance(portfolio, CompiledPortfolio) else compile_portfolio(portfolio)
+    sp = index.panel
+    times = _as_i8(list(timestamps), sp.ts_dtype)
+
+    shape = (len(times), len(c.symbols))
+    last, vol, dd = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+    for k, sym in enumerate(c.symbols):
+        start, stop = index.slices.get(sym, (0, 0))
+        if stop == start:
+            continue
+        row = np.searchsorted(sp.timestamps[start:stop], times, side="right") - 1
+        ok = row >= 0
+        p = sp.prices[start:stop]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            dd_hist = np.minimum.accumulate(p / np.fmax.accumulate(p) - 1.0)
+        last[ok, k], vol[ok, k], dd[ok, k] = p[row[ok]], _trailing_vol_at(p, row[ok], vol_window), dd_hist[row[ok]]
+    return [_rollup_compiled(c, last[t], vol[t], dd[t]) for t in range(len(times))]
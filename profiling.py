@@ -0,0 +1,187 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import functools
+import os
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Tuple
+import psutil
+
+# ---------- stage-level profiling ----------
+# profile_stage() wraps any block (a loader, rolling, parallel or portfolio
+# call) and records wall time, CPU time of this process and its child workers,
+# peak RSS of the whole process tree (background sampler), optional
+# tracemalloc top allocators and, when a WorkerPool is passed, per-task worker
+# timings. Profiles turn into rows for reporting.write_reports.
+
+_MB = 1024 ** 2
+
+
+def _tree(proc: psutil.Process) -> List[psutil.Process]:
+    try:
+        return [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return [proc]
+
+
+def _tree_rss(proc: psutil.Process) -> int:
+    total = 0
+    for p in _tree(proc):
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def _children_cpu(proc: psutil.Process) -> Dict[int, float]:
+    out = {}
+    for p in _tree(proc)[1:]:
+        try:
+            t = p.cpu_times()
+            out[p.pid] = t.user + t.system
+        except psutil.Error:
+            pass
+    return out
+
+
+class _Sampler(threading.Thread):
+    """Polls RSS of the process tree every `interval` seconds and keeps the peak."""
+
+    def __init__(self, proc: psutil.Process, interval: float):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.interval = interval
+        self.peak = _tree_rss(proc)
+        self.samples = 1
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _tree_rss(self.proc))
+            self.samples += 1
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, _tree_rss(self.proc))
+        return self.peak
+
+
+@dataclass
+class StageProfile:
+    section: str
+    lib: str = ""
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0           # this process (all threads) + child workers
+    rss_mb_start: float = 0.0
+    rss_mb_end: float = 0.0
+    peak_rss_mb: float = 0.0           # process tree incl. child workers
+    samples: int = 0
+    top_allocations: List[Tuple[str, float]] = field(default_factory=list)  # (file:line, KiB)
+    tasks: List[Dict[str, Any]] = field(default_factory=list)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def cpu_percent(self) -> float:
+        return 100.0 * self.cpu_seconds / self.seconds if self.seconds > 0 else 0.0
+
+    def worker_summary(self) -> Dict[int, Dict[str, Any]]:
+        """Per worker pid: number of tasks (int) and total task seconds (float)."""
+        out: Dict[int, Dict[str, Any]] = {}
+        for t in self.tasks:
+            w = out.setdefault(t["pid"], {"tasks": 0, "seconds": 0.0})
+            w["tasks"] += 1
+            w["seconds"] += t["seconds"]
+        return out
+
+    def to_row(self) -> Dict[str, Any]:
+        """Flat row in the performance_summary.csv layout."""
+        row = {
+            "section": self.section,
+            "lib": self.lib,
+            "seconds": round(self.seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "cpu_percent": round(self.cpu_percent, 1),
+            "rss_mb_delta": round(max(self.rss_mb_end - self.rss_mb_start, 0.0), 2),
+            "peak_rss_mb_delta": round(max(self.peak_rss_mb - self.rss_mb_start, 0.0), 2),
+            "tasks": len(self.tasks),
+            "workers": len(self.worker_summary()),
+        }
+        row.update(self.extra)
+        return row
+
+
+@contextmanager
+def profile_stage(section: str, lib: str = "", sample_interval: float | None = 0.01,
+                  trace_allocations: bool = False, top: int = 5, pool=None) -> Iterator[StageProfile]:
+    """
+    Profile the enclosed block; the yielded StageProfile is filled in on exit.
+
+    `sample_interval=None` disables the background RSS sampler (peak is then
+    max(start, end)). `trace_allocations` turns on tracemalloc for the block
+    and keeps the `top` allocating lines. `pool` is a workers.WorkerPool whose
+    task timings are collected while the block runs.
+    """
+    prof = StageProfile(section=section, lib=lib)
+    proc = psutil.Process(os.getpid())
+    sampler = _Sampler(proc, sample_interval) if sample_interval else None
+    prof.rss_mb_start = _tree_rss(proc) / _MB
+
+    if trace_allocations:
+        tracemalloc.start()
+    if pool is not None:
+        prev_sink, pool.task_sink = pool.task_sink, prof.tasks
+    child_cpu0 = _children_cpu(proc)
+    reaped0 = os.times()
+    cpu0 = time.process_time()
+    if sampler:
+        sampler.start()
+    t0 = time.perf_counter()
+    try:
+        yield prof
+    finally:
+        prof.seconds = time.perf_counter() - t0
+        cpu1 = time.process_time()
+        reaped1 = os.times()
+        child_cpu1 = _children_cpu(proc)
+        if pool is not None:
+            pool.task_sink = prev_sink
+
+        live = sum(v - child_cpu0.get(pid, 0.0) for pid, v in child_cpu1.items())
+        reaped = (reaped1.children_user - reaped0.children_user) + (reaped1.children_system - reaped0.children_system)
+        prof.cpu_seconds = (cpu1 - cpu0) + live + reaped
+
+        prof.rss_mb_end = _tree_rss(proc) / _MB
+        if sampler:
+            prof.peak_rss_mb = sampler.stop() / _MB
+            prof.samples = sampler.samples
+        else:
+            prof.peak_rss_mb = max(prof.rss_mb_start, prof.rss_mb_end)
+
+        if trace_allocations:
+            snap = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            prof.top_allocations = [(f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size / 1024)
+                                    for s in snap.statistics("lineno")[:top]]
+
+
+def profiled(section: str | None = None, lib: str = "", sink: List[StageProfile] | None = None, **options):
+    """
+    Decorator form of profile_stage. Each call's StageProfile is stored on
+    `wrapper.last_profile` and appended to `sink` when given.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_stage(section or fn.__name__, lib, **options) as prof:
+                result = fn(*args, **kwargs)
+            wrapper.last_profile = prof
+            if sink is not None:
+                sink.append(prof)
+            return result
+        wrapper.last_profile = None
+        return wrapper
+    return deco
@@ -0,0 +1,213 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+import queue
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Sequence
+import numpy as np
+import pandas as pd
+
+from data_loader import collect
+from portfolio import IncrementalPortfolio
+from streaming import StreamingMetrics
+
+# ---------- tick replay harness ----------
+# A producer thread emits market_data rows (symbol, price) at `rate` ticks/s,
+# or as fast as possible, through an in-process queue or a localhost TCP
+# socket; the consumer (calling thread) pushes each tick through
+# StreamingMetrics and, with a portfolio, IncrementalPortfolio.update.
+# Latency of a tick = finished - scheduled emission time. With a fixed rate the
+# schedule is t0 + i / rate, so a consumer that falls behind shows up as
+# latency and backlog instead of silently slowing the producer (no coordinated
+# omission); without a rate the emission time is when the tick was sent.
+# Service time (processing only) gives the capacity: 1 / mean service time.
+TRANSPORTS = ("queue", "socket")
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+_IDLE_TIMEOUT_S = 10.0  # socket: give up when the producer stays silent this long
+_FAILED = object()      # queue: the producer raised (the error is in `errors`)
+
+
+@dataclass
+class ReplayStats:
+    transport: str
+    rate: float | None                 # offered ticks/s (None: as fast as possible)
+    latencies_ns: np.ndarray           # per tick, in arrival order
+    service_ns: np.ndarray             # time spent processing the tick (excludes queueing)
+    backlog: np.ndarray                # ticks sent but not yet processed, seen as each tick finished
+    seconds: float                     # first emission -> last tick processed
+    metrics: StreamingMetrics = field(repr=False)
+    portfolio: IncrementalPortfolio | None = field(default=None, repr=False)
+
+    @property
+    def ticks(self) -> int:
+        return len(self.latencies_ns)
+
+    @property
+    def throughput(self) -> float:
+        """Sustained ticks/s processed."""
+        return self.ticks / self.seconds if self.seconds > 0 else 0.0
+
+    def percentiles(self, qs: Sequence[float] = PERCENTILES, service: bool = False) -> Dict[str, float]:
+        """Latency (or service time) percentiles in microseconds, keyed p50, p99, p99.9, ..."""
+        if self.ticks == 0:
+            return {f"p{q:g}": float("nan") for q in qs}
+        vals = np.percentile(self.service_ns if service else self.latencies_ns, qs) / 1e3
+        return {f"p{q:g}": float(v) for q, v in zip(qs, vals)}
+
+    def histogram(self, bins: int = 40) -> pd.DataFrame:
+        """Latency counts in log-spaced microsecond buckets [lo_us, hi_us) (the last one includes hi_us)."""
+        if self.ticks == 0:
+            return pd.DataFrame({"lo_us": [], "hi_us": [], "count": []})
+        us = np.maximum(self.latencies_ns / 1e3, 1e-3)
+        lo = us.min()
+        hi = max(us.max(), lo * (1 + 1e-9))  # a single distinct value still gets increasing edges
+        edges = np.logspace(np.log10(lo), np.log10(hi), bins + 1)
+        edges[0], edges[-1] = lo, hi  # exact outer edges: logspace rounding must not drop the extremes
+        counts, _ = np.histogram(us, bins=edges)
+        return pd.DataFrame({"lo_us": edges[:-1], "hi_us": edges[1:], "count": counts})
+
+    def summary(self) -> Dict[str, Any]:
+        out = {"transport": self.transport, "ticks": self.ticks, "offered_rate": self.rate,
+               "throughput": round(float(self.throughput), 1), "seconds": round(float(self.seconds), 6),
+               "capacity": round(1e9 / float(self.service_ns.mean()), 1) if self.ticks else 0.0,
+               "max_backlog": int(self.backlog.max()) if self.ticks else 0,
+               "mean_backlog": round(float(self.backlog.mean()), 3) if self.ticks else 0.0,
+               "max_us": float(self.latencies_ns.max() / 1e3) if self.ticks else float("nan")}
+        out.update({f"{k}_us": round(v, 3) for k, v in self.percentiles().items()})
+        out.update({f"service_{k}_us": round(v, 3) for k, v in self.percentiles((50.0, 99.0), service=True).items()})
+        return out
+
+
+def _produce(send, n: int, symbols: List[str], prices: List[float], rate: float | None,
+             sched: np.ndarray, sent: List[int]):
+    t0 = time.perf_counter_ns()
+    step = None if rate is None else 1e9 / rate
+    for i in range(n):
+        if step is not None:
+            target = t0 + int(i * step)
+            delay = (target - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+            sched[i] = target
+        else:
+            sched[i] = time.perf_counter_ns()
+        sent[0] = i + 1  # counted before the hand-off, so the consumer never sees a negative backlog
+        send(i, symbols[i], prices[i])
+
+
+def _queue_ticks(n, symbols, prices, rate, sched, sent):
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    errors: List[BaseException] = []
+
+    def run():
+        try:
+            _produce(lambda i, s, p: q.put((i, s, p)), n, symbols, prices, rate, sched, sent)
+        except BaseException as exc:
+            errors.append(exc)
+            q.put(_FAILED)
+
+    producer = threading.Thread(target=run, daemon=True)
+    producer.start()
+    for _ in range(n):
+        item = q.get()
+        if item is _FAILED:
+            producer.join()
+            raise errors[0]
+        yield item
+    producer.join()
+
+
+def _socket_ticks(n, symbols, prices, rate, sched, sent):
+    timeout = _IDLE_TIMEOUT_S + (1.0 / rate if rate else 0.0)
+    server = socket.create_server(("127.0.0.1", 0))
+    server.settimeout(0.05)  # accept polls, so a producer that fails to connect is noticed
+    port = server.getsockname()[1]
+    errors: List[BaseException] = []
+
+    def run():
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=timeout) as conn:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                _produce(lambda i, s, p: conn.sendall(f"{i},{s},{p!r}\n".encode()),
+                         n, symbols, prices, rate, sched, sent)
+        except BaseException as exc:
+            errors.append(exc)
+
+    def failed(reason: str):
+        producer.join(timeout)
+        return errors[0] if errors else ConnectionError(f"tick producer {reason}")
+
+    producer = threading.Thread(target=run, daemon=True)
+    producer.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn, _ = server.accept()
+                break
+            except TimeoutError:
+                if errors or not producer.is_alive() or time.monotonic() > deadline:
+                    raise failed(f"did not connect within {timeout:g}s")
+        conn.settimeout(timeout)  # a stalled producer raises TimeoutError instead of blocking forever
+        with conn, conn.makefile("rb") as reader:
+            for _ in range(n):
+                line = reader.readline()
+                if not line:
+                    raise failed("closed the connection early")
+                i, sym, px = line.decode().rstrip("\n").split(",")
+                yield int(i), sym, float(px)
+    finally:
+        server.close()
+        producer.join(timeout)
+
+
+def replay(source, portfolio: Dict[str, Any] | None = None, rate: float | None = None,
+           transport: str = "queue", window: int = 20, vol_window: int = 20,
+           warmup_rows: int = 0, limit: int | None = None) -> ReplayStats:
+    """
+    Stream the rows of `source` (pandas/polars frame with symbol and price
+    columns, in time order) through the rolling-metrics and, with
+    `portfolio`, the portfolio-aggregation path, one tick at a time. The
+    first `warmup_rows` rows seed the state (and are the price history of the
+    IncrementalPortfolio) without being timed; at most `limit` rows follow.
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"transport must be one of {TRANSPORTS}")
+    if rate is not None and rate <= 0:
+        raise ValueError("rate must be > 0 ticks/s (or None for as fast as possible)")
+    df = collect(source, library="pandas")
+    history, ticks = df.iloc[:warmup_rows], df.iloc[warmup_rows:]
+    if limit is not None:
+        ticks = ticks.iloc[:limit]
+
+    metrics = StreamingMetrics(window)
+    metrics.update_many(history["symbol"].tolist(), history["price"].tolist())
+    book = None
+    if portfolio is not None:
+        if history.empty:
+            raise ValueError("a portfolio replay needs warmup_rows > 0 (price history for the initial snapshot)")
+        book = IncrementalPortfolio(portfolio, history, vol_window)
+
+    symbols, prices = ticks["symbol"].tolist(), ticks["price"].tolist()
+    n = len(symbols)
+    sched = np.zeros(n, dtype=np.int64)
+    lat = np.zeros(n, dtype=np.int64)
+    service = np.zeros(n, dtype=np.int64)
+    backlog = np.zeros(n, dtype=np.int64)
+    sent = [0]
+
+    stream = (_queue_ticks if transport == "queue" else _socket_ticks)(n, symbols, prices, rate, sched, sent)
+    done = time.perf_counter_ns()
+    for i, sym, px in stream:
+        start = time.perf_counter_ns()
+        metrics.update(sym, px)
+        if book is not None:
+            book.update(((sym, px),))
+        done = time.perf_counter_ns()
+        lat[i] = done - sched[i]
+        service[i] = done - start
+        backlog[i] = sent[0] - i - 1
+    seconds = (done - sched[0]) / 1e9 if n else 0.0
+    return ReplayStats(transport=transport, rate=rate, latencies_ns=lat, service_ns=service, backlog=backlog,
+                       seconds=seconds, metrics=metrics, portfolio=book)
@@ -0,0 +1,35 @@
+from typing import Any, Dict, Iterable, List
+import pandas as pd
+
+
+def profiles_to_frame(profiles: Iterable[Any]) -> pd.DataFrame:
+    """One row per profiling.StageProfile (or plain row dict)."""
+    rows: List[Dict[str, Any]] = [p if isinstance(p, dict) else p.to_row() for p in profiles]
+    return pd.DataFrame(rows)
+
+
+def write_reports(perf_df: pd.DataFrame, csv_path: str = "performance_summary.csv",
+                  md_path: str = "performance_report.md", title: str = "Performance Report",
+                  details: Iterable[Any] = ()) -> None:
+    """
+    Write the summary table as CSV and markdown. `details` are StageProfiles
+    whose tracemalloc top allocators and per-worker task timings are appended
+    to the markdown report.
+    """
+    perf_df.to_csv(csv_path, index=False)
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write(f"# {title}\n\n")
+        f.write(perf_df.to_markdown(index=False))
+        f.write("\n")
+        for p in details:
+            if not p.top_allocations and not p.tasks:
+                continue
+            f.write(f"\n## {p.section} | {p.lib}\n\n")
+            if p.top_allocations:
+                f.write(pd.DataFrame(p.top_allocations, columns=["location", "kib"]).to_markdown(index=False))
+                f.write("\n\n")
+            if p.tasks:
+                workers = pd.DataFrame.from_dict(p.worker_summary(), orient="index")
+                workers.index.name = "pid"
+                f.write(workers.to_markdown())
+                f.write("\n")
@@ -0,0 +1,329 @@
+from __future__ import annotations
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import sys
+import sysconfig
+import threading
+import time
+import types
+from typing import Any, Callable, Dict, Iterable, Tuple
+import pandas as pd
+import pyarrow as pa
+
+from data_loader import _source_stamp, is_polars
+
+# ---------- content-addressed result cache ----------
+# A result is stored under sha256(function, its code, input fingerprint,
+# parameters) as an uncompressed Arrow IPC file, so a hit is a memory-mapped
+# read with no recomputation. index.json keeps size, compute time and last
+# access per entry; when the total size exceeds `max_bytes` the least recently
+# used entries are evicted. Several processes may share a directory: under a
+# lock file each merges the index on disk into its own before replacing it.
+# Reads only update access times in memory; they reach the index with the
+# next put (or flush). Only pandas/polars DataFrame results are cached.
+RESULT_CACHE_DIRNAME = ".result_cache"
+_INDEX = "index.json"
+_LOCK = "index.lock"
+_UNKEYED = frozenset({"pool"})  # arguments that change how, not what, is computed
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writes stay atomic, but concurrent merges may drop entries
+    fcntl = None
+
+
+def file_fingerprint(path) -> str:
+    """Cheap fingerprint of a source file: absolute path, size and mtime."""
+    stamp = _source_stamp(path)
+    return f"file:{os.path.abspath(os.fspath(path))}:{stamp['size']}:{stamp['mtime_ns']}"
+
+
+def frame_fingerprint(df) -> str:
+    """Content hash of a pandas/polars frame (values, index and schema)."""
+    h = hashlib.sha256()
+    if is_polars(df, "LazyFrame"):
+        df = df.collect()
+    if is_polars(df):
+        h.update(repr(df.schema).encode())
+        h.update(df.hash_rows(seed=0).to_numpy().tobytes())
+    elif isinstance(df, pd.DataFrame):
+        h.update(repr(df.dtypes.to_dict()).encode() + repr(df.index.names).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    else:
+        raise TypeError("fingerprint needs a pandas or polars frame, or pass fingerprint=")
+    return f"frame:{h.hexdigest()}"
+
+
+def _fn_name(fn: Callable) -> str:
+    return f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', repr(fn))}"
+
+
+def _hash_code(code: types.CodeType, h):
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):  # nested functions; their repr holds an address
+            _hash_code(const, h)
+        else:
+            h.update(repr(const).encode())
+
+
+def code_version(fn: Callable) -> str:
+    """Hash of the function's bytecode and constants ("" for callables without __code__)."""
+    code = getattr(getattr(fn, "func", fn), "__code__", None)  # functools.partial -> its function
+    if code is None:
+        return ""
+    h = hashlib.sha256()
+    _hash_code(code, h)
+    return h.hexdigest()[:16]
+
+
+# ---------- dependency versions ----------
+# The bytecode of `fn` does not change when a helper it calls does, so keys
+# also hash the source of every project module `fn` can reach: its own module
+# and, transitively, any project module (not stdlib or site-packages) that a
+# reached module holds as a global, directly or through an imported function
+# or class.
+_LIBRARY_DIRS = tuple({os.path.abspath(p) for p in (sysconfig.get_paths()[k] for k in ("stdlib", "platstdlib",
+                                                                                          "purelib", "platlib"))})
+_source_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def _project_file(module) -> str | None:
+    path = getattr(module, "__file__", None)
+    if not path or not path.endswith(".py"):
+        return None
+    path = os.path.abspath(path)
+    if path.startswith(_LIBRARY_DIRS) or f"{os.sep}site-packages{os.sep}" in path:
+        return None
+    return path
+
+
+def _source_hash(path: str) -> str:
+    st = os.stat(path)
+    stamp = (path, st.st_size, st.st_mtime_ns)
+    if stamp not in _source_hashes:
+        with open(path, "rb") as f:
+            _source_hashes[stamp] = hashlib.sha256(f.read()).hexdigest()
+    return _source_hashes[stamp]
+
+
+def _project_modules(names: Iterable[str]) -> Dict[str, str]:
+    """{module name: source path} of the project modules reachable from `names`."""
+    found: Dict[str, str] = {}
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        module = sys.modules.get(name)
+        path = _project_file(module) if module is not None else None
+        if name in found or path is None:
+            continue
+        found[name] = path
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                todo.append(value.__name__)
+            elif isinstance(value, (types.FunctionType, type)):
+                todo.append(getattr(value, "__module__", None) or "")
+    return found
+
+
+def dependency_version(fn: Callable, modules: Iterable[str] = ()) -> str:
+    """Hash of the source of the project modules reachable from `fn`'s module and `modules`."""
+    fn = getattr(fn, "func", fn)
+    names = [getattr(fn, "__module__", None) or "", *modules]
+    found = _project_modules(names)
+    h = hashlib.sha256()
+    for name in sorted(found):
+        h.update(f"{name}:{_source_hash(found[name])}\n".encode())
+    return h.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    On-disk cache of function results, e.g.
+
+        cache = ResultCache()
+        out = cache.call(rolling_pandas, df, window=20)
+
+    `call` hashes `df` (or uses `fingerprint=`, e.g. file_fingerprint(csv)),
+    the function name and bytecode, the source of the project modules it can
+    reach (see dependency_version) and the keyword arguments; `pool` is not
+    part of the key. `modules` names extra modules whose source is keyed
+    (e.g. ones only imported inside functions); bump `version` for anything
+    else that changes results.
+    """
+
+    def __init__(self, root=RESULT_CACHE_DIRNAME, max_bytes: int = 1 << 30, version: str = "",
+                 modules: Iterable[str] = ()):
+        self.root = os.fspath(root)
+        self.max_bytes = max_bytes
+        self.version = version
+        self.modules = tuple(modules)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = self._read_index()
+        self._dirty = False        # hits whose access time is not on disk yet
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0       # result bytes served from disk instead of recomputed
+        self.seconds_saved = 0.0   # compute time recorded when those results were stored
+
+    # ----- index -----
+    def _read_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.root, _INDEX), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {k: v for k, v in index.items() if os.path.exists(self._path(k))}
+
+    def _merge_index(self):
+        """Fold in entries other processes stored; drop entries whose file is gone (evicted elsewhere)."""
+        for key, entry in self._read_index().items():
+            mine = self._index.get(key)
+            if mine is None or entry["last_access"] > mine["last_access"]:
+                self._index[key] = entry
+        self._index = {k: v for k, v in self._index.items() if os.path.exists(self._path(k))}
+
+    @contextmanager
+    def _index_lock(self):
+        """Exclusive lock on the directory's index (merge, evict and write as one step)."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.root, _LOCK), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _dump_index(self):
+        tmp = os.path.join(self.root, f"{_INDEX}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, os.path.join(self.root, _INDEX))
+        self._dirty = False
+
+    def _write_index(self):
+        with self._index_lock():
+            self._merge_index()
+            self._evict()
+            self._dump_index()
+
+    def flush(self):
+        """Persist access times recorded by hits since the last write."""
+        with self._lock:
+            if self._dirty:
+                self._write_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.arrow")
+
+    # ----- keys -----
+    @staticmethod
+    def key(fn: Callable | str, fingerprint: str, params: Dict[str, Any], version: str = "",
+            modules: Iterable[str] = ()) -> str:
+        if isinstance(fn, str):
+            name, code, deps = fn, "", ""
+        else:
+            name, code, deps = _fn_name(fn), code_version(fn), dependency_version(fn, modules)
+        payload = json.dumps({"fn": name, "code": code, "deps": deps, "version": version, "data": fingerprint,
+                              "params": {k: v for k, v in sorted(params.items()) if k not in _UNKEYED}},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ----- get / put -----
+    def get(self, key: str):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                with pa.memory_map(self._path(key), "r") as source:
+                    table = pa.ipc.open_file(source).read_all()
+            except (OSError, pa.ArrowInvalid):
+                del self._index[key]
+                try:
+                    os.remove(self._path(key))  # unreadable: don't let the next merge bring it back
+                except OSError:
+                    pass
+                self.misses += 1
+                return None
+            entry["last_access"] = time.time()
+            self._dirty = True
+            self.hits += 1
+            self.bytes_saved += entry["bytes"]
+            self.seconds_saved += entry.get("compute_s", 0.0)
+        if entry["library"] == "pandas":
+            return table.to_pandas()
+        import polars as pl
+        return pl.from_arrow(table)
+
+    def put(self, key: str, result, compute_s: float = 0.0) -> bool:
+        """Store a DataFrame result; returns False (and stores nothing) for other results."""
+        if isinstance(result, pd.DataFrame):
+            table, library = pa.Table.from_pandas(result, preserve_index=True), "pandas"
+        elif is_polars(result):
+            table, library = result.to_arrow(), "polars"
+        else:
+            return False
+        with self._lock:
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp, path)
+            self._index[key] = {"bytes": os.path.getsize(path), "library": library,
+                                "compute_s": compute_s, "last_access": time.time()}
+            self._write_index()  # evicts down to max_bytes
+        return True
+
+    def _evict(self):
+        total = sum(e["bytes"] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)["bytes"]
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def call(self, fn: Callable, df, *args, fingerprint: str | None = None, **kwargs):
+        """fn(df, *args, **kwargs) through the cache (positional args are part of the key)."""
+        params = dict(kwargs)
+        if args:
+            params["__args__"] = list(args)
+        key = self.key(fn, fingerprint or frame_fingerprint(df), params, self.version, self.modules)
+        hit = self.get(key)
+        if hit is not None:
+            return hit
+        t0 = time.perf_counter()
+        result = fn(df, *args, **kwargs)
+        self.put(key, result, time.perf_counter() - t0)
+        return result
+
+    # ----- maintenance -----
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved, "seconds_saved": round(self.seconds_saved, 6),
+                "entries": len(self._index), "size_bytes": sum(e["bytes"] for e in self._index.values()),
+                "max_bytes": self.max_bytes}
+
+    def clear(self):
+        with self._lock, self._index_lock():
+            self._merge_index()  # entries other processes stored too
+            for key in list(self._index):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._index = {}
+            self._dump_index()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+import warnings
+import numpy as np
+import pandas as pd
+
+from portfolio import CompiledPortfolio, PriceIndex, build_price_index, compile_portfolio
+from workers import WorkerPool, thread_executor
+
+# ---------- scenario / stress revaluation ----------
+# A scenario is a vector of simple returns, one per symbol; S scenarios form an
+# S x N shock matrix. Because positions are linear in price, a node's scenario
+# P&L is its exposure vector (value held per symbol in the node's subtree)
+# dotted with the shocks, so all nodes x all scenarios is one matrix product:
+#     pnl (S x nodes) = shocks (S x N) @ exposures.T (N x nodes)
+# The product is computed in scenario chunks sized by `max_bytes` and the
+# chunks run on a thread pool (the matmul releases the GIL). `max_bytes` only
+# sizes the chunks: the shocks (S x N) and the full P&L (S x nodes, kept for
+# VaR/ES and per-node distributions) are both held in memory, so memory grows
+# with S x (N + nodes); `nodes=` is what limits the result.
+_MAX_BYTES = 64 << 20
+
+
+def node_exposures(compiled: CompiledPortfolio, last: np.ndarray) -> np.ndarray:
+    """
+    (nodes x symbols) market value held per symbol in each node's subtree, at
+    prices `last` (aligned with compiled.symbols). Unpriced symbols carry no
+    exposure.
+    """
+    c = compiled
+    n = len(c.names)
+    pos_value = np.nan_to_num(last[c.pos_sym] * c.quantities, nan=0.0)
+    pos_node = np.repeat(np.arange(n), np.diff(c.pos_offsets))
+    exp = np.zeros((n, len(c.symbols)))
+    np.add.at(exp, (pos_node, c.pos_sym), pos_value)
+    # children into parents, deepest level first (like _rollup_compiled)
+    for level in range(int(c.depth.max()), 0, -1):
+        nodes = np.flatnonzero(c.depth == level)
+        np.add.at(exp, c.parents[nodes], exp[nodes])
+    return exp
+
+
+def _last_prices(index: PriceIndex, symbols: List[str], as_of=None) -> np.ndarray:
+    last = np.full(len(symbols), np.nan)
+    for k, sym in enumerate(symbols):
+        start, stop = index.bounds(sym, as_of)
+        if stop > start:
+            last[k] = index.panel.prices[stop - 1]
+    return last
+
+
+def _shock_matrix(shocks, symbols: List[str], universe) -> np.ndarray:
+    """
+    DataFrame columns are matched by symbol: columns for symbols of the price
+    `universe` that the portfolio does not hold are dropped (e.g.
+    historical_shocks over the whole panel), a column that is neither held nor
+    priced is an error (usually a typo), and a portfolio symbol without a
+    column gets a 0 shock with a warning. Arrays must be S x N.
+    """
+    if isinstance(shocks, pd.DataFrame):
+        known = set(symbols)
+        unmatched = [c for c in shocks.columns if c not in known and c not in universe]
+        if unmatched:
+            raise ValueError(f"shock columns match no portfolio or price panel symbol: {unmatched}")
+        absent = [s for s in symbols if s not in shocks.columns]
+        if absent:
+            warnings.warn(f"no shock column for {absent}; they are held unshocked", stacklevel=3)
+        return shocks.reindex(columns=symbols, fill_value=0.0).to_numpy(dtype=np.float64)
+    m = np.asarray(shocks, dtype=np.float64)
+    if m.ndim != 2 or m.shape[1] != len(symbols):
+        raise ValueError(f"shocks must be S x {len(symbols)} (one column per portfolio symbol)")
+    return m
+
+
+# ---------- shock builders ----------
+def factor_shocks(factor_returns, loadings) -> pd.DataFrame | np.ndarray:
+    """
+    Symbol shocks from factor shocks: (S x F) factor returns times (N x F)
+    loadings. With a loadings DataFrame (index = symbol) the result is a
+    DataFrame with one column per symbol.
+    """
+    f = np.asarray(factor_returns, dtype=np.float64)
+    if isinstance(loadings, pd.DataFrame):
+        return pd.DataFrame(f @ loadings.to_numpy(dtype=np.float64).T, columns=list(loadings.index))
+    return f @ np.asarray(loadings, dtype=np.float64).T
+
+
+def historical_shocks(index: PriceIndex, symbols: Sequence[str] | None = None,
+                      horizon: int = 1, as_of=None) -> pd.DataFrame:
+    """
+    Historical replay: every `horizon`-tick return observed on the panel's
+    clock (prices forward-filled across timestamps), one row per timestamp
+    and one column per symbol; rows with any missing symbol are dropped.
+    """
+    symbols = list(index.slices) if symbols is None else list(symbols)
+    series = {s: index.series(s, as_of) for s in symbols if s in index.slices}
+    prices = pd.DataFrame(series).sort_index().ffill()
+    return prices.pct_change(horizon, fill_method=None).dropna(how="any")
+
+
+# ---------- engine ----------
+@dataclass
+class ScenarioResult:
+    """P&L per scenario (rows) and node (columns, pre-order) plus the base values."""
+    names: List[str]
+    nodes: np.ndarray          # node indices into the compiled tree
+    base_value: np.ndarray     # unshocked node values
+    pnl: np.ndarray            # S x len(nodes)
+
+    def _column(self, node) -> int:
+        if isinstance(node, str):
+            return self.names.index(node)
+        return int(np.flatnonzero(self.nodes == node)[0])
+
+    def node_pnl(self, node) -> np.ndarray:
+        """P&L distribution of one node (name or compiled node index)."""
+        return self.pnl[:, self._column(node)]
+
+    def values(self) -> np.ndarray:
+        return self.base_value + self.pnl
+
+    def var(self, alpha: float = 0.99) -> np.ndarray:
+        """Historical-simulation VaR per node: loss (positive) at the 1 - alpha quantile."""
+        return self._tail(alpha)[0]
+
+    def es(self, alpha: float = 0.99) -> np.ndarray:
+        """Expected shortfall per node: mean loss over the worst 1 - alpha of scenarios."""
+        return self._tail(alpha)[1]
+
+    def _tail(self, alpha: float):
+        if not 0.0 < alpha < 1.0:
+            raise ValueError("alpha must be in (0, 1)")
+        s = len(self.pnl)
+        if s == 0:
+            nan = np.full(len(self.nodes), np.nan)
+            return nan, nan
+        k = max(1, int(np.ceil((1.0 - alpha) * s)))  # number of tail scenarios
+        worst = np.partition(self.pnl, k - 1, axis=0)[:k]
+        return -worst[k - 1], -worst.mean(axis=0)
+
+    def summary(self, alphas: Sequence[float] = (0.95, 0.99)) -> pd.DataFrame:
+        out: Dict[str, Any] = {"base_value": self.base_value,
+                               "mean_pnl": self.pnl.mean(axis=0) if len(self.pnl) else np.nan,
+                               "std_pnl": self.pnl.std(axis=0) if len(self.pnl) else np.nan,
+                               "worst_pnl": self.pnl.min(axis=0) if len(self.pnl) else np.nan}
+        for a in alphas:
+            tag = f"{a * 100:g}".replace(".", "_")
+            out[f"var_{tag}"], out[f"es_{tag}"] = self._tail(a)
+        return pd.DataFrame(out, index=pd.Index(self.names, name="node"))
+
+
+def run_scenarios(portfolio, shocks, price_panel: pd.DataFrame | None = None,
+                  index: PriceIndex | None = None, nodes: Sequence[Any] | None = None,
+                  as_of=None, max_bytes: int = _MAX_BYTES, pool: WorkerPool | None = None) -> ScenarioResult:
+    """
+    Revalue the tree under every row of `shocks` (S x N simple returns: an
+    array aligned with the compiled symbols, or a DataFrame with symbol
+    columns, e.g. from historical_shocks / factor_shocks). `portfolio` is the
+    JSON tree or a CompiledPortfolio; prices are the latest (or at `as_of`).
+    `nodes` limits the output to some nodes (names or indices; default all),
+    which shrinks both the work and the S x nodes result. `max_bytes` sizes
+    the chunks of scenarios (shock rows plus P&L rows) that the threads work
+    on; it does not bound the result, which is S x len(nodes) float64s
+    (S x nodes x 8 bytes) next to the S x N shocks.
+    """
+    c = portfolio if isinstance(portfolio, CompiledPortfolio) else compile_portfolio(portfolio)
+    if index is None:
+        index = build_price_index(price_panel)
+    if nodes is None:
+        sel = np.arange(len(c.names))
+    else:
+        sel = np.array([c.names.index(k) if isinstance(k, str) else int(k) for k in nodes], dtype=np.int64)
+
+    exp_t = np.ascontiguousarray(node_exposures(c, _last_prices(index, c.symbols, as_of))[sel].T)
+    m = _shock_matrix(shocks, c.symbols, index.slices)
+    s = len(m)
+    pnl = np.empty((s, len(sel)))
+
+    rows = max(1, max_bytes // (8 * (m.shape[1] + len(sel))))
+    chunks = [(lo, min(lo + rows, s)) for lo in range(0, s, rows)]
+
+    def _chunk(lo: int, hi: int):
+        np.matmul(m[lo:hi], exp_t, out=pnl[lo:hi])
+
+    if len(chunks) <= 1:
+        for lo, hi in chunks:
+            _chunk(lo, hi)
+    else:
+        with thread_executor(pool) as executor:
+            for fut in [executor.submit(_chunk, lo, hi) for lo, hi in chunks]:
+                fut.result()
+    return ScenarioResult(names=[c.names[k] for k in sel], nodes=sel,
+                          base_value=exp_t.sum(axis=0), pnl=pnl)
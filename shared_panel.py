@@ -0,0 +1,207 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+from data_loader import is_polars
+
+# ---------- shared-memory price panel ----------
+# The panel copies timestamp/price/symbol-code columns into one shared memory
+# block, sorted by (symbol, timestamp). Workers attach to the block by name and
+# build zero-copy NumPy views, so only small descriptors (PanelSpec, offset,
+# length, window) are pickled per task.
+
+_ALIGN = 8
+
+
+@dataclass(frozen=True)
+class PanelSpec:
+    """Picklable description of a SharedPanel block."""
+    name: str
+    n_rows: int
+    ts_dtype: str
+    symbols: Tuple[str, ...]
+    offsets: Tuple[int, ...]   # len(symbols) + 1 boundaries into the sorted rows
+
+    def slice_for(self, symbol: str) -> Tuple[int, int]:
+        """(offset, length) of `symbol` in the sorted panel; (0, 0) if absent."""
+        try:
+            i = self.symbols.index(symbol)
+        except ValueError:
+            return 0, 0
+        return self.offsets[i], self.offsets[i + 1] - self.offsets[i]
+
+
+@dataclass(frozen=True)
+class BlockSpec:
+    """Picklable description of a shared float64 (n_cols x n_rows) output block."""
+    name: str
+    n_cols: int
+    n_rows: int
+
+
+def _padded(nbytes: int) -> int:
+    return -(-nbytes // _ALIGN) * _ALIGN
+
+
+def _panel_layout(n: int) -> Dict[str, Tuple[int, type]]:
+    # byte offsets of each column inside the block
+    ts_off = 0
+    px_off = ts_off + _padded(n * 8)
+    code_off = px_off + _padded(n * 8)
+    return {"timestamp": (ts_off, np.int64), "price": (px_off, np.float64), "code": (code_off, np.int32),
+            "_end": (code_off + _padded(n * 4), None)}
+
+
+def _panel_views(buf, n: int) -> Dict[str, np.ndarray]:
+    layout = _panel_layout(n)
+    return {k: np.ndarray((n,), dtype=dt, buffer=buf, offset=off)
+            for k, (off, dt) in layout.items() if dt is not None}
+
+
+def _create(nbytes: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+
+
+# worker-side attachments, keyed by block name; kept small so a long-lived
+# worker does not pin unlinked blocks forever
+_ATTACHED: Dict[str, shared_memory.SharedMemory] = {}
+_MAX_ATTACHED = 8
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    shm = _ATTACHED.get(name)
+    if shm is None:
+        while len(_ATTACHED) >= _MAX_ATTACHED:
+            old = _ATTACHED.pop(next(iter(_ATTACHED)))
+            try:
+                old.close()
+            except BufferError:
+                pass
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            # older Pythons register with the parent's resource tracker, which is
+            # a set, so this is a no-op for a block the parent already owns
+            shm = shared_memory.SharedMemory(name=name)
+        _ATTACHED[name] = shm
+    return shm
+
+
+def attach_panel(spec: PanelSpec) -> Dict[str, np.ndarray]:
+    """Worker-side: zero-copy views of the panel columns."""
+    return _panel_views(_attach(spec.name).buf, spec.n_rows)
+
+
+def attach_block(spec: BlockSpec) -> np.ndarray:
+    """Worker-side: zero-copy (n_cols, n_rows) float64 view of an output block."""
+    return np.ndarray((spec.n_cols, spec.n_rows), dtype=np.float64, buffer=_attach(spec.name).buf)
+
+
+def _columns(df) -> Tuple[np.ndarray, str, np.ndarray, np.ndarray]:
+    """(int64 timestamps, their datetime64 dtype, symbols, prices) of a pandas or polars frame."""
+    if is_polars(df):
+        ts = df["timestamp"].to_numpy()
+        return ts.view(np.int64), str(ts.dtype), df["symbol"].to_numpy(), df["price"].to_numpy()
+    idx = pd.DatetimeIndex(df["timestamp"] if "timestamp" in df.columns else df.index)
+    return idx.asi8, f"datetime64[{idx.unit}]", df["symbol"].to_numpy(), df["price"].to_numpy()
+
+
+@dataclass(frozen=True)
+class SortedPanel:
+    """Panel columns stable-sorted by (symbol, timestamp); `order` maps back to source rows."""
+    order: np.ndarray
+    symbols: Tuple[str, ...]
+    offsets: Tuple[int, ...]   # len(symbols) + 1 boundaries into the sorted rows
+    codes: np.ndarray
+    timestamps: np.ndarray     # int64, sorted
+    ts_dtype: str
+    prices: np.ndarray         # float64, sorted
+
+
+def sort_by_symbol(df) -> SortedPanel:
+    """Sort a pandas or polars price panel once by (symbol, timestamp)."""
+    ts_i8, ts_dtype, sym, price = _columns(df)
+    symbols, codes = np.unique(sym.astype(str), return_inverse=True)
+    order = np.lexsort((ts_i8, codes))  # stable
+    codes = codes.astype(np.int32)[order]
+    offsets = np.searchsorted(codes, np.arange(len(symbols) + 1)).tolist()
+    return SortedPanel(order=order, symbols=tuple(symbols.tolist()), offsets=tuple(offsets), codes=codes,
+                       timestamps=ts_i8[order], ts_dtype=ts_dtype,
+                       prices=price.astype(np.float64, copy=False)[order])
+
+
+class SharedPanel:
+    """
+    Price panel held in `multiprocessing.shared_memory`.
+
+    Build once with `SharedPanel.from_frame(df)` (pandas with a timestamp index or
+    column, or polars), hand `panel.spec` to workers, and `close()` (or use as a
+    context manager) when done. `order` maps sorted rows back to rows of `df`.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, spec: PanelSpec, order: np.ndarray):
+        self._shm = shm
+        self.spec = spec
+        self.order = order
+        self.views = _panel_views(shm.buf, spec.n_rows)
+
+    @classmethod
+    def from_frame(cls, df) -> "SharedPanel":
+        return cls.from_sorted(sort_by_symbol(df))
+
+    @classmethod
+    def from_sorted(cls, sp: SortedPanel) -> "SharedPanel":
+        n = len(sp.order)
+        shm = _create(_panel_layout(n)["_end"][0])
+        views = _panel_views(shm.buf, n)
+        views["timestamp"][:] = sp.timestamps
+        views["price"][:] = sp.prices
+        views["code"][:] = sp.codes
+        del views
+
+        spec = PanelSpec(name=shm.name, n_rows=n, ts_dtype=sp.ts_dtype,
+                         symbols=sp.symbols, offsets=sp.offsets)
+        return cls(shm, spec, sp.order)
+
+    def timestamps(self) -> np.ndarray:
+        return self.views["timestamp"].view(self.spec.ts_dtype)
+
+    def close(self):
+        if self._shm is None:
+            return
+        self.views = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SharedBlock:
+    """Owner side of a shared float64 (n_cols, n_rows) block, e.g. worker outputs."""
+
+    def __init__(self, n_cols: int, n_rows: int):
+        self._shm = _create(n_cols * n_rows * 8)
+        self.spec = BlockSpec(name=self._shm.name, n_cols=n_cols, n_rows=n_rows)
+        self.array = np.ndarray((n_cols, n_rows), dtype=np.float64, buffer=self._shm.buf)
+        self.array.fill(np.nan)
+
+    def close(self):
+        if self._shm is None:
+            return
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from collections import deque
+from typing import Any, Dict, Iterable
+import math
+
+from data_loader import is_polars
+
+# ---------- streaming rolling metrics ----------
+# Incremental counterpart of metrics.rolling_pandas / rolling_polars: one state
+# per symbol, O(1) work per tick. Semantics match the batch functions:
+#   ret    = price / previous price - 1
+#   ma/std = rolling mean / std (ddof=1) of price over `window`
+#   sharpe = rolling mean / std of ret over `window`
+# Values are NaN until a full window is available (pandas min_periods=window).
+
+NAN = float("nan")
+OUTPUT_COLUMNS = ["ret", "ma", "std", "sharpe"]
+
+
+class _Window:
+    """Sliding-window mean/variance with O(1) Welford add/replace updates."""
+    __slots__ = ("size", "buf", "mean", "m2", "replaced", "resync_every")
+
+    def __init__(self, size: int, resync_every: int):
+        self.size = size
+        self.buf = deque(maxlen=size)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.replaced = 0
+        self.resync_every = resync_every
+
+    def push(self, x: float):
+        buf = self.buf
+        if len(buf) < self.size:
+            buf.append(x)
+            d = x - self.mean
+            self.mean += d / len(buf)
+            self.m2 += d * (x - self.mean)
+            return
+        old = buf[0]
+        buf.append(x)  # maxlen drops `old`
+        old_mean = self.mean
+        self.mean += (x - old) / self.size
+        self.m2 += (x - old) * (x - self.mean + old - old_mean)
+        self.replaced += 1
+        if self.replaced % self.resync_every == 0:
+            self._resync()
+
+    def _resync(self):
+        # bound floating-point drift of the running sums: exact two-pass recompute, O(window)
+        n = len(self.buf)
+        self.mean = math.fsum(self.buf) / n
+        self.m2 = math.fsum((v - self.mean) ** 2 for v in self.buf)
+
+    @property
+    def full(self) -> bool:
+        return len(self.buf) == self.size
+
+    def current_mean(self) -> float:
+        return self.mean if self.full else NAN
+
+    def current_std(self) -> float:
+        if not self.full or self.size < 2:
+            return NAN
+        return math.sqrt(max(self.m2, 0.0) / (self.size - 1))
+
+
+def _ratio(num: float, den: float) -> float:
+    # float semantics of the batch path: x/0 -> +-inf, 0/0 and NaN -> NaN
+    if den != den or num != num:
+        return NAN
+    if den == 0.0:
+        return NAN if num == 0.0 else math.copysign(math.inf, num)
+    return num / den
+
+
+class _SymbolState:
+    __slots__ = ("prev", "prices", "returns")
+
+    def __init__(self, window: int, resync_every: int):
+        self.prev = None
+        self.prices = _Window(window, resync_every)
+        self.returns = _Window(window, resync_every)
+
+
+class StreamingMetrics:
+    """
+    Stateful incremental rolling metrics keyed by symbol.
+
+    `update(symbol, price)` consumes one tick and returns the new
+    ret/ma/std/sharpe for that symbol; `update_batch(df)` consumes a
+    micro-batch (pandas or polars, rows in arrival order) and returns the same
+    frame type with the metric columns added.
+    """
+
+    def __init__(self, window: int = 20, resync_every: int = 1024):
+        if window < 1:
+            raise ValueError("window must be >= 1")
+        self.window = window
+        self.resync_every = resync_every
+        self._state: Dict[str, _SymbolState] = {}
+
+    @property
+    def symbols(self):
+        return list(self._state)
+
+    def reset(self, symbol: str | None = None):
+        if symbol is None:
+            self._state.clear()
+        else:
+            self._state.pop(symbol, None)
+
+    def update(self, symbol: str, price: float) -> Dict[str, float]:
+        price = float(price)
+        if not math.isfinite(price):
+            raise ValueError(f"non-finite price for {symbol}: {price}")
+        st = self._state.get(symbol)
+        if st is None:
+            st = self._state[symbol] = _SymbolState(self.window, self.resync_every)
+
+        ret = NAN
+        if st.prev is not None:
+            ret = _ratio(price, st.prev) - 1.0
+            st.returns.push(ret)
+        st.prev = price
+        st.prices.push(price)
+
+        return {
+            "ret": ret,
+            "ma": st.prices.current_mean(),
+            "std": st.prices.current_std(),
+            "sharpe": _ratio(st.returns.current_mean(), st.returns.current_std()),
+        }
+
+    def update_many(self, symbols: Iterable[str], prices: Iterable[float]) -> Dict[str, list]:
+        out: Dict[str, list] = {c: [] for c in OUTPUT_COLUMNS}
+        for sym, px in zip(symbols, prices):
+            row = self.update(sym, px)
+            for c in OUTPUT_COLUMNS:
+                out[c].append(row[c])
+        return out
+
+    def update_batch(self, df: Any):
+        if is_polars(df):
+            import polars as pl
+            cols = self.update_many(df["symbol"].to_list(), df["price"].to_list())
+            return df.with_columns([pl.Series(c, cols[c], dtype=pl.Float64, nan_to_null=True)
+                                    for c in OUTPUT_COLUMNS])
+        cols = self.update_many(df["symbol"].tolist(), df["price"].tolist())
+        out = df.copy()
+        for c in OUTPUT_COLUMNS:
+            out[c] = cols[c]
+        return out
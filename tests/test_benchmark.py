@@ -0,0 +1,30 @@
+# tests/test_benchmark.py
+import benchmark
+
+def test_generators_are_deterministic():
+    a = benchmark.generate_market_data(n_symbols=4, n_rows=1001, seed=7)
+    b = benchmark.generate_market_data(n_symbols=4, n_rows=1001, seed=7)
+    assert a.equals(b)
+    assert len(a) == 1001 and a["symbol"].nunique() == 4
+
+    syms = sorted(a["symbol"].unique())
+    port = benchmark.generate_portfolio(syms, depth=2, width=3, positions_per_node=2)
+    assert len(port["sub_portfolios"]) == 3
+    assert len(port["sub_portfolios"][0]["sub_portfolios"]) == 3
+    assert "sub_portfolios" not in port["sub_portfolios"][0]["sub_portfolios"][0]
+
+def test_matrix_and_regression_compare(tmp_path):
+    res = benchmark.run_matrix(symbols=[2], rows=[2000], warmup=0, repeat=2, stages=["rolling"], max_workers=1)
+    assert {r["variant"] for r in res} == {"pandas-numpy", "pandas-groupby", "polars",
+                                           "pandas-numpy-metrics32", "polars-metrics32",
+                                           "pandas-numpy-resultcache", "polars-resultcache"}
+    mb = {r["variant"]: r["result_mb"] for r in res}
+    assert mb["pandas-numpy-metrics32"] < mb["pandas-numpy"] and mb["polars-metrics32"] < mb["polars"]
+    assert all(r["p95_s"] >= r["median_s"] > 0 for r in res)
+
+    out = tmp_path / "bench.json"
+    benchmark.save_results(res, out)
+    baseline = benchmark.load_results(out)
+    slower = [dict(r, median_s=r["median_s"] * 2) for r in res]
+    assert not any(c["regression"] for c in benchmark.compare(res, baseline))
+    assert all(c["regression"] for c in benchmark.compare(slower, baseline, threshold=0.5))
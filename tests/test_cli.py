@@ -0,0 +1,52 @@
+# tests/test_cli.py
+import json
+import os
+import subprocess
+import sys
+import cli
+from conftest import CSV_PATH, PORTFOLIO_JSON
+
+def test_portfolio_command_matches_sequential(df_pandas, portfolio_dict, tmp_path, capsys):
+    from data_loader import load_pandas
+    from portfolio import aggregate_portfolio_sequential
+
+    out = tmp_path / "snap.json"
+    assert cli.main(["portfolio", CSV_PATH, "--portfolio", PORTFOLIO_JSON, "--out", str(out)]) == 0
+    snap = json.loads(out.read_text())
+    expect = aggregate_portfolio_sequential(portfolio_dict, load_pandas(CSV_PATH))
+    assert abs(snap["total_value"] - expect["total_value"]) < 1e-6
+
+    assert cli.main(["--timings", "rolling", CSV_PATH, "--window", "5", "20", "--output", "metrics"]) == 0
+    captured = capsys.readouterr()
+    assert "ma_5" in captured.out and "sharpe_20" in captured.out
+    timings = json.loads(captured.err.strip().splitlines()[-1])
+    assert timings["command"] == "rolling" and timings["imports_s"] >= 0
+
+def test_cold_start_imports_only_what_the_command_needs():
+    code = ("import sys, cli; heavy = ('pandas', 'polars', 'matplotlib', 'psutil');"
+            "print([m for m in heavy if m in sys.modules])")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(cli.__file__)))
+    assert out.stdout.strip() == "[]"
+
+    res = subprocess.run([sys.executable, cli.__file__, "--timings", "load", CSV_PATH],
+                         capture_output=True, text=True, check=True)
+    timings = json.loads(res.stderr.strip().splitlines()[-1])
+    assert "pandas" in timings["modules"]
+    assert not {"polars", "matplotlib", "psutil"} & set(timings["modules"])
+
+def test_pandas_commands_never_load_polars():
+    # parallel runs in its default auto mode, so the calibration is covered too
+    for args in (["rolling", CSV_PATH], ["parallel", CSV_PATH, "--workers", "2"]):
+        res = subprocess.run([sys.executable, cli.__file__, "--timings", *args],
+                             capture_output=True, text=True, check=True)
+        timings = json.loads(res.stderr.strip().splitlines()[-1])
+        assert timings["command"] == args[0] and "pandas" in timings["modules"]
+        assert "polars" not in timings["modules"], args
+
+def test_library_modules_import_without_polars():
+    code = ("import sys, benchmark, data_loader, parallel, portfolio, result_cache, scenarios, shared_panel, "
+            "streaming, workers; print('polars' in sys.modules, 'polars' in workers.DEFAULT_PRELOAD)")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(cli.__file__)))
+    assert out.stdout.strip() == "False False"
@@ -21,4 +21,51 @@ def test_load_polars(tmp_path):
     df = load_polars(f)
     assert isinstance(df, pl.DataFrame)
     assert {"timestamp", "symbol", "price"}.issubset(df.columns)
-    assert df.height == 2
\ No newline at end of file
+    assert df.height == 2
+
+def test_cached_loads_match_and_invalidate(tmp_path):
+    f = tmp_path / "market_data-1.csv"
+    f.write_text("timestamp,symbol,price\n2024-01-01 09:30:00,AAPL,170.5\n2024-01-01 09:30:00,MSFT,310.2\n"
+                 "2024-01-01 09:31:00,AAPL,170.7\n")
+    cache_dir = tmp_path / "cache"
+
+    pd.testing.assert_frame_equal(load_pandas(f, cache_dir=cache_dir), load_pandas(f))
+    assert load_polars(f, cache_dir=cache_dir).equals(load_polars(f))
+    assert len(list(cache_dir.glob("*/part-*.arrow"))) == 2  # one partition per symbol
+
+    # rewriting the source (size changes) must invalidate the cached copy
+    f.write_text("timestamp,symbol,price\n2024-01-01 09:30:00,AAPL,171.0\n")
+    df = load_polars(f, cache_dir=cache_dir)
+    assert df.height == 1 and df["price"][0] == 171.0
+    assert len(list(cache_dir.glob("*/part-*.arrow"))) == 1
+
+
+def test_scan_market_data_pushdown(tmp_path):
+    from data_loader import scan_market_data
+    import polars as pl
+    f = tmp_path / "market_data-1.csv"
+    f.write_text("timestamp,symbol,price\n2024-01-01 09:30:00,AAPL,170.5\n2024-01-01 09:30:00,MSFT,310.2\n"
+                 "2024-01-01 09:31:00,AAPL,170.7\n2024-01-01 09:32:00,AAPL,170.9\n2024-01-01 09:32:00,SPY,430.0\n")
+    full = load_polars(f)
+    expected = full.filter((pl.col("symbol") == "AAPL") & (pl.col("timestamp") >= pl.datetime(2024, 1, 1, 9, 31)))
+
+    for kwargs in ({}, {"cache_dir": tmp_path / "cache"}):
+        lf = scan_market_data(f, symbols=["AAPL"], start="2024-01-01 09:31", **kwargs)
+        assert isinstance(lf, pl.LazyFrame)
+        assert lf.collect().equals(expected)
+        assert scan_market_data(f, symbols=["XYZ"], **kwargs).collect().height == 0
+        cols = scan_market_data(f, columns=["symbol", "price"], end="2024-01-01 09:30", **kwargs).collect()
+        assert cols.columns == ["symbol", "price"] and cols.height == 2
+
+def test_compact_loaders_encode_symbols_and_downcast(tmp_path):
+    import polars as pl
+    f = tmp_path / "market_data-1.csv"
+    f.write_text("timestamp,symbol,price\n2024-01-01 09:30:00,AAPL,170.5\n2024-01-01 09:30:00,MSFT,310.2\n"
+                 "2024-01-01 09:31:00,AAPL,170.7\n")
+    for kwargs in ({}, {"cache_dir": tmp_path / "cache"}):
+        pdf = load_pandas(f, compact=True, float32=True, **kwargs)
+        assert str(pdf["symbol"].dtype) == "category" and pdf["price"].dtype == "float32"
+        assert pdf["symbol"].astype(str).tolist() == load_pandas(f)["symbol"].tolist()
+        pol = load_polars(f, compact=True, float32=True, **kwargs)
+        assert pol.schema["symbol"] == pl.Categorical and pol.schema["price"] == pl.Float32
+        assert load_polars(f, compact=True, **kwargs).schema["price"] == pl.Float64
@@ -0,0 +1,67 @@
+# tests/test_ingest.py
+import asyncio
+import time
+import polars as pl
+import pytest
+from data_loader import load_polars, load_pandas
+from ingest import ingest_files, iter_ingest, load_files, resolve_paths
+from metrics import rolling_polars
+
+def _write_days(df_polars: pl.DataFrame, tmp_path, n=3):
+    out = df_polars.head(3000).with_columns(pl.col("timestamp").dt.strftime("%Y-%m-%d %H:%M:%S"))
+    paths = []
+    for k in range(n):
+        p = tmp_path / f"day_{k}.csv"
+        out.slice(k * 1000, 1000).write_csv(p)
+        paths.append(str(p))
+    return paths
+
+def test_load_files_matches_per_file_rolling(df_polars: pl.DataFrame, tmp_path):
+    paths = _write_days(df_polars, tmp_path)
+    assert resolve_paths(tmp_path) == paths
+    assert resolve_paths(str(tmp_path / "day_*.csv")) == paths
+
+    results, stats = load_files(tmp_path, library="polars", window=5, concurrency=2, queue_size=1)
+    assert list(results) == paths
+    for p in paths:
+        assert results[p].equals(rolling_polars(load_polars(p), 5))
+    s = stats.summary()
+    assert s["files"] == 3 and s["rows"] == 3000
+    assert 0 <= s["max_queue_depth"] <= 1
+    assert len(stats.to_frame()) == 3
+
+    raw, _ = load_files(paths, library="pandas", process=lambda df: df)
+    assert raw[paths[0]].equals(load_pandas(paths[0]))
+
+def test_ingest_streams_and_propagates_errors(df_polars: pl.DataFrame, tmp_path):
+    paths = _write_days(df_polars, tmp_path, n=2)
+
+    async def first():
+        async for path, result, fs in iter_ingest(paths, process=len):
+            return path, result, fs
+
+    path, result, fs = asyncio.run(first())
+    assert path in paths and result == 1000 and fs.rows == 1000
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(ingest_files(paths + [str(tmp_path / "missing.csv")]))
+
+def test_cancelled_ingest_does_not_block_the_loop(df_polars: pl.DataFrame, tmp_path):
+    paths = _write_days(df_polars, tmp_path, n=2)
+
+    def slow(df):
+        time.sleep(1.0)
+        return len(df)
+
+    async def consume():
+        async for _ in iter_ingest(paths, process=slow):
+            pass
+
+    async def main():
+        t = time.perf_counter()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(consume(), 0.2)
+        return time.perf_counter() - t
+
+    # the transient executor is shut down without waiting for the running task
+    assert asyncio.run(main()) < 0.8
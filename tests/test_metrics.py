@@ -1,7 +1,9 @@
 import datetime as dt
+import numpy as np
 import pandas as pd
 import polars as pl
-from metrics import rolling_pandas, rolling_polars
+import kernels
+from metrics import rolling_chunked, rolling_pandas, rolling_polars
 
 def test_rolling_pandas_basic():
     idx = pd.date_range("2024-01-01", periods=25, freq="D", tz="UTC")
@@ -25,4 +27,65 @@ def test_rolling_polars_basic():
     })
     r = rolling_polars(df, window=5)
     assert all(c in r.columns for c in ["ma","std","sharpe"])
-    assert r.height == df.height
\ No newline at end of file
+    assert r.height == df.height
+
+def test_rolling_pandas_numpy_matches_groupby(df_pandas):
+    # interleave symbols so the sort/scatter-back path is exercised
+    small = df_pandas.groupby("symbol", group_keys=False).head(2000).sort_index(kind="stable")
+    a = rolling_pandas(small, window=20, method="numpy")
+    b = rolling_pandas(small, window=20, method="groupby")
+    assert list(a.columns) == list(b.columns)
+    assert (a["symbol"].to_numpy() == b["symbol"].to_numpy()).all()
+    for c in ["ret", "ma", "std", "sharpe"]:
+        assert np.allclose(a[c].to_numpy(), b[c].to_numpy(), rtol=1e-9, atol=1e-12, equal_nan=True)
+
+def test_rolling_sums_long_windows_and_constant_runs():
+    rng = np.random.default_rng(1)
+    lengths = [3000, 40, 1800]
+    x = np.concatenate([100 + np.cumsum(rng.normal(0, 0.1, n)) for n in lengths])
+    x[3100:3160] = x[3100]  # a constant stretch: exact mean, std exactly 0
+    codes = np.repeat(np.arange(3), lengths)
+    pos = kernels.group_positions(codes)
+    bounds = np.cumsum([0] + lengths)
+    for w in (2, 20, 1024, 1500):  # 1500 > the default segment, so the sums grow to fit
+        mean, std = kernels.RollingSums(x, pos, w).mean_std(w)
+        # exact two-pass reference per group
+        exp_mean, exp_std = np.full(len(x), np.nan), np.full(len(x), np.nan)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if hi - lo >= w:
+                win = np.lib.stride_tricks.sliding_window_view(x[lo:hi], w)
+                exp_mean[lo + w - 1:hi], exp_std[lo + w - 1:hi] = win.mean(axis=1), win.std(axis=1, ddof=1)
+        assert np.allclose(mean, exp_mean, rtol=1e-12, equal_nan=True)
+        # sum-of-squares cancellation: absolute error ~ eps * price**2 / std
+        assert np.allclose(std, exp_std, rtol=1e-9, atol=1e-8, equal_nan=True)
+    _, std = kernels.RollingSums(x, pos, 20).mean_std(20)
+    assert (std[3119:3160] == 0.0).all()
+
+def test_multi_window_matches_single_window(df_pandas):
+    small = df_pandas.groupby("symbol", group_keys=False).head(500).sort_index(kind="stable")
+    for method in ("numpy", "groupby"):
+        multi = rolling_pandas(small, window=[5, 20], method=method)
+        for w in (5, 20):
+            single = rolling_pandas(small, window=w, method=method)
+            for c in ["ma", "std", "sharpe"]:
+                assert np.array_equal(multi[f"{c}_{w}"].to_numpy(), single[c].to_numpy(), equal_nan=True)
+    r = rolling_polars(pl.from_pandas(small.reset_index()), window=[5, 20])
+    assert {"ret", "ma_5", "sharpe_20"} <= set(r.columns) and "ma" not in r.columns
+
+def test_rolling_chunked_matches_in_memory(df_pandas, tmp_path):
+    small = df_pandas.groupby("symbol", group_keys=False).head(1500).sort_index(kind="stable")
+    ref = rolling_pandas(small, window=[5, 20])
+
+    chunks = [small.iloc[i:i + 997] for i in range(0, len(small), 997)]
+    info = rolling_chunked(iter(chunks), tmp_path / "out.parquet", window=[5, 20])
+    got = pd.read_parquet(tmp_path / "out.parquet")
+    assert info["rows"] == len(small) and info["chunks"] == len(chunks)
+    assert list(got.columns) == list(ref.columns)
+    for c in ref.columns:
+        assert np.array_equal(got[c].to_numpy(), ref[c].to_numpy(), equal_nan=ref[c].dtype.kind == "f")
+
+    csv = tmp_path / "md.csv"
+    small.reset_index().to_csv(csv, index=False)
+    rolling_chunked(csv, tmp_path / "m.parquet", window=20, chunk_rows=1000, output="metrics")
+    m = pd.read_parquet(tmp_path / "m.parquet")
+    assert np.array_equal(m["std"].to_numpy(), rolling_pandas(small)["std"].to_numpy(), equal_nan=True)
@@ -69,3 +69,119 @@ def test_parallel_polars_runs(df_polars: pl.DataFrame):
     for c in ["return", "ma", "std", "sharpe", "price", "symbol"]:
         assert c in thr.columns
         assert c in pro.columns
+
+def test_shared_multiprocessing_matches_threading(df_pandas: pd.DataFrame):
+    small = df_pandas.groupby("symbol", group_keys=False).head(500).copy()
+
+    thr = _as_key(parallel.compute_threading(small, library="pandas", window=20))
+    shm = _as_key(parallel.compute_multiprocessing(small, library="pandas", window=20, shared=True))
+
+    assert len(thr) == len(shm)
+    for c in ["return", "ma", "std", "sharpe"]:
+        assert np.allclose(thr[c].to_numpy(), shm[c].to_numpy(), equal_nan=True)
+
+def test_lazy_scan_accepted_by_rolling_and_parallel(df_polars: pl.DataFrame, tmp_path):
+    from data_loader import scan_market_data
+    from metrics import rolling_pandas, rolling_polars
+
+    f = tmp_path / "md.csv"
+    df_polars.head(3000).with_columns(pl.col("timestamp").dt.strftime("%Y-%m-%d %H:%M:%S")).write_csv(f)
+    sym = df_polars["symbol"][0]
+    lf = scan_market_data(f, symbols=[sym])
+
+    assert rolling_polars(lf).equals(rolling_polars(lf.collect()))
+    assert rolling_pandas(lf)["symbol"].unique().tolist() == [sym]
+    thr = parallel.compute_threading(lf, library="polars", window=20)
+    assert isinstance(thr, pl.DataFrame) and thr["symbol"].unique().to_list() == [sym]
+    assert len(parallel.compute_threading(lf, library="pandas", window=20)) == thr.height
+
+def test_polars_lazy_matches_threaded_polars(df_polars: pl.DataFrame):
+    thr = parallel.compute_threading(df_polars, library="polars", window=20)
+    lazy = parallel.compute_threading(df_polars, library="polars-lazy", window=20)
+    assert isinstance(lazy, pl.DataFrame)
+    assert lazy.columns == thr.columns
+
+    key = ["symbol", "timestamp"]
+    thr, lazy = thr.sort(key), lazy.sort(key)
+    for c in ["return", "ma", "std", "sharpe"]:
+        assert np.allclose(thr[c].fill_null(np.nan).to_numpy(), lazy[c].fill_null(np.nan).to_numpy(),
+                           equal_nan=True)
+    assert parallel.compute_multiprocessing(df_polars, library="polars-lazy").height == df_polars.height
+
+def test_multi_window_columns_across_executors(df_pandas: pd.DataFrame, df_polars: pl.DataFrame):
+    windows = [5, 20]
+    cols = parallel.metric_columns(windows)
+    assert cols == ["return", "ma_5", "std_5", "sharpe_5", "ma_20", "std_20", "sharpe_20"]
+
+    single = parallel.compute_threading(df_pandas, library="pandas", window=20)
+    thr = parallel.compute_threading(df_pandas, library="pandas", window=windows)
+    shm = parallel.compute_multiprocessing(df_pandas, library="pandas", window=windows, shared=True)
+    for c in cols:
+        assert np.allclose(thr[c].to_numpy(), shm[c].to_numpy(), equal_nan=True)
+    assert np.allclose(thr["std_20"].to_numpy(), single["std"].to_numpy(), equal_nan=True)
+
+    pol = parallel.compute_threading(df_polars, library="polars", window=windows)
+    lazy = parallel.compute_polars_lazy(df_polars, window=windows)
+    assert set(cols) <= set(pol.columns) and set(cols) <= set(lazy.columns)
+
+def test_metrics_output_is_aligned_to_input(df_pandas: pd.DataFrame, df_polars: pl.DataFrame):
+    cols = parallel.metric_columns(20)
+    sym = df_pandas["symbol"].to_numpy()
+    for run in (lambda **kw: parallel.compute_threading(df_pandas, library="pandas", **kw),
+                lambda **kw: parallel.compute_multiprocessing(df_pandas, library="pandas", **kw),
+                lambda **kw: parallel.compute_multiprocessing(df_pandas, library="pandas", shared=True, **kw)):
+        m = run(output="metrics", float32=True)
+        assert list(m.columns) == cols and (m.dtypes == np.float32).all()
+        assert m.index.equals(df_pandas.index)
+        for s in np.unique(sym):
+            ref = parallel.compute_metrics_for_symbol(df_pandas[sym == s])
+            assert np.allclose(m["std"].to_numpy()[sym == s], ref["std"].to_numpy(), rtol=1e-5, equal_nan=True)
+
+    m = parallel.compute_threading(df_polars, library="polars", output="metrics")
+    ref = parallel.compute_polars_lazy(df_polars, output="metrics")
+    assert m.columns == cols and m.height == df_polars.height
+    assert np.allclose(m["ma"].fill_null(np.nan).to_numpy(), ref["ma"].fill_null(np.nan).to_numpy(), equal_nan=True)
+
+def _calibration(**kw):
+    base = dict(cpu_count=8, call_s={"pandas": 1e-3, "polars": 1e-4}, row_s={"pandas": 1e-6, "polars": 1e-7},
+                thread_speedup={"pandas": 1.0, "polars": 3.0}, thread_task_s=1e-5, process_startup_s=1.0,
+                process_task_s=1e-4, ipc_row_s=1e-7, engine_call_s=1e-3, engine_row_s=1e-6)
+    base.update(kw)
+    return parallel.Calibration(**base)
+
+def test_plan_execution_follows_cost_model():
+    cal = _calibration()
+    assert parallel.plan_execution(1000, 3, "pandas", calibration=cal).mode == "serial"
+    heavy = parallel.plan_execution(50_000_000, 2000, "pandas", calibration=cal)
+    assert heavy.mode == "process" and heavy.max_workers == 8 and heavy.chunksize == 63
+    assert parallel.plan_execution(5_000_000, 50, "polars", calibration=cal).mode == "thread"
+    cheap_engine = _calibration(engine_row_s=1e-9)
+    assert parallel.plan_execution(5_000_000, 50, "polars", calibration=cheap_engine).mode == "engine"
+    assert "engine" not in heavy.estimates
+
+def test_compute_auto_runs_every_mode_and_logs(df_pandas: pd.DataFrame, df_polars: pl.DataFrame, caplog):
+    import logging
+    ref = _as_key(parallel.compute_threading(df_pandas, library="pandas"))
+    for mode in ("serial", "thread", "process"):
+        plan = parallel.ExecutionPlan(mode=mode, library="pandas", max_workers=1, chunksize=2)
+        with caplog.at_level(logging.INFO, logger="parallel"):
+            got = _as_key(parallel.compute_auto(df_pandas, "pandas", plan=plan))
+        assert f"mode={mode}" in caplog.text
+        assert np.allclose(got["sharpe"].to_numpy(), ref["sharpe"].to_numpy(), equal_nan=True)
+
+    # a shared pool runs the plan with at most plan.max_workers of its workers
+    from workers import WorkerPool
+    with WorkerPool(max_workers=2) as pool:
+        for mode in ("thread", "process"):
+            plan = parallel.ExecutionPlan(mode=mode, library="pandas", max_workers=1, chunksize=2)
+            got = _as_key(parallel.compute_auto(df_pandas, "pandas", pool=pool, plan=plan))
+            assert np.allclose(got["sharpe"].to_numpy(), ref["sharpe"].to_numpy(), equal_nan=True)
+
+    plan = parallel.ExecutionPlan(mode="engine", library="polars", max_workers=1, chunksize=1)
+    assert parallel.compute_auto(df_polars, "polars", plan=plan).height == df_polars.height
+    assert len(parallel.compute_auto(df_pandas, "pandas", calibration=_calibration())) == len(df_pandas)
+
+def test_calibrate_is_cached():
+    cal = parallel.calibrate()
+    assert parallel.calibrate() is cal
+    assert cal.process_startup_s > 0 and set(cal.row_s) == {"pandas", "polars"}
@@ -31,3 +31,271 @@ def test_portfolio_position_values_match_latest_price(df_pandas: pd.DataFrame, p
     assert match, f"No aggregated position for {sym}"
     computed_val = match[0]["value"]
     assert abs(computed_val - qty * last_px) < 1e-6
+
+def test_portfolio_shared_panel_matches_sequential(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    seq = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20)
+    shm = aggregate_portfolio_parallel(portfolio_dict, df_pandas, vol_window=20, shared=True)
+
+    assert abs(seq["total_value"] - shm["total_value"]) < 1e-6
+    assert np.isclose(seq["aggregate_volatility"], shm["aggregate_volatility"])
+    assert seq["max_drawdown"] == shm["max_drawdown"]
+
+def test_price_index_slices_match_mask_lookup(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    from portfolio import build_price_index
+
+    index = build_price_index(df_pandas)
+    for sym in df_pandas["symbol"].unique():
+        a = index.series(sym)
+        b = df_pandas[df_pandas["symbol"] == sym].sort_index()["price"].astype(float)
+        assert np.array_equal(a.to_numpy(), b.to_numpy())
+    assert index.series("NOT_A_SYMBOL").empty
+
+    seq = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, index=index)
+    par = aggregate_portfolio_parallel(portfolio_dict, df_pandas, vol_window=20, index=index)
+    assert abs(seq["total_value"] - par["total_value"]) < 1e-6
+
+def test_flat_evaluator_matches_sequential_snapshot(df_pandas: pd.DataFrame):
+    syms = list(df_pandas["symbol"].unique())
+    # deeper tree with the same symbols repeated across levels
+    leaf = {"name": "Leaf", "positions": [{"symbol": syms[0], "quantity": 3}]}
+    tree = {
+        "name": "Root",
+        "positions": [{"symbol": s, "quantity": 10 * (i + 1)} for i, s in enumerate(syms)],
+        "sub_portfolios": [
+            {"name": "A", "positions": [{"symbol": syms[-1], "quantity": 5}], "sub_portfolios": [leaf]},
+            {"name": "B", "positions": [{"symbol": syms[0], "quantity": -2}, {"symbol": "MISSING", "quantity": 1}]},
+        ],
+    }
+    from portfolio import aggregate_portfolio_flat
+
+    seq = aggregate_portfolio_sequential(tree, df_pandas, vol_window=20)
+    for shared in (False, True):
+        flat = aggregate_portfolio_flat(tree, df_pandas, vol_window=20, shared=shared)
+        assert json.dumps(flat, sort_keys=True) == json.dumps(seq, sort_keys=True)
+
+def test_metrics_cache_hits_and_invalidation(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    from portfolio import PositionMetricsCache, aggregate_portfolio_flat
+
+    cache = PositionMetricsCache(maxsize=2)
+    seq = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20)
+    first = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, cache=cache)
+    assert json.dumps(first, sort_keys=True) == json.dumps(seq, sort_keys=True)
+    assert cache.stats()["size"] <= 2
+
+    cache = PositionMetricsCache()
+    aggregate_portfolio_parallel(portfolio_dict, df_pandas, vol_window=20, cache=cache)
+    misses = cache.stats()["misses"]
+    again = aggregate_portfolio_flat(portfolio_dict, df_pandas, vol_window=20, cache=cache)
+    assert cache.stats()["misses"] == misses and cache.stats()["hits"] > 0
+    assert json.dumps(again, sort_keys=True) == json.dumps(seq, sort_keys=True)
+
+    sym = portfolio_dict["positions"][0]["symbol"]
+    cache.put(sym, 20, (1.0, 0.0, 0.0))
+    cache.invalidate(sym)
+    assert cache.get(sym, 20) is None
+
+def test_metrics_cache_keyed_on_data(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    from portfolio import PositionMetricsCache
+
+    # the same cache across a growing panel: appended prices must not be served stale
+    head = df_pandas.iloc[:-300]
+    cache = PositionMetricsCache()
+    aggregate_portfolio_sequential(portfolio_dict, head, vol_window=20, cache=cache)
+    grown = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, cache=cache)
+    fresh = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20)
+    assert json.dumps(grown, sort_keys=True) == json.dumps(fresh, sort_keys=True)
+
+    # valuing the grown panel as of the old end reuses the first run's entries
+    hits = cache.stats()["hits"]
+    again = aggregate_portfolio_parallel(portfolio_dict, df_pandas, vol_window=20, cache=cache,
+                                         as_of=head.index.max(), max_workers=2)
+    assert cache.stats()["hits"] > hits
+    old = aggregate_portfolio_sequential(portfolio_dict, head, vol_window=20)
+    assert json.dumps(again, sort_keys=True) == json.dumps(old, sort_keys=True)
+
+def test_incremental_portfolio_matches_full_recompute(df_pandas: pd.DataFrame):
+    from portfolio import IncrementalPortfolio
+
+    syms = list(df_pandas["symbol"].unique())
+    tree = {
+        "name": "Root",
+        "positions": [{"symbol": syms[0], "quantity": 10}],
+        "sub_portfolios": [
+            {"name": "A", "positions": [{"symbol": syms[0], "quantity": 5}]},
+            {"name": "B", "positions": [{"symbol": syms[-1], "quantity": 2}]},
+        ],
+    }
+    head, tail = df_pandas.iloc[:-50], df_pandas.iloc[-50:]
+    inc = IncrementalPortfolio(tree, head, vol_window=20)
+    assert json.dumps(inc.snapshot()) == json.dumps(aggregate_portfolio_sequential(tree, head, vol_window=20))
+
+    # only the symbol's holders and their ancestors are recomputed
+    one = tail[tail["symbol"] == syms[0]]
+    inc.update(one)
+    assert inc.recomputed_nodes == 2
+
+    got = inc.update(tail[tail["symbol"] != syms[0]])
+    full = aggregate_portfolio_sequential(tree, df_pandas, vol_window=20)
+
+    def walk(a, b):
+        for k in ("total_value", "aggregate_volatility", "max_drawdown"):
+            assert np.isclose(a[k], b[k], rtol=1e-9, equal_nan=True)
+        for pa, pb in zip(a["positions"], b["positions"]):
+            assert pa["symbol"] == pb["symbol"] and pa["value"] == pb["value"]
+            assert np.isclose(pa["volatility"], pb["volatility"], rtol=1e-9, equal_nan=True)
+        for sa, sb in zip(a.get("sub_portfolios", []), b.get("sub_portfolios", [])):
+            walk(sa, sb)
+    walk(got, full)
+
+def test_incremental_wide_tree_tick_by_tick(df_pandas: pd.DataFrame):
+    from portfolio import IncrementalPortfolio
+
+    syms = list(df_pandas["symbol"].unique())
+    rng = np.random.default_rng(3)
+    wide = [{"symbol": syms[k % len(syms)], "quantity": float(q)}
+            for k, q in enumerate(rng.normal(0, 40, 300).round(3))]  # shorts and fractions too
+    tree = {"name": "Root", "positions": wide[:100],
+            "sub_portfolios": [{"name": "A", "positions": wide[100:200],
+                                "sub_portfolios": [{"name": "A1", "positions": wide[200:]},
+                                                   {"name": "Unpriced", "positions": [{"symbol": "NONE", "quantity": 1}]}]}]}
+    panel = df_pandas.iloc[:1200]
+    inc = IncrementalPortfolio(tree, panel.iloc[:5], vol_window=20)  # NaN vols until 20 ticks arrive
+    for sym, px in zip(panel["symbol"].iloc[5:].tolist(), panel["price"].iloc[5:].tolist()):
+        inc.update([(sym, px)])
+    assert inc.recomputed_nodes == 3  # the holders (every priced node) and nothing else
+
+    full = aggregate_portfolio_sequential(tree, panel, vol_window=20)
+
+    def walk(a, b):
+        assert np.isclose(a["total_value"], b["total_value"], rtol=1e-12, atol=0.011, equal_nan=True)
+        for k in ("aggregate_volatility", "max_drawdown"):
+            assert np.isclose(a[k], b[k], rtol=1e-9, atol=1e-12, equal_nan=True)
+        assert np.array_equal([p["value"] for p in a["positions"]], [p["value"] for p in b["positions"]],
+                              equal_nan=True)
+        for sa, sb in zip(a.get("sub_portfolios", []), b.get("sub_portfolios", [])):
+            walk(sa, sb)
+    walk(inc.snapshot(), full)
+
+def test_compiled_portfolio_matches_sequential(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    from portfolio import compile_portfolio, evaluate_compiled
+
+    syms = list(df_pandas["symbol"].unique())
+    tree = dict(portfolio_dict)
+    tree["sub_portfolios"] = list(portfolio_dict.get("sub_portfolios", [])) + [
+        {"name": "Empty", "positions": []},
+        {"name": "Deep", "positions": [{"symbol": "MISSING", "quantity": 1}],
+         "sub_portfolios": [{"name": "Leaf", "positions": [{"symbol": syms[0], "quantity": -4}]}]},
+    ]
+    seq = aggregate_portfolio_sequential(tree, df_pandas, vol_window=20)
+    val = evaluate_compiled(compile_portfolio(tree), df_pandas, vol_window=20)
+    snap = val.to_snapshot()
+
+    def walk(a, b):
+        assert list(a) == list(b) and a["name"] == b["name"]
+        for k in ("total_value", "aggregate_volatility", "max_drawdown"):
+            assert np.isclose(a[k], b[k], rtol=1e-9, equal_nan=True)
+        for pa, pb in zip(a["positions"], b["positions"]):
+            for k in ("value", "volatility", "drawdown"):
+                assert np.isclose(pa[k], pb[k], rtol=1e-9, equal_nan=True)
+        assert len(a.get("sub_portfolios", [])) == len(b.get("sub_portfolios", []))
+        for sa, sb in zip(a.get("sub_portfolios", []), b.get("sub_portfolios", [])):
+            walk(sa, sb)
+    walk(snap, seq)
+
+def test_compiled_rounds_like_sequential(df_pandas: pd.DataFrame):
+    from portfolio import compile_portfolio, evaluate_compiled
+
+    # 4-decimal prices and fractional quantities: 109.7985 * 50 is 5489.925 in
+    # float, which round() takes to .93 and np.round to .92
+    syms = list(df_pandas["symbol"].unique())[:3]
+    panel = df_pandas[df_pandas["symbol"].isin(syms)].copy()
+    panel["price"] = panel["price"] * 1.000137 + 0.0003
+    last = panel.index.max() + pd.Timedelta("1s")
+    panel = pd.concat([panel, pd.DataFrame({"symbol": [syms[0]], "price": [109.7985]}, index=[last])])
+    panel.index.name = df_pandas.index.name
+    rng = np.random.default_rng(3)
+    tree = {"name": "Root", "positions": [{"symbol": syms[0], "quantity": 50}],
+            "sub_portfolios": [{"name": f"N{j}", "positions": [
+                {"symbol": str(s), "quantity": float(q)}
+                for s, q in zip(rng.choice(syms, 40), np.round(rng.uniform(-20, 80, 40), 3))]}
+                for j in range(3)]}
+
+    seq = aggregate_portfolio_sequential(tree, panel, vol_window=20)
+    snap = evaluate_compiled(compile_portfolio(tree), panel, vol_window=20).to_snapshot()
+    assert snap["positions"][0]["value"] == seq["positions"][0]["value"] == 5489.93
+
+    def walk(a, b):
+        assert a["total_value"] == b["total_value"]
+        assert [p["value"] for p in a["positions"]] == [p["value"] for p in b["positions"]]
+        for sa, sb in zip(a.get("sub_portfolios", []), b.get("sub_portfolios", [])):
+            walk(sa, sb)
+    walk(snap, seq)
+
+def test_as_of_valuation_matches_truncated_panel(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    from portfolio import aggregate_portfolio_flat, aggregate_portfolio_as_of
+
+    ts = df_pandas.index.sort_values()
+    t = ts[len(ts) // 2]
+    expected = aggregate_portfolio_sequential(portfolio_dict, df_pandas[df_pandas.index <= t], vol_window=20)
+    got = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, as_of=t)
+    assert json.dumps(got, sort_keys=True) == json.dumps(expected, sort_keys=True)
+    for shared in (False, True):
+        par = aggregate_portfolio_parallel(portfolio_dict, df_pandas, vol_window=20, shared=shared, as_of=str(t))
+        flat = aggregate_portfolio_flat(portfolio_dict, df_pandas, vol_window=20, shared=shared, as_of=t)
+        assert par["total_value"] == expected["total_value"] == flat["total_value"]
+
+    # a batch of timestamps: one snapshot each, same bits as the scalar path
+    times = [ts[0] - pd.Timedelta("1s"), ts[5], ts[100], t, ts[-1]]
+    batch = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, as_of=times)
+    ref = [aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, as_of=when) for when in times]
+    assert json.dumps(batch, sort_keys=True) == json.dumps(ref, sort_keys=True)
+    assert aggregate_portfolio_as_of(portfolio_dict, df_pandas, times[:3])[2].total_value[0] == batch[2]["total_value"]
+
+    # batches leave the cache alone: one entry per (symbol, timestamp) would only evict scalar entries
+    from portfolio import PositionMetricsCache
+    cache = PositionMetricsCache()
+    cached = aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, as_of=times, cache=cache)
+    assert json.dumps(cached, sort_keys=True) == json.dumps(batch, sort_keys=True)
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+def test_every_aggregator_accepts_a_batch_as_of(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    import pytest
+    from portfolio import (aggregate_portfolio_flat, build_price_index, compile_portfolio,
+                           evaluate_compiled, risk_table)
+    from workers import WorkerPool
+
+    ts = df_pandas.index.sort_values()
+    times = [ts[50], ts[len(ts) // 2], ts[-1]]
+    expected = [aggregate_portfolio_sequential(portfolio_dict, df_pandas, vol_window=20, as_of=t) for t in times]
+    with WorkerPool(max_workers=2) as pool:
+        for shared in (False, True):
+            for fn in (aggregate_portfolio_parallel, aggregate_portfolio_flat):
+                got = fn(portfolio_dict, df_pandas, vol_window=20, shared=shared, pool=pool, as_of=times)
+                assert json.dumps(got, sort_keys=True) == json.dumps(expected, sort_keys=True)
+    vals = evaluate_compiled(compile_portfolio(portfolio_dict), df_pandas, vol_window=20, as_of=times)
+    assert [v.to_snapshot()["total_value"] for v in vals] == [e["total_value"] for e in expected]
+
+    # below the batch entry points a list is an error, not a valuation at its first entry
+    with pytest.raises(TypeError):
+        risk_table(build_price_index(df_pandas), vol_window=20, as_of=times)
+
+def test_risk_table_matches_per_series_helpers(df_pandas: pd.DataFrame):
+    from portfolio import build_price_index, risk_table, _rolling_vol_pct, _max_drawdown_pct
+
+    # ragged histories: drop most rows of one symbol
+    syms = list(df_pandas["symbol"].unique())
+    ragged = df_pandas[(df_pandas["symbol"] != syms[0]) | (np.arange(len(df_pandas)) % 7 == 0)]
+    index = build_price_index(ragged)
+    for max_cells in (1 << 24, 50):  # one block / one column per block
+        table = risk_table(index, syms + ["MISSING"], vol_window=20, max_cells=max_cells)
+        for sym in syms:
+            s = index.series(sym)
+            last, vol, dd = table.metrics(sym)
+            assert last == s.iloc[-1]
+            assert np.isclose(vol, _rolling_vol_pct(s, 20), rtol=1e-9)
+            assert dd == _max_drawdown_pct(s)
+        assert np.isnan(table.metrics("MISSING")).all()
+    assert list(table.to_frame().columns) == ["last", "volatility", "drawdown"]
+
+    short = risk_table(index, syms, vol_window=20, as_of=ragged.index.min())
+    assert np.isnan(short.volatility).all() and (short.drawdown == 0).all()
@@ -0,0 +1,31 @@
+# tests/test_profiling.py
+import numpy as np
+import pandas as pd
+import parallel
+from profiling import profile_stage, profiled
+from reporting import profiles_to_frame, write_reports
+from workers import WorkerPool
+
+def test_profile_stage_records_workers_and_peak(df_pandas: pd.DataFrame, tmp_path):
+    small = df_pandas.groupby("symbol", group_keys=False).head(500)
+    with WorkerPool(max_workers=2) as pool:
+        with profile_stage("multiprocessing", "pandas", pool=pool) as prof:
+            parallel.compute_multiprocessing(small, library="pandas", pool=pool)
+        assert pool.task_sink is None  # restored on exit
+
+    assert prof.seconds > 0 and prof.cpu_seconds > 0
+    assert prof.peak_rss_mb >= prof.rss_mb_start
+    assert len(prof.tasks) == small["symbol"].nunique()
+    assert sum(w["tasks"] for w in prof.worker_summary().values()) == len(prof.tasks)
+
+    @profiled("alloc", trace_allocations=True, sample_interval=None)
+    def alloc():
+        return np.ones(1_000_000)
+
+    alloc()
+    assert alloc.last_profile.top_allocations
+
+    perf_df = profiles_to_frame([prof, alloc.last_profile])
+    write_reports(perf_df, tmp_path / "s.csv", tmp_path / "r.md", details=[prof, alloc.last_profile])
+    assert list(pd.read_csv(tmp_path / "s.csv")["section"]) == ["multiprocessing", "alloc"]
+    assert "## alloc" in (tmp_path / "r.md").read_text()
@@ -0,0 +1,48 @@
+# tests/test_replay.py
+import json
+import pandas as pd
+import pytest
+from portfolio import IncrementalPortfolio
+from replay import replay
+from streaming import StreamingMetrics
+
+@pytest.mark.parametrize("transport", ["queue", "socket"])
+def test_replay_updates_match_direct_path(df_pandas: pd.DataFrame, portfolio_dict: dict, transport):
+    res = replay(df_pandas, portfolio_dict, transport=transport, warmup_rows=300, limit=1500)
+    assert res.ticks == 1500 and (res.latencies_ns > 0).all() and (res.backlog >= 0).all()
+
+    direct = IncrementalPortfolio(portfolio_dict, df_pandas.iloc[:300])
+    direct.update(df_pandas.iloc[300:1800])
+    assert json.dumps(res.portfolio.snapshot(), sort_keys=True) == json.dumps(direct.snapshot(), sort_keys=True)
+
+    eng = StreamingMetrics(20)
+    eng.update_many(df_pandas["symbol"].iloc[:1800].tolist(), df_pandas["price"].iloc[:1800].tolist())
+    sym, px = df_pandas["symbol"].iloc[1800], df_pandas["price"].iloc[1800]
+    assert res.metrics.update(sym, px) == pytest.approx(eng.update(sym, px), nan_ok=True)
+
+    s = res.summary()
+    assert s["p50_us"] <= s["p99_us"] <= s["p99.9_us"] <= s["max_us"]
+    assert 0 < s["service_p50_us"] <= s["p99.9_us"] and s["capacity"] > 0
+    assert s["throughput"] > 0 and res.histogram(bins=10)["count"].sum() == 1500
+
+def test_paced_replay_and_validation(df_pandas: pd.DataFrame):
+    res = replay(df_pandas, rate=20_000, limit=400)
+    assert res.rate == 20_000 and res.seconds >= 399 / 20_000
+    assert res.portfolio is None and res.throughput <= 20_000 * 1.05
+    with pytest.raises(ValueError):
+        replay(df_pandas, transport="pipe")
+    with pytest.raises(ValueError):
+        replay(df_pandas, {"name": "P", "positions": []}, limit=10)
+
+@pytest.mark.parametrize("transport", ["queue", "socket"])
+def test_producer_errors_reach_the_consumer(df_pandas: pd.DataFrame, transport, monkeypatch):
+    import replay as replay_mod
+    real = replay_mod._produce
+
+    def failing(send, n, *args):
+        real(send, 5, *args)  # a few ticks, then the producer dies
+        raise RuntimeError("feed lost")
+
+    monkeypatch.setattr(replay_mod, "_produce", failing)
+    with pytest.raises(RuntimeError, match="feed lost"):
+        replay(df_pandas, transport=transport, limit=50)
@@ -0,0 +1,123 @@
+# tests/test_result_cache.py
+import importlib
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+import pandas as pd
+import polars as pl
+import parallel
+import result_cache
+from metrics import rolling_pandas, rolling_polars
+from result_cache import ResultCache, code_version, file_fingerprint, frame_fingerprint
+
+def test_hit_skips_compute_and_round_trips(df_pandas: pd.DataFrame, df_polars: pl.DataFrame, tmp_path):
+    cache = ResultCache(tmp_path / "rc")
+    calls = []
+
+    def counted(df, window=20):
+        calls.append(window)
+        return rolling_pandas(df, window)
+
+    a = cache.call(counted, df_pandas, window=20)
+    b = cache.call(counted, df_pandas, window=20)
+    assert calls == [20]
+    pd.testing.assert_frame_equal(a, b)
+    cache.call(counted, df_pandas, window=5)
+    assert calls == [20, 5]
+
+    p = cache.call(rolling_polars, df_polars, window=20)
+    assert cache.call(rolling_polars, df_polars, window=20).equals(p)
+    m = cache.call(parallel.compute_threading, df_pandas, library="pandas", pool=None)
+    assert len(m) == len(df_pandas)
+
+    s = cache.stats()
+    assert (s["hits"], s["misses"], s["entries"]) == (2, 4, 4)
+    assert s["bytes_saved"] > 0 and s["size_bytes"] > 0
+
+    # a fresh instance reads the persisted index
+    again = ResultCache(tmp_path / "rc")
+    pd.testing.assert_frame_equal(again.call(counted, df_pandas, window=20), a)
+    assert calls == [20, 5] and again.stats()["hits"] == 1
+
+def test_fingerprints_and_size_bounded_eviction(df_pandas: pd.DataFrame, tmp_path):
+    small = df_pandas.head(500)
+    assert frame_fingerprint(small) == frame_fingerprint(small.copy())
+    changed = small.copy()
+    changed.iloc[0, changed.columns.get_loc("price")] += 1.0
+    assert frame_fingerprint(changed) != frame_fingerprint(small)
+
+    f = tmp_path / "md.csv"
+    f.write_text("timestamp,symbol,price\n")
+    fp = file_fingerprint(f)
+    f.write_text("timestamp,symbol,price\n2024-01-01 09:30:00,AAPL,1\n")
+    assert file_fingerprint(f) != fp
+
+    cache = ResultCache(tmp_path / "rc", max_bytes=1)
+    cache.call(rolling_pandas, small, window=5)
+    cache.call(rolling_pandas, small, window=10)
+    s = cache.stats()
+    assert s["evictions"] == 2 and s["entries"] == 0
+    assert [n for n in os.listdir(tmp_path / "rc") if n.endswith(".arrow")] == []
+
+def test_key_tracks_code_and_shared_index_merges(df_pandas: pd.DataFrame, tmp_path):
+    def f(df, window=20):
+        return rolling_pandas(df, window)
+    old = ResultCache.key(f, "data", {"window": 20})
+    old_code = code_version(f)
+
+    def f(df, window=20):  # same name, new body: must not hit the old result
+        return rolling_pandas(df, window).dropna()
+    assert code_version(f) != old_code and ResultCache.key(f, "data", {"window": 20}) != old
+    assert ResultCache.key(f, "data", {"window": 20}, version="2") != ResultCache.key(f, "data", {"window": 20})
+
+    # two writers on one directory (like two processes): neither drops the other's entries
+    small = df_pandas.head(500)
+    a, b = ResultCache(tmp_path / "rc"), ResultCache(tmp_path / "rc")
+    a.call(rolling_pandas, small, window=5)
+    b.call(rolling_pandas, small, window=10)
+    a.call(rolling_pandas, small, window=20)
+    assert ResultCache(tmp_path / "rc").stats()["entries"] == 3
+    assert not [n for n in os.listdir(tmp_path / "rc") if n.endswith(".tmp")]
+    b.clear()
+    assert ResultCache(tmp_path / "rc").stats()["entries"] == 0
+
+def test_key_tracks_helper_modules_and_reads_do_not_write(df_pandas: pd.DataFrame, tmp_path, monkeypatch):
+    # a helper module changes, the calling function's bytecode does not
+    (tmp_path / "rc_helper.py").write_text("def scale(x):\n    return x * 2\n")
+    (tmp_path / "rc_caller.py").write_text("import rc_helper\n\ndef run(df):\n"
+                                           "    return df.assign(price=rc_helper.scale(df['price']))\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import rc_caller
+    old = ResultCache.key(rc_caller.run, "data", {})
+    (tmp_path / "rc_helper.py").write_text("def scale(x):\n    return x * 3\n")
+    importlib.reload(sys.modules["rc_helper"])
+    assert ResultCache.key(rc_caller.run, "data", {}) != old
+    assert ResultCache.key(rolling_pandas, "data", {}) == ResultCache.key(rolling_pandas, "data", {})
+
+    cache = ResultCache(tmp_path / "rc")
+    small = df_pandas.head(200)
+    cache.call(rolling_pandas, small, window=5)
+    index = tmp_path / "rc" / "index.json"
+    before = (index.read_bytes(), index.stat().st_mtime_ns)
+    cache.call(rolling_pandas, small, window=5)
+    assert cache.stats()["hits"] == 1 and (index.read_bytes(), index.stat().st_mtime_ns) == before
+    cache.flush()
+    assert index.read_bytes() != before[0]
+
+@pytest.mark.skipif(result_cache.fcntl is None, reason="index lock needs fcntl")
+def test_concurrent_writers_keep_every_entry(df_pandas: pd.DataFrame, tmp_path):
+    small = df_pandas.head(50)
+    caches = [ResultCache(tmp_path / "rc") for _ in range(4)]
+
+    def store(k, cache):
+        for w in range(2, 12):
+            cache.call(rolling_pandas, small, window=w + 100 * k)
+
+    threads = [threading.Thread(target=store, args=(k, c)) for k, c in enumerate(caches)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert ResultCache(tmp_path / "rc").stats()["entries"] == 40
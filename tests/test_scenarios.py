@@ -0,0 +1,81 @@
+# tests/test_scenarios.py
+import numpy as np
+import pandas as pd
+import pytest
+from portfolio import build_price_index, compile_portfolio
+from scenarios import factor_shocks, historical_shocks, node_exposures, run_scenarios
+
+def _tree(syms):
+    return {
+        "name": "Root",
+        "positions": [{"symbol": s, "quantity": 10 * (i + 1)} for i, s in enumerate(syms)],
+        "sub_portfolios": [
+            {"name": "A", "positions": [{"symbol": syms[-1], "quantity": 5}],
+             "sub_portfolios": [{"name": "Leaf", "positions": [{"symbol": syms[0], "quantity": -3}]}]},
+            {"name": "B", "positions": [{"symbol": syms[0], "quantity": 2}, {"symbol": "MISSING", "quantity": 1}]},
+        ],
+    }
+
+def test_scenario_pnl_matches_brute_force_revaluation(df_pandas: pd.DataFrame):
+    syms = list(df_pandas["symbol"].unique())
+    c = compile_portfolio(_tree(syms))
+    index = build_price_index(df_pandas)
+    last = np.array([df_pandas.loc[df_pandas["symbol"] == s, "price"].iloc[-1] if s in syms else np.nan
+                     for s in c.symbols])
+    shocks = np.random.default_rng(0).normal(0.0, 0.02, size=(257, len(c.symbols)))
+
+    res = run_scenarios(c, shocks, index=index)
+    # brute force: revalue every position under every scenario, sum each subtree
+    subtree = {0: [0, 1, 2, 3], 1: [1, 2], 2: [2], 3: [3]}
+    for node, members in subtree.items():
+        pos = [j for k in members for j in range(c.pos_offsets[k], c.pos_offsets[k + 1])]
+        held = np.nan_to_num(last[c.pos_sym[pos]] * c.quantities[pos])
+        expect = (held * (1 + shocks[:, c.pos_sym[pos]])).sum(axis=1) - held.sum()
+        np.testing.assert_allclose(res.node_pnl(node), expect, rtol=1e-10, atol=1e-8)
+        assert np.isclose(res.base_value[node], held.sum())
+
+    chunked = run_scenarios(c, shocks, index=index, max_bytes=256)
+    np.testing.assert_array_equal(chunked.pnl, res.pnl)
+    sub = run_scenarios(c, pd.DataFrame(shocks, columns=c.symbols), index=index, nodes=["A", 3])
+    assert sub.names == ["A", "B"]
+    np.testing.assert_array_equal(sub.pnl, res.pnl[:, [1, 3]])
+    assert node_exposures(c, last).shape == (4, len(c.symbols))
+
+def test_var_es_and_shock_builders(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    index = build_price_index(df_pandas)
+    hist = historical_shocks(index, horizon=5)
+    assert not hist.isna().any().any() and len(hist) > 100
+    res = run_scenarios(portfolio_dict, hist, index=index)
+    summary = res.summary()
+    assert list(summary.columns) == ["base_value", "mean_pnl", "std_pnl", "worst_pnl",
+                                     "var_95", "es_95", "var_99", "es_99"]
+    assert (summary["es_99"] >= summary["var_99"]).all() and (summary["var_99"] >= summary["var_95"]).all()
+
+    root = res.node_pnl(0)
+    k = int(np.ceil(0.05 * len(root)))
+    worst = np.sort(root)[:k]
+    assert np.isclose(res.var(0.95)[0], -worst[-1]) and np.isclose(res.es(0.95)[0], -worst.mean())
+
+    loadings = pd.DataFrame({"mkt": [1.0, 1.2, 0.8]}, index=["AAPL", "MSFT", "SPY"])
+    fs = factor_shocks(np.array([[-0.1], [0.05]]), loadings)
+    assert list(fs.columns) == ["AAPL", "MSFT", "SPY"] and np.isclose(fs.loc[0, "MSFT"], -0.12)
+
+def test_shock_columns_must_match_portfolio_symbols(df_pandas: pd.DataFrame):
+    syms = list(df_pandas["symbol"].unique())
+    c = compile_portfolio(_tree(syms))
+    index = build_price_index(df_pandas)
+    shocks = pd.DataFrame(np.full((4, len(c.symbols)), 0.01), columns=c.symbols)
+
+    with pytest.raises(ValueError, match="TYPO"):
+        run_scenarios(c, shocks.rename(columns={syms[0]: "TYPO"}), index=index)
+    with pytest.warns(UserWarning, match=syms[-1]):
+        res = run_scenarios(c, shocks.drop(columns=[syms[-1]]), index=index)
+    assert np.isfinite(res.pnl).all()
+
+    # a portfolio holding some of the panel's symbols takes panel-wide shocks as they are
+    held = compile_portfolio({"name": "Root", "positions": [{"symbol": syms[0], "quantity": 10}]})
+    hist = historical_shocks(index)
+    res = run_scenarios(held, hist, index=index)
+    assert np.allclose(res.pnl[:, 0], hist[syms[0]].to_numpy() * res.base_value[0])
+    with pytest.raises(ValueError, match="TYPO"):
+        run_scenarios(held, hist.assign(TYPO=0.0), index=index)
@@ -0,0 +1,31 @@
+# tests/test_streaming.py
+import numpy as np
+import pandas as pd
+import polars as pl
+from metrics import rolling_pandas, rolling_polars
+from streaming import StreamingMetrics
+
+def test_streaming_matches_batch_pandas(df_pandas: pd.DataFrame):
+    small = df_pandas.groupby("symbol", group_keys=False).head(3000)
+    batch = rolling_pandas(small, window=20)
+
+    eng = StreamingMetrics(window=20, resync_every=256)
+    # feed as several micro-batches plus single ticks to exercise carried state
+    parts = [eng.update_batch(small.iloc[:1000]), eng.update_batch(small.iloc[1000:-5])]
+    ticks = [eng.update(s, p) for s, p in zip(small["symbol"].iloc[-5:], small["price"].iloc[-5:])]
+    streamed = pd.concat(parts)
+
+    for c in ["ret", "ma", "std", "sharpe"]:
+        got = np.concatenate([streamed[c].to_numpy(), [t[c] for t in ticks]])
+        assert np.allclose(got, batch[c].to_numpy(), rtol=1e-8, atol=1e-12, equal_nan=True)
+
+def test_streaming_batch_polars(df_polars: pl.DataFrame):
+    small = df_polars.sort(["symbol", "timestamp"]).group_by("symbol", maintain_order=True).head(500)
+    batch = rolling_polars(small, window=10)
+    streamed = StreamingMetrics(window=10).update_batch(small)
+
+    assert isinstance(streamed, pl.DataFrame)
+    for c in ["ret", "ma", "std", "sharpe"]:
+        a = streamed[c].fill_null(np.nan).to_numpy()
+        b = batch[c].fill_null(np.nan).to_numpy()
+        assert np.allclose(a, b, rtol=1e-8, atol=1e-12, equal_nan=True)
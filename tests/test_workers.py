@@ -0,0 +1,49 @@
+# tests/test_workers.py
+import threading
+import time
+import numpy as np
+import pandas as pd
+import parallel
+from portfolio import aggregate_portfolio_sequential, aggregate_portfolio_parallel
+from workers import WorkerPool, thread_executor
+
+def test_pool_reused_across_entry_points(df_pandas: pd.DataFrame, portfolio_dict: dict):
+    small = df_pandas.groupby("symbol", group_keys=False).head(500).copy()
+
+    with WorkerPool(max_workers=2) as pool:
+        assert pool.processes_started == 0
+        pool.warm_up()
+        executor = pool.processes
+        started = pool.processes_started
+        assert started == 2
+
+        thr = parallel.compute_threading(small, library="pandas", window=20, pool=pool)
+        pro = parallel.compute_multiprocessing(small, library="pandas", window=20, pool=pool)
+        snap = aggregate_portfolio_parallel(portfolio_dict, small, vol_window=20, pool=pool)
+
+        # the same executor and workers served every call: nothing was respawned
+        assert pool.processes is executor
+        assert pool.processes_started == started
+    assert pool.processes_started == 0  # closed
+
+    assert len(thr) == len(pro) == len(small)
+    seq = aggregate_portfolio_sequential(portfolio_dict, small, vol_window=20)
+    assert abs(seq["total_value"] - snap["total_value"]) < 1e-6
+    assert np.isfinite(snap["aggregate_volatility"])
+
+def test_executor_cap_limits_concurrency():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def task(_):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return _
+
+    with WorkerPool(max_workers=2, max_threads=8) as pool:
+        with thread_executor(pool, max_workers=2) as ex:
+            assert list(ex.map(task, range(20), chunksize=3)) == list(range(20))
+    assert peak[0] == 2
@@ -0,0 +1,240 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, CancelledError, wait
+from contextlib import contextmanager
+import importlib
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Modules every worker needs; imported once per worker instead of per task.
+# polars only goes into pools that run polars jobs (POLARS_PRELOAD, preload_for).
+DEFAULT_PRELOAD = ("numpy", "pandas", "shared_panel", "parallel", "portfolio")
+POLARS_PRELOAD = DEFAULT_PRELOAD + ("polars",)
+
+
+def preload_for(library: str) -> Tuple[str, ...]:
+    """Preload list for a pool running `library` jobs ("pandas", "polars", "polars-lazy")."""
+    return POLARS_PRELOAD if library.startswith("polars") else DEFAULT_PRELOAD
+
+
+def default_context():
+    """
+    Start method for process pools. fork is unsafe once polars has started its
+    thread pool in the parent (children can deadlock), so POSIX uses forkserver:
+    the server imports the preload list once and every worker is forked from it.
+    """
+    if sys.platform == "win32":
+        return mp.get_context("spawn")
+    return mp.get_context("forkserver")
+
+
+def _init_worker(preload: Iterable[str]):
+    for name in preload:
+        importlib.import_module(name)
+
+
+def _ping(delay: float = 0.0) -> int:
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _timed_call(fn, args, kwargs):
+    start = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timing = {"task": getattr(fn, "__qualname__", repr(fn)), "pid": os.getpid(),
+              "thread": threading.get_ident(), "start": start, "seconds": time.perf_counter() - t0}
+    return result, timing
+
+
+class _TimedExecutor:
+    """
+    Executor proxy that runs each task through _timed_call and appends its
+    timing dict to `sink`; callers see the plain result.
+    """
+
+    def __init__(self, executor, sink: List[Dict[str, Any]]):
+        self._executor = executor
+        self._sink = sink
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        outer: Future = Future()
+        outer.set_running_or_notify_cancel()
+
+        def _done(inner: Future):
+            if inner.cancelled():
+                outer.set_exception(CancelledError())
+            elif inner.exception() is not None:
+                outer.set_exception(inner.exception())
+            else:
+                result, timing = inner.result()
+                self._sink.append(timing)
+                outer.set_result(result)
+
+        self._executor.submit(_timed_call, fn, args, kwargs).add_done_callback(_done)
+        return outer
+
+    def map(self, fn, *iterables, **_):
+        futs = [self.submit(fn, *args) for args in zip(*iterables)]
+        return (f.result() for f in futs)
+
+    def shutdown(self, *args, **kwargs):
+        self._executor.shutdown(*args, **kwargs)
+
+
+def _call_chunk(fn, chunk):
+    return [fn(*args) for args in chunk]
+
+
+class _CappedExecutor:
+    """
+    Executor proxy that keeps at most `limit` tasks submitted at once, so a
+    caller can use fewer workers than a shared pool has; `submit` blocks while
+    all slots are taken. `map` sends `chunksize` calls per task, like
+    ProcessPoolExecutor.map.
+    """
+
+    def __init__(self, executor, limit: int):
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max(1, limit))
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            fut = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def map(self, fn, *iterables, chunksize: int = 1, **_):
+        calls = list(zip(*iterables))
+        futs = [self.submit(_call_chunk, fn, calls[i:i + chunksize]) for i in range(0, len(calls), chunksize)]
+        return (r for f in futs for r in f.result())
+
+    def shutdown(self, *args, **kwargs):
+        self._executor.shutdown(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    Long-lived thread and process executors shared by compute_threading,
+    compute_multiprocessing and aggregate_portfolio_parallel.
+
+    Create one per service process, optionally `warm_up()`, pass it as `pool=`
+    to each call, and `close()` (or use as a context manager) at shutdown.
+    Executors are created lazily, so a pool that is only used for threads never
+    starts any processes.
+
+    While `task_sink` is a list, tasks submitted through `threads`/`processes`
+    are timed in the worker and their timing dicts (task, pid, thread, start,
+    seconds) are appended to it; see profiling.profile_stage.
+    """
+
+    def __init__(self, max_workers: int | None = None, max_threads: int | None = None,
+                 preload: Iterable[str] = DEFAULT_PRELOAD, mp_context=None):
+        self.max_workers = max_workers or mp.cpu_count()
+        self.max_threads = max_threads or min(32, (os.cpu_count() or 1) + 4)  # ThreadPoolExecutor's default
+        self.preload = tuple(preload)
+        self.mp_context = mp_context or default_context()
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+        self._processes_started = 0
+        self.task_sink: List[Dict[str, Any]] | None = None
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.max_threads)
+        return self._threads
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            if self.mp_context.get_start_method() == "forkserver":
+                self.mp_context.set_forkserver_preload(list(self.preload))
+            self._processes = ProcessPoolExecutor(self.max_workers, mp_context=self.mp_context,
+                                                  initializer=_init_worker, initargs=(self.preload,))
+        return self._processes
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        if self.task_sink is not None:
+            return _TimedExecutor(self._thread_pool(), self.task_sink)
+        return self._thread_pool()
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        self._processes_started = max(self._processes_started, 1)  # the first submit starts a worker
+        if self.task_sink is not None:
+            return _TimedExecutor(self._process_pool(), self.task_sink)
+        return self._process_pool()
+
+    @property
+    def processes_started(self) -> int:
+        """
+        Worker processes this pool has started: 0 before the process executor
+        is used, max_workers after warm_up(), at least 1 once tasks have been
+        handed to it (the executor spawns more on demand).
+        """
+        return self._processes_started
+
+    def warm_up(self, processes: bool = True, threads: bool = True) -> List[int]:
+        """Start every worker now so the first real request does not pay spawn/import cost."""
+        if threads:
+            ex = self._thread_pool()
+            wait([ex.submit(_ping) for _ in range(self.max_threads)])
+        pids: List[int] = []
+        if processes:
+            # tasks block briefly so each one lands on a different worker
+            futs = [self._process_pool().submit(_ping, 0.05) for _ in range(self.max_workers)]
+            pids = sorted({f.result() for f in futs})
+            self._processes_started = self.max_workers  # max_workers tasks at once spawn them all
+        return pids
+
+    def close(self, wait: bool = True):
+        if self._threads is not None:
+            self._threads.shutdown(wait=wait)
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
+            self._processes = None
+            self._processes_started = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def thread_executor(pool: WorkerPool | None = None,
+                    max_workers: int | None = None) -> Iterator[ThreadPoolExecutor]:
+    """
+    The pool's thread executor, or a transient one torn down on exit. With
+    `max_workers`, at most that many threads run tasks at once.
+    """
+    if pool is not None:
+        ex = pool.threads
+        yield ex if max_workers is None or max_workers >= pool.max_threads else _CappedExecutor(ex, max_workers)
+        return
+    with ThreadPoolExecutor(max_workers) as executor:
+        yield executor
+
+
+@contextmanager
+def process_executor(pool: WorkerPool | None = None,
+                     max_workers: int | None = None) -> Iterator[ProcessPoolExecutor]:
+    """
+    The pool's process executor, or a transient one torn down on exit. With
+    `max_workers`, at most that many worker processes run tasks at once.
+    """
+    if pool is not None:
+        ex = pool.processes
+        yield ex if max_workers is None or max_workers >= pool.max_workers else _CappedExecutor(ex, max_workers)
+        return
+    with ProcessPoolExecutor(max_workers, mp_context=default_context()) as executor:
+        yield executor